@@ -1,7 +1,8 @@
+import argparse
+
 import pandas as pd
 
-# Load existing dataset
-df = pd.read_csv("tracks_with_mood.csv", low_memory=False)
+import catalogue
 
 # New Malayalam songs as a list of dictionaries
 malayalam_songs = [
@@ -11,12 +12,31 @@ malayalam_songs = [
      "duration_ms": 180000, "energy": 0.3, "valence": 0.2, "track_genre": "malayalam", "mood": "sad"}
 ]
 
-# Convert to DataFrame
-malayalam_df = pd.DataFrame(malayalam_songs)
 
-# Concatenate with existing dataset
-df = pd.concat([df, malayalam_df], ignore_index=True)
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Add Malayalam songs to the catalogue. Songs already in it are skipped, "
+                    "so running this again is harmless.")
+    parser.add_argument("files", nargs="*",
+                        help="CSV/JSON files of tracks to add in one batch (default: the songs above)")
+    parser.add_argument("--catalogue", default=catalogue.CATALOGUE_PATH)
+    parser.add_argument("--csv", default="tracks_with_mood.csv",
+                        help="source CSV to append the new songs to ('' to leave it alone)")
+    args = parser.parse_args(argv)
+
+    if args.files:
+        songs = pd.concat([catalogue.read_tracks(path) for path in args.files], ignore_index=True)
+    else:
+        songs = pd.DataFrame(malayalam_songs)
+    if "track_genre" not in songs:
+        songs["track_genre"] = "malayalam"
+    songs["track_genre"] = songs["track_genre"].fillna("malayalam")
+
+    # One transaction: appended as a new catalogue segment, never a rewrite
+    report = catalogue.ingest(songs, args.catalogue, csv_path=args.csv or None)
+    print(f"Added {report['added']} Malayalam songs "
+          f"({report['existing']} already present, {report['duplicates']} repeated in the input, "
+          f"{report['invalid']} missing an id or energy/valence)")
 
-# Save updated CSV
-df.to_csv("tracks_with_mood.csv", index=False)
-print("Updated tracks_with_mood.csv with Malayalam songs")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+import metrics
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is turned away because its route is at capacity.
+    """
+
+    def __init__(self, name, retry_after=1):
+        super().__init__(f"{name} is at capacity")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimit:
+    """
+    Lets at most `limit` requests of one kind run at once and rejects the
+    rest immediately instead of queueing them, so a burst costs the surplus
+    callers a fast 503 rather than costing everyone latency.
+    """
+
+    def __init__(self, name, limit, retry_after=1):
+        self.name = name
+        self.limit = limit
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            admitted = self.in_flight < self.limit
+            if admitted:
+                self.in_flight += 1
+            else:
+                self.rejected += 1
+        if not admitted:
+            metrics.inc(f"{self.name}_shed")
+            raise Overloaded(self.name, self.retry_after)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def slot(self):
+        """
+        Holds one slot for the enclosed block. Raises Overloaded if none is free.
+        """
+        self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def __call__(self, view):
+        """
+        Decorator form of slot().
+        """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with self.slot():
+                return view(*args, **kwargs)
+        return wrapper
+
+    def until_closed(self, view):
+        """
+        Decorator for views whose Flask response streams its body after
+        they return (e.g. send_file): the slot is held until the server
+        closes the body, so slow downloads count against the limit.
+        """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            self._acquire()
+            try:
+                response = view(*args, **kwargs)
+            except BaseException:
+                self._release()
+                raise
+            released = []
+            def release():
+                # Whichever closes first: the response or its passed-through body
+                if not released:
+                    released.append(True)
+                    self._release()
+            response.call_on_close(release)
+            body = response.response
+            if response.direct_passthrough and hasattr(body, "close"):
+                # send_file's file wrapper goes to the server as is (so it
+                # can sendfile() it) and the server closes it, not the response
+                close_file = body.close
+                def close():
+                    try:
+                        close_file()
+                    finally:
+                        release()
+                body.close = close
+            return response
+        return wrapper
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "in_flight": self.in_flight, "rejected": self.rejected}
@@ -1,89 +1,628 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, abort, send_file, url_for
+from flask_sock import Sock
+import hmac
+import json
+import logging
+import multiprocessing
 import os
-from audio_logic import analyze_voice_input
-import real_emotion
+import threading
+import time
+import uuid
+import numpy as np
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import audio_logic
+from audio_logic import analyze_voice_bytes, analyze_voice_samples
+import catalogue
 import fusion_engine
+import real_emotion
+import stt
+from emotions import FaceEmotion
+from session_store import SessionStore
+from face_pool import FaceInferenceService, FaceUnavailable, FrameDropped
+from face_temporal import FaceStreamFilter, FaceTracker
+from voice_stream import VoiceStream
+import voice_features
+from result_cache import ResultCache
+from admission import ConcurrencyLimit, Overloaded
+from mood_timeline import MoodTimeline
+import metrics
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"))
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+sock = Sock(app)
+
+# Per-request stage timings go out as a Server-Timing header when switched on
+# for the whole server (TIMING_HEADER=1) or asked for with "X-Timing: 1"
+TIMING_HEADER = os.environ.get("TIMING_HEADER") == "1"
+
+# Per-session State (one entry per browser, idle sessions expire)
+SESSION_COOKIE = "mt_session"
+sessions = SessionStore(
+    ttl_seconds=int(os.environ.get("SESSION_TTL_SECONDS", 1800)),
+    max_sessions=int(os.environ.get("MAX_SESSIONS", 1000))
+)
+
+def current_session_id():
+    """
+    Returns the caller's session id, issuing a new one if the cookie is missing.
+    """
+    if 'session_id' not in g:
+        session_id = request.cookies.get(SESSION_COOKIE, "")
+        if not (0 < len(session_id) <= 64 and session_id.isalnum()):
+            session_id = uuid.uuid4().hex
+            g.new_session = True
+        g.session_id = session_id
+    return g.session_id
+
+# Face inference runs on worker processes, one FaceMesh each
+face_service = FaceInferenceService(
+    workers=int(os.environ.get("FACE_WORKERS", 0)) or None,
+    max_queue=int(os.environ.get("FACE_QUEUE_SIZE", 64))
+)
+FACE_TIMEOUT_SECONDS = float(os.environ.get("FACE_TIMEOUT_SECONDS", 2.0))
+
+# What the camera stream asks clients to send (see negotiate_face_stream)
+FACE_STREAM_MAX_WIDTH = int(os.environ.get("FACE_STREAM_MAX_WIDTH", 480))
+FACE_STREAM_QUALITY = float(os.environ.get("FACE_STREAM_QUALITY", 0.7))
+FACE_STREAM_INTERVAL_MS = int(os.environ.get("FACE_STREAM_INTERVAL_MS", 200))
+
+# Face inputs the server accepts (advertised on /capabilities): encoded frames,
+# optionally cropped to an ROI, or landmarks from a mesh run on the client
+FACE_LANDMARKS_FORMAT = "application/x-landmarks-f16"
+FACE_FORMATS = ("image/jpeg", "image/png", FACE_LANDMARKS_FORMAT)
+
+# Voice streams are cheapest at this rate: the features do not need more
+VOICE_PREFERRED_RATE = 16000
+
+# Retried uploads and a still camera send byte-identical inputs; their
+# analysis is looked up by content hash instead of being run again.
+# RESULT_CACHE_DIR adds a disk tier shared by all workers on the host.
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 512))
+RESULT_CACHE_TTL_SECONDS = float(os.environ.get("RESULT_CACHE_TTL_SECONDS", 600))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR") or None
+face_cache = ResultCache("face", RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_DIR)
+voice_cache = ResultCache("voice", RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_DIR)
+
+# Every face reading and fused voice answer is kept for the therapist's
+# history; writes are batched in the background (see mood_timeline.py)
+timeline = MoodTimeline(os.environ.get("MOOD_TIMELINE_DB", "mood_timeline.db"))
+
+# Requests beyond these run limits get an immediate 503 with Retry-After
+# instead of waiting behind the ones in progress
+def face_stream_capacity():
+    """
+    Camera sockets allowed at once. Under gunicorn (WEB_THREADS set) each
+    socket holds a worker thread for its whole life, so at most half of the
+    threads go to sockets (a quarter by default) and HTTP keeps the rest.
+    """
+    threads = int(os.environ.get("WEB_THREADS") or 0)
+    if not threads:
+        return int(os.environ.get("FACE_STREAM_MAX_CONCURRENT", 64))
+    limit = int(os.environ.get("FACE_STREAM_MAX_CONCURRENT", max(1, threads // 4)))
+    if limit > threads // 2:
+        logger.warning("FACE_STREAM_MAX_CONCURRENT=%d would take most of the %d threads; using %d",
+                       limit, threads, max(1, threads // 2))
+        limit = max(1, threads // 2)
+    return limit
+
+face_limit = ConcurrencyLimit("face", int(os.environ.get("FACE_MAX_CONCURRENT", 16)))
+face_stream_limit = ConcurrencyLimit("face_stream", face_stream_capacity())
+voice_limit = ConcurrencyLimit("voice", int(os.environ.get("VOICE_MAX_CONCURRENT", 4)))
+song_limit = ConcurrencyLimit("song", int(os.environ.get("SONG_MAX_CONCURRENT", 32)))
+
+for limit in (face_limit, face_stream_limit, voice_limit, song_limit):
+    metrics.register_gauge(f"{limit.name}_admission", limit.stats)
+metrics.register_gauge("face_pool", face_service.stats)
+metrics.register_gauge("face_cache", face_cache.stats)
+metrics.register_gauge("voice_cache", voice_cache.stats)
+metrics.register_gauge("mood_timeline", timeline.stats)
+metrics.register_gauge("sessions", lambda: len(sessions))
+
+@app.before_request
+def start_timing():
+    if TIMING_HEADER or request.headers.get("X-Timing") == "1":
+        g.timing_token = metrics.begin_request()
+
+@app.after_request
+def set_session_cookie(response):
+    if g.get('new_session'):
+        response.set_cookie(SESSION_COOKIE, g.session_id, httponly=True, samesite='Lax')
+    return response
+
+@app.after_request
+def add_server_timing(response):
+    token = g.pop('timing_token', None)
+    if token is not None:
+        spans = metrics.end_request(token)
+        if spans:
+            response.headers['Server-Timing'] = metrics.server_timing(spans)
+    return response
 
-# Config
-UPLOAD_FOLDER = 'temp_audio'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+@app.errorhandler(Overloaded)
+def shed_load(e):
+    response = jsonify({"error": "Server busy, please try again", "route": e.name})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
 
-# Global State
-current_state = {
-    "face_emotion": "Neutral",
-    "voice_emotion": "Neutral",
-    "last_spoken_text": "",
-    "final_mood": "Neutral"
-}
+@app.route('/metrics')
+def metrics_endpoint():
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# --- Warm-up and health ---
+# Models and native libraries load on first use unless warmed up first.
+# WARM_UP=1 warms up while this module is imported, i.e. before a WSGI worker
+# accepts requests; WARM_UP=background does it on a thread while /readyz
+# answers 503. With the default (0) the server is ready at once, but cold.
+WARM_UP = os.environ.get("WARM_UP", "0")
+FACE_WARMUP_TIMEOUT_SECONDS = float(os.environ.get("FACE_WARMUP_TIMEOUT_SECONDS", 120.0))
+STARTED_AT = time.monotonic()
+
+warmup_state = {"status": "cold", "seconds": None, "error": None}
+_warmup_lock = threading.Lock()
+
+def warm_up():
+    """
+    Preloads everything the first requests would otherwise wait for: the
+    face workers and their FaceMesh graphs, the speech backend, the audio
+    decoder and feature code paths, and the fusion table.
+    Returns True once warm; failures are logged and reported by /readyz.
+    """
+    with _warmup_lock:
+        if warmup_state["status"] == "ready":
+            return True
+        warmup_state.update(status="warming", error=None)
+        started = time.perf_counter()
+        try:
+            with metrics.span("warmup_voice"):
+                audio_logic.extract_features(np.zeros(16000, dtype=np.float32), 16000)
+                stt.get_backend()
+            with metrics.span("warmup_fusion"):
+                fusion_engine.fuse_emotions(FaceEmotion.NEUTRAL, "Neutral")
+            with metrics.span("warmup_face"):
+                face_service.warm_up(timeout=FACE_WARMUP_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.exception("Warm-up failed")
+            warmup_state.update(status="failed", error=str(e))
+            return False
+        warmup_state.update(status="ready", seconds=round(time.perf_counter() - started, 3))
+        logger.info("Warm-up finished in %.2fs", warmup_state["seconds"])
+        return True
+
+def start_warm_up():
+    warmup_state["status"] = "warming"
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+@app.route('/healthz')
+def healthz():
+    # Liveness: the process is up and serving requests
+    return jsonify({"status": "alive", "uptime_seconds": round(time.monotonic() - STARTED_AT, 1)})
+
+@app.route('/readyz')
+def readyz():
+    # Readiness: warm-up finished (or was not asked for)
+    state = dict(warmup_state, warm_up=WARM_UP)
+    ready = state["status"] == "ready" or (state["status"] == "cold" and WARM_UP == "0")
+    return jsonify(state), 200 if ready else 503
 
 @app.route('/')
 def index():
+    current_session_id()
     return render_template('index.html')
 
+@app.route('/capabilities')
+def capabilities():
+    """
+    The input formats this server accepts, so clients can send the smallest.
+    """
+    return jsonify({
+        "face": {
+            "formats": list(FACE_FORMATS),
+            "max_width": FACE_STREAM_MAX_WIDTH,
+            "quality": FACE_STREAM_QUALITY,
+            "interval_ms": FACE_STREAM_INTERVAL_MS,
+            # A frame may be a crop: send roi="x,y,width,height" in normalized frame coordinates
+            "roi": True,
+            "landmarks": {
+                "dtype": "float16",
+                "byte_order": "little",
+                "points": [real_emotion.NUM_LANDMARKS, len(real_emotion.KEY_LANDMARKS)],
+                "key_landmarks": real_emotion.KEY_LANDMARKS.tolist()
+            }
+        },
+        "voice": {
+            "formats": voice_features.accepted_formats(),
+            "preferred_rate": VOICE_PREFERRED_RATE,
+            "stream": {"encoding": "pcm_s16le", "channels": 1, "min_rate": 8000, "max_rate": 96000}
+        }
+    })
+
 # --- ROUTE FOR MEMBER 1 (Camera) ---
 # Updated to receive actual image data from frontend loop
 @app.route('/detect_face', methods=['POST'])
+@face_limit
 def detect_face():
-    if 'face_image' not in request.files:
+    # A frame (face_image) or the client's own landmarks (landmarks), read
+    # straight from the upload stream; nothing is written to disk
+    if 'landmarks' in request.files:
+        payload, landmarks = request.files['landmarks'].read(), True
+    elif 'face_image' in request.files:
+        payload, landmarks = request.files['face_image'].read(), False
+    else:
         return jsonify({"error": "No face image"}), 400
-    
-    file = request.files['face_image']
-    filepath = os.path.join(UPLOAD_FOLDER, "face_capture.jpg")
-    file.save(filepath)
 
-    # Analyze face
-    emotion = real_emotion.analyze_face(filepath)
+    session_id = current_session_id()
+    try:
+        roi = parse_roi(request.form.get('roi'))
+        status, emotion, _ = analyze_frame(session_id, payload, roi, landmarks)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Where the face is, so clients may send just that region (as roi) next time
+    tracker = sessions.get(session_id).face_tracker
+    return jsonify({"status": status, "emotion": emotion,
+                    "face_box": tracker.bbox if tracker is not None else None})
+
+def parse_roi(text):
+    """
+    Parses "x,y,width,height" (normalized frame coordinates) into a tuple.
+    Returns None if text is empty; raises ValueError if it is malformed.
+    """
+    if not text:
+        return None
+    roi = tuple(float(v) for v in text.split(","))
+    if len(roi) != 4:
+        raise ValueError("roi must be x,y,width,height")
+    x, y, width, height = roi
+    if not (0 <= x < 1 and 0 <= y < 1 and 0 < width <= 1 - x + 1e-6 and 0 < height <= 1 - y + 1e-6):
+        raise ValueError("roi must lie within the frame, in normalized coordinates")
+    return roi
+
+def analyze_frame(session_id, image_bytes, roi=None, landmarks=False):
+    """
+    Analyzes a camera frame for a session.
+    Returns (status, display emotion, face label).
+
+    Runs on the worker pool, through this session's temporal filter (skips
+    unchanged frames, smooths the features). If a newer frame from this browser
+    replaced this one, or the pool is saturated, answers with the last known emotion.
+    With landmarks=True, image_bytes is a landmark payload from the client,
+    scored right here. Raises ValueError for a malformed one.
+
+    Whole frames are searched around the session's last face position first
+    (see FaceTracker); frames the client already cropped to a roi are not.
+    """
+    state = sessions.get(session_id)
+    with state.lock:
+        if state.face_filter is None:
+            state.face_filter = FaceStreamFilter()
+            state.face_tracker = FaceTracker()
+        face_filter, tracker = state.face_filter, state.face_tracker
+
+    def infer(frame):
+        if landmarks:
+            reading = real_emotion.analyze_landmarks_bytes(frame)
+        else:
+            search = tracker.search_region() if roi is None else None
+            reading = face_cache.get_or_compute(
+                frame, f"{real_emotion.ANALYZER_VERSION}/{roi}/{search}",
+                lambda: face_service.infer(session_id, frame, roi, search, timeout=FACE_TIMEOUT_SECONDS))
+        tracker.update(reading)
+        return reading
+
+    try:
+        reading = face_filter.process(image_bytes, infer, encoded=not landmarks)
+    except (FrameDropped, FutureTimeout):
+        last = sessions.snapshot(session_id)
+        return "dropped", last['face_emotion'], last['face_label']
+    except (FaceUnavailable, BrokenProcessPool) as e:
+        # The pool restarts itself after a back-off (see face_pool.py)
+        logger.warning("Face workers unavailable: %s", e)
+        last = sessions.snapshot(session_id)
+        return "unavailable", last['face_emotion'], last['face_label']
     
-    # Update Global State
-    current_state['face_emotion'] = emotion
+    # Update this session's state: the label feeds fusion, the text is for display
+    emotion = str(reading)
+    sessions.update(session_id, face_emotion=emotion, face_label=reading.emotion)
+    timeline.record_face(session_id, reading.emotion.label)
+    return "success", emotion, reading.emotion
+
+def negotiate_face_stream(message):
+    """
+    Picks the format, frame size, JPEG quality and interval for a camera
+    stream from the client's JSON hello, never exceeding what the client
+    offered or what the server allows. The format is the first of the
+    client's "formats" the server accepts (JPEG if it lists none).
+    """
+    try:
+        hello = json.loads(message)
+    except ValueError:
+        hello = {}
+    if not isinstance(hello, dict):
+        hello = {}
+    width = int(hello.get("width") or FACE_STREAM_MAX_WIDTH)
+    height = int(hello.get("height") or 0)
+    scale = min(1.0, FACE_STREAM_MAX_WIDTH / max(width, 1))
+    offered = hello.get("formats")
+    offered = [f for f in offered if f in FACE_FORMATS] if isinstance(offered, list) else []
+    return {
+        "type": "config",
+        "format": offered[0] if offered else "image/jpeg",
+        "width": max(1, round(width * scale)),
+        "height": max(1, round(height * scale)) if height else None,
+        "quality": FACE_STREAM_QUALITY,
+        "interval_ms": FACE_STREAM_INTERVAL_MS
+    }
+
+# Persistent alternative to polling /detect_face. The client sends a JSON
+# "hello" with its camera size (and optionally the formats it can send), then
+# binary JPEG frames at the negotiated size, or landmark payloads; the server
+# pushes {"type": "emotion"} only when the face label changes.
+@sock.route('/ws/face')
+def face_stream(ws):
+    try:
+        with face_stream_limit.slot():
+            stream_face_frames(ws)
+    except Overloaded:
+        # 1013 "Try Again Later"; the page falls back to polling /detect_face
+        ws.close(reason=1013, message="Server busy")
 
-    return jsonify({"status": "success", "emotion": emotion})
+def stream_face_frames(ws):
+    session_id = current_session_id()
+    last_sent = None
+    face_format = "image/jpeg"
+
+    def configure(message):
+        config = negotiate_face_stream(message)
+        ws.send(json.dumps(config))
+        return config["format"]
+
+    while True:
+        message = ws.receive()
+        # Latest frame wins: skip anything that queued up while we were busy
+        newer = ws.receive(timeout=0)
+        while newer is not None:
+            if isinstance(message, str):
+                face_format = configure(message)
+            message = newer
+            newer = ws.receive(timeout=0)
+
+        if isinstance(message, str):
+            face_format = configure(message)
+            continue
+
+        try:
+            _, emotion, label = analyze_frame(session_id, message,
+                                              landmarks=face_format == FACE_LANDMARKS_FORMAT)
+        except ValueError as e:
+            ws.send(json.dumps({"type": "error", "error": str(e)}))
+            continue
+        if label != last_sent:
+            ws.send(json.dumps({"type": "emotion", "emotion": emotion}))
+            last_sent = label
+
+@app.route('/face_stats')
+def face_stats():
+    return jsonify(dict(face_service.stats(), cache=face_cache.stats()))
 
 @app.route('/update_face', methods=['POST'])
 def update_face():
     # Keep old route for backward compatibility if needed, or redirect logic
     data = request.json
-    current_state['face_emotion'] = data.get('emotion', 'Neutral')
+    emotion = data.get('emotion', 'Neutral')
+    session_id = current_session_id()
+    sessions.update(session_id, face_emotion=emotion, face_label=emotion)
+    timeline.record_face(session_id, str(emotion))
     return jsonify({"status": "updated"})
 
 # --- ROUTE FOR MEMBER 2 (Your Audio Logic) ---
 @app.route('/process_voice_answer', methods=['POST'])
+@voice_limit
 def process_voice_answer():
     if 'audio_data' not in request.files:
         return jsonify({"error": "No audio"}), 400
 
-    file = request.files['audio_data']
-    # Save as WAV (Make sure frontend sends WAV blob)
-    filepath = os.path.join(UPLOAD_FOLDER, "response.wav")
-    file.save(filepath)
+    # Frontend sends a WAV blob; it is decoded from memory
+    wav_bytes = request.files['audio_data'].read()
 
-    # 1. Analyze the Voice
-    analysis = analyze_voice_input(filepath)
-    
-    # 2. Update State
-    current_state['voice_emotion'] = analysis['emotion']
-    current_state['last_spoken_text'] = analysis['text']
-    
-    # 3. FUSION LOGIC (New Expert System)
-    # Get the latest face emotion from the global state
-    face_val = current_state['face_emotion']
+    # 1. Analyze the Voice (once per distinct recording; a failed
+    # transcription is not cached, so a retry gets another go)
+    analysis = voice_cache.get_or_compute(
+        wav_bytes, audio_logic.analyzer_version(),
+        lambda: analyze_voice_bytes(wav_bytes),
+        cacheable=lambda result: not result.get('stt_failed'))
+    return jsonify(respond_to_voice(current_session_id(), analysis))
+
+def respond_to_voice(session_id, analysis):
+    """
+    Fuses a voice analysis with the session's face emotion and builds the reply.
+    """
+    # 2. FUSION LOGIC (New Expert System)
+    # Read the face emotion and write the result under this session's lock,
+    # so a face frame arriving meanwhile cannot interleave with the update
+    state = sessions.get(session_id)
     voice_val = analysis['emotion']
-    
-    fusion_result = fusion_engine.fuse_emotions(face_val, voice_val)
-    
-    current_state['final_mood'] = fusion_result['final_mood']
-    
-    print(f"🗣️ User Said: '{analysis['text']}' | Fused Mood: {current_state['final_mood']}")
+    with state.lock:
+        face_val = state.data['face_label']
+        fusion_result = fusion_engine.fuse_emotions(face_val, voice_val)
+        state.data.update(
+            voice_emotion=voice_val,
+            last_spoken_text=analysis['text'],
+            final_mood=fusion_result['final_mood']
+        )
+    timeline.record_voice(session_id, getattr(face_val, "label", face_val), voice_val,
+                          fusion_result['final_mood'], fusion_result['confidence'],
+                          analysis['energy_score'], analysis['pitch_score'])
 
-    return jsonify({
+    logger.info("User Said: '%s' | Fused Mood: %s", analysis['text'], fusion_result['final_mood'])
+
+    # The client starts fetching the song while it renders the reply
+    track_id, track = recommend_track(state, fusion_result['final_mood'])
+    return {
         "bot_reply": f"I heard you say '{analysis['text']}'.",
-        "new_mood": current_state['final_mood'],
+        "new_mood": fusion_result['final_mood'],
         "confidence": fusion_result['confidence'],
-        "reasoning": fusion_result['reasoning']
-    })
+        "reasoning": fusion_result['reasoning'],
+        "track": track,
+        "track_url": url_for('song', track_id=track_id) if track_id else None
+    }
+
+# --- Mood history ---
+# A session's history as a downsampled timeline or a mood distribution.
+# since/until are epoch seconds and default to the whole session. Browsers
+# read their own session; therapists read any session by id, with the
+# THERAPIST_TOKEN as a bearer token (these routes answer 404 while it is unset).
+THERAPIST_TOKEN = os.environ.get("THERAPIST_TOKEN") or None
+
+def require_therapist():
+    if THERAPIST_TOKEN is None:
+        abort(404)
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), THERAPIST_TOKEN.encode()):
+        abort(401)
+
+def valid_session_id(session_id):
+    if not (0 < len(session_id) <= 64 and session_id.isalnum()):
+        abort(404)
+    return session_id
+
+def time_range_args():
+    try:
+        return tuple(float(request.args[key]) if request.args.get(key) else None
+                     for key in ('since', 'until'))
+    except ValueError:
+        abort(400)
+
+@app.route('/mood_timeline')
+def mood_timeline():
+    return session_timeline(current_session_id())
+
+@app.route('/mood_distribution')
+def mood_distribution():
+    return session_distribution(current_session_id())
+
+@app.route('/sessions/<session_id>/mood_timeline')
+def therapist_timeline(session_id):
+    require_therapist()
+    return session_timeline(valid_session_id(session_id))
+
+@app.route('/sessions/<session_id>/mood_distribution')
+def therapist_distribution(session_id):
+    require_therapist()
+    return session_distribution(valid_session_id(session_id))
+
+def session_timeline(session_id):
+    since, until = time_range_args()
+    buckets = request.args.get('buckets', 200, type=int)
+    return jsonify(timeline.timeline(session_id, since, until, buckets))
+
+def session_distribution(session_id):
+    since, until = time_range_args()
+    return jsonify(timeline.distribution(session_id, since, until))
+
+# --- Songs ---
+# Audio is streamed to the browser's <audio> player; the server never plays it.
+# send_file answers Range requests (seeking, resumed downloads) and
+# If-None-Match/If-Modified-Since, and hands the file to the WSGI server's
+# file wrapper, which uses sendfile() where the server supports it.
+DEFAULT_TRACK_ID = "default"
+SONG_MAX_AGE_SECONDS = int(os.environ.get("SONG_MAX_AGE_SECONDS", 86400))
+
+def song_path(track_id):
+    if track_id == DEFAULT_TRACK_ID:
+        return audio_logic.DEFAULT_SONG
+    return catalogue.track_path(track_id)
+
+def recommend_track(state, mood):
+    """
+    Picks a song for the mood that this session has not heard recently.
+    Returns (track id, track details), falling back to the default song
+    while no catalogue (or no audio for the picked track) is available.
+    """
+    with state.lock:
+        if state.recent_tracks is None:
+            state.recent_tracks = catalogue.RecentTracks()
+        recent = state.recent_tracks
+    try:
+        track = catalogue.pick(mood, recent=recent)
+    except Exception as e:
+        logger.error("Song selection failed: %s", e)
+        track = None
+
+    if track is not None and os.path.isfile(song_path(track['track_id'])):
+        details = {key: track[key] for key in ('track_id', 'track_name', 'artists', 'duration_ms')}
+        return track['track_id'], details
+    if os.path.isfile(song_path(DEFAULT_TRACK_ID)):
+        return DEFAULT_TRACK_ID, None
+    return None, None
+
+@app.route('/songs/<track_id>')
+@song_limit.until_closed
+def song(track_id):
+    # Track ids are alphanumeric (Spotify ids, "M001"), never paths
+    if not (0 < len(track_id) <= 64 and track_id.isalnum()):
+        abort(404)
+    path = os.path.abspath(song_path(track_id))
+    if not os.path.isfile(path):
+        abort(404)
+    # A track id always names the same recording, so browsers may keep it
+    return send_file(path, conditional=True, etag=True, max_age=SONG_MAX_AGE_SECONDS)
+
+# --- Streaming voice answers ---
+# The client starts a stream, posts raw 16-bit mono PCM chunks while the user
+# speaks (each reply carries a provisional emotion and whether the speaker has
+# stopped), then finishes it to get the same reply as /process_voice_answer.
+@app.route('/voice_stream/start', methods=['POST'])
+@voice_limit
+def voice_stream_start():
+    data = request.get_json(silent=True) or {}
+    try:
+        rate = int(data.get('sample_rate', 0))
+    except (TypeError, ValueError):
+        rate = 0
+    if not 8000 <= rate <= 96000:
+        return jsonify({"error": "sample_rate must be between 8000 and 96000"}), 400
+
+    state = sessions.get(current_session_id())
+    with state.lock:
+        state.voice_stream = VoiceStream(rate)
+    return jsonify({"status": "started"})
+
+@app.route('/voice_stream/chunk', methods=['POST'])
+def voice_stream_chunk():
+    stream = sessions.get(current_session_id()).voice_stream
+    if stream is None:
+        return jsonify({"error": "No voice stream"}), 409
+    return jsonify(stream.push_pcm16(request.get_data()))
+
+@app.route('/voice_stream/finish', methods=['POST'])
+def voice_stream_finish():
+    session_id = current_session_id()
+    state = sessions.get(session_id)
+    # Checked before the stream is taken, so a 503 leaves it for a retry
+    with voice_limit.slot():
+        with state.lock:
+            stream, state.voice_stream = state.voice_stream, None
+        if stream is None:
+            return jsonify({"error": "No voice stream"}), 409
+
+        analysis = analyze_voice_samples(stream.samples(), stream.rate, stream.pending_text())
+    return jsonify(respond_to_voice(session_id, analysis))
+
+# Spawned face workers import this module too (as __mp_main__ under
+# "python app.py"), and so does the debug reloader's watching process, which
+# never serves; only the serving process warms up.
+_serving = multiprocessing.parent_process() is None and (
+    __name__ != '__main__' or os.environ.get("WERKZEUG_RUN_MAIN") == "true")
+if _serving:
+    if WARM_UP == "1":
+        warm_up()
+    elif WARM_UP == "background":
+        start_warm_up()
 
+# Development server. In production run it under gunicorn instead (see
+# gunicorn.conf.py): gunicorn -c gunicorn.conf.py app:app
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
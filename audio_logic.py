@@ -1,13 +1,27 @@
+import logging
+import multiprocessing
 import os
-import librosa
-import numpy as np
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import speech_recognition as sr
-import pygame
-import sounddevice as sd
-from scipy.io.wavfile import write
+
+import catalogue
+import metrics
+import stt
+import voice_features
+
+logger = logging.getLogger(__name__)
 
 # --------------------- Voice Recording ---------------------
 def record_voice(filename="audio/test_voice.wav", duration=5, fs=44100):
+    # Fixed-length recording to a WAV file; mic_stream.listen() stops at the
+    # end of speech and hands back the samples instead
+    # Device-bound imports stay local so the server imports this module on headless nodes
+    import sounddevice as sd
+    from scipy.io.wavfile import write
+
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     print(f"Recording your voice for {duration} seconds...")
     recording = sd.rec(int(duration * fs), samplerate=fs, channels=1)
@@ -17,121 +31,177 @@ def record_voice(filename="audio/test_voice.wav", duration=5, fs=44100):
     return filename
 
 # --------------------- Voice Analysis ---------------------
-def analyze_voice_input(file_path):
-    result = {
+# Part of the result cache key (see app.py): bump when the analysis of a
+# given recording changes, so cached results from before are not reused
+ANALYZER_VERSION = "voice-1"
+
+def analyzer_version():
+    # Transcripts depend on the speech backend too
+    return f"{ANALYZER_VERSION}/{stt.get_backend().name}"
+
+# Feature extraction can run on spawned worker processes (VOICE_WORKERS=N), off
+# the request threads. It is one numpy pass of about a millisecond per 5 s clip,
+# mostly outside the GIL, so by default (0) it runs inline, which is cheaper
+# than shipping the samples to another process.
+VOICE_WORKERS = int(os.environ.get("VOICE_WORKERS", 0))
+_feature_pool = None
+_feature_pool_lock = threading.Lock()
+
+def extract_features(y, sr_rate):
+    global _feature_pool
+    if not VOICE_WORKERS:
+        return voice_features.extract_features(y, sr_rate)
+    with _feature_pool_lock:
+        if _feature_pool is None:
+            _feature_pool = ProcessPoolExecutor(
+                max_workers=VOICE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        pool = _feature_pool
+    try:
+        return pool.submit(voice_features.extract_features, y, sr_rate).result()
+    except BrokenProcessPool:
+        with _feature_pool_lock:
+            if _feature_pool is pool:
+                _feature_pool = None
+        raise
+
+def _empty_result():
+    return {
         "text": "(Voice Only)",
         "emotion": "Neutral",
         "energy_score": 0.0,
         "pitch_score": 0.0
     }
 
-    # --- Part A: Speech-to-Text (English + Malayalam) ---
-    recognizer = sr.Recognizer()
-    recognizer.energy_threshold = 300
-
+def analyze_voice_input(file_path):
     try:
-        with sr.AudioFile(file_path) as source:
-            audio_data = recognizer.record(source)
-            try:
-                text = recognizer.recognize_google(audio_data, language='en-US')
-                result['text'] = text
-                print(f">> USER SAID (English): {text}")
-            except sr.UnknownValueError:
-                try:
-                    text_ml = recognizer.recognize_google(audio_data, language='ml-IN')
-                    result['text'] = text_ml
-                    print(f">> USER SAID (Malayalam): {text_ml}")
-                except:
-                    print("   [ERROR] Could not understand Audio in English or Malayalam")
-            except sr.RequestError:
-                print("   [ERROR] No internet connection for speech recognition")
+        with metrics.span("voice_decode"):
+            y, sr_rate = voice_features.read_pcm(file_path)
     except Exception as e:
-        print(f"   [CRITICAL] Speech Recognition Crashed: {e}")
-
-    # --- Part B: Physics & Emotion Logic ---
+        logger.error("Could not decode audio: %s", e)
+        return _empty_result()
+    return analyze_voice_samples(y, sr_rate)
+
+def analyze_voice_bytes(wav_bytes):
+    """
+    Same as analyze_voice_input, for a recording held in memory: WAV, or
+    any other format voice_features.read_audio_bytes accepts.
+    """
     try:
-        y, sr_rate = librosa.load(file_path)
-
-        max_vol = np.max(np.abs(y))
-        y_clean = y[np.abs(y) > (0.25 * max_vol)]
-        if len(y_clean) == 0:
-            y_clean = y
+        with metrics.span("voice_decode"):
+            y, sr_rate = voice_features.read_audio_bytes(wav_bytes)
+    except Exception as e:
+        logger.error("Could not decode audio: %s", e)
+        return _empty_result()
+    return analyze_voice_samples(y, sr_rate)
+
+@metrics.timed("analyze_voice")
+def analyze_voice_samples(y, sr_rate, pending_text=None):
+    """
+    Analyzes mono float samples. pending_text may carry speech recognition
+    already started on these samples (see stt.start).
+    """
+    result = _empty_result()
 
-        rms = librosa.feature.rms(y=y_clean)
-        energy = float(np.mean(rms))
+    # --- Part A: Speech-to-Text (English + Malayalam) ---
+    # Both languages are recognized concurrently, in the background, while
+    # the physics below runs on this thread.
+    if pending_text is None:
+        try:
+            pending_text = stt.start(stt.audio_data_from_samples(y, sr_rate))
+        except Exception as e:
+            logger.error("Speech Recognition Crashed: %s", e)
 
-        zcr = librosa.feature.zero_crossing_rate(y=y_clean)
-        pitch_var = float(np.mean(zcr))
+    # --- Part B: Physics & Emotion Logic ---
+    try:
+        # Native-rate, single-pass energy/ZCR (see voice_features)
+        with metrics.span("voice_features"):
+            energy, pitch_var = extract_features(y, sr_rate)
 
         result['energy_score'] = energy
         result['pitch_score'] = pitch_var
 
         # --- Expert Rules for Emotion ---
-        if energy < 0.015:
-            result['emotion'] = "Neutral"
-        elif energy > 0.08:
-            result['emotion'] = "Excited" if pitch_var > 0.05 else "Angry"
-        elif energy > 0.02:
-            result['emotion'] = "Happy" if pitch_var > 0.06 else "Neutral"
-        else:
-            result['emotion'] = "Sad" if pitch_var < 0.03 else "Calm"
-
-        print(f"   [PHYSICS] Energy: {energy:.4f}, Pitch: {pitch_var:.4f}")
-        print(f"   [EMOTION] Detected Emotion: {result['emotion']}")
+        result['emotion'] = voice_features.label_voice(energy, pitch_var)
+
+        logger.debug("[PHYSICS] Energy: %.4f, Pitch: %.4f", energy, pitch_var)
+        logger.debug("[EMOTION] Detected Emotion: %s", result['emotion'])
 
     except Exception as e:
-        print(f"   [CRITICAL] Physics Engine Failed: {e}")
+        logger.error("Physics Engine Failed: %s", e)
+
+    # --- Collect the transcript ---
+    if pending_text is not None:
+        try:
+            # Only the time still spent waiting once the physics is done
+            with metrics.span("stt_wait"):
+                text, language = stt.collect(pending_text)
+            if text:
+                result['text'] = text
+                logger.info(">> USER SAID (%s): %s", language, text)
+            else:
+                logger.warning("Could not understand Audio in English or Malayalam")
+        except sr.RequestError:
+            logger.warning("No internet connection for speech recognition")
+            result['stt_failed'] = True
+        except Exception as e:
+            logger.error("Speech Recognition Crashed: %s", e)
+            result['stt_failed'] = True
 
     return result
 
 # --------------------- Song Selection ---------------------
-def select_song(emotion):
-    # You can later add more Malayalam songs for different emotions
-    if emotion in ["Calm", "Sad"]:
-        return "audio/malayalam/malayalam_calm.mp3"
-    elif emotion in ["Happy", "Excited"]:
-        return "audio/malayalam/malayalam_calm.mp3"
-    elif emotion == "Angry":
-        return "audio/malayalam/malayalam_calm.mp3"
-    else:
-        return "audio/malayalam/malayalam_calm.mp3"
+DEFAULT_SONG = "audio/malayalam/malayalam_calm.mp3"
+_recent_tracks = catalogue.RecentTracks()
+
+def select_song(emotion, genre=None, recent=None):
+    """
+    Returns the audio file of the catalogue track nearest to the emotion's
+    energy/valence target, optionally within one genre (e.g. "malayalam"),
+    and not among the recently played tracks. Falls back to the default
+    song while no catalogue is compiled (see catalogue.py).
+    """
+    track = catalogue.pick(emotion, genre, _recent_tracks if recent is None else recent)
+    return catalogue.track_path(track["track_id"]) if track else DEFAULT_SONG
 
 # --------------------- Play Song ---------------------
-def play_song(song_path):
+def play_song(song_path, wait=False):
+    """
+    Starts playing a song on this machine's speakers and returns at once;
+    pygame's mixer keeps playing in the background. wait=True blocks until
+    the song ends, for command-line scripts that would otherwise exit.
+    The web app never plays audio itself: browsers stream it from /songs.
+    """
     if not os.path.exists(song_path):
-        print(f"Song not found ❌: {song_path}")
+        logger.warning("Song not found ❌: %s", song_path)
         return
 
-    pygame.mixer.init()
+    import pygame
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
     pygame.mixer.music.load(song_path)
     pygame.mixer.music.play()
-    print(f"Playing song: {song_path}")
+    logger.info("Playing song: %s", song_path)
 
-    # Wait until song finishes
-    while pygame.mixer.music.get_busy():
-        pygame.time.Clock().tick(10)
+    if wait:
+        clock = pygame.time.Clock()
+        while pygame.mixer.music.get_busy():
+            clock.tick(10)
 
 # --------------------- MAIN ---------------------
 if __name__ == "__main__":
-    # --- Step 1: Record voice ---
-    import sounddevice as sd
-    from scipy.io.wavfile import write
-
-    fs = 44100  # Sampling rate
-    duration = 5  # seconds
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
-    print("Recording your voice for 5 seconds...")
-    recording = sd.rec(int(duration * fs), samplerate=fs, channels=1)
-    sd.wait()  # Wait until recording is finished
+    # --- Step 1: Listen until the speaker stops ---
+    import mic_stream
 
-    voice_file = "audio/test_voice.wav"
-    write(voice_file, fs, recording)
-    print(f"Voice recorded and saved to {voice_file}")
+    print("Listening... speak now, recording stops when you finish.")
+    samples, rate = mic_stream.listen()
+    print(f"Heard {samples.size / rate:.1f} seconds of audio")
 
-    # --- Step 2: Analyze the recorded voice ---
-    result = analyze_voice_input(voice_file)
+    # --- Step 2: Analyze the samples straight from memory ---
+    result = analyze_voice_samples(samples, rate) if samples.size else _empty_result()
     print(f"Detected Emotion: {result['emotion']}, Text: {result['text']}")
 
     # --- Step 3: Select and play the song based on emotion ---
     song_file = select_song(result['emotion'])
-    play_song(song_file)
+    play_song(song_file, wait=True)
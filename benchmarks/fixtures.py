@@ -0,0 +1,182 @@
+"""
+Deterministic synthetic inputs for the benchmarks: MediaPipe-shaped landmark
+sets, voice-like WAVs, webcam-sized JPEG frames and track catalogues.
+Everything is generated from fixed seeds, so two runs (or two commits) time
+exactly the same data.
+"""
+import io
+import os
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+import soundfile as sf
+
+import catalogue
+import real_emotion
+from emotions import FaceEmotion
+
+NUM_LANDMARKS = 468
+
+WAV_SECONDS = (1.0, 3.0, 5.0)
+WAV_RATES = (16000, 44100, 48000)
+
+CATALOGUE_SIZES = (10_000, 1_000_000)
+GENRES = ("malayalam", "pop", "rock", "acoustic", "jazz", "classical", "hip-hop", "ambient")
+
+# Common webcam resolutions (width, height)
+FRAME_SIZES = ((320, 240), (640, 480), (1280, 720), (1920, 1080))
+JPEG_QUALITY = 80
+
+# Padded box around the face frame_image draws, as FaceTracker would ask for it
+FACE_SEARCH_REGION = (0.3, 0.15, 0.4, 0.7)
+
+
+# --- Landmarks ---
+class Landmark(NamedTuple):
+    """
+    Stand-in for a MediaPipe NormalizedLandmark (only .x/.y are read).
+    """
+    x: float
+    y: float
+    z: float = 0.0
+
+
+# A resting face in normalized image coordinates. Each key point is placed
+# well clear of the thresholds in real_emotion, so it classifies as Neutral.
+_NEUTRAL_KEY_POINTS = np.array([
+    (0.50, 0.62), (0.50, 0.64),   # top lip, bottom lip
+    (0.44, 0.63), (0.56, 0.63),   # left, right mouth corner
+    (0.455, 0.40), (0.545, 0.40), # left, right inner brow
+    (0.42, 0.40), (0.58, 0.40),   # left, right mid brow
+    (0.42, 0.45), (0.58, 0.45),   # left, right eye top
+    (0.36, 0.45), (0.64, 0.45),   # left, right eye outer corner
+])
+
+# Key point moves (position in KEY_LANDMARKS -> (dx, dy)) reaching each rule
+_EXPRESSIONS = {
+    FaceEmotion.NEUTRAL: {},
+    FaceEmotion.HAPPY: {real_emotion.LEFT_CORNER: (0.0, -0.03),
+                        real_emotion.RIGHT_CORNER: (0.0, -0.03)},
+    # Corners follow the jaw down so the open mouth does not read as a smile
+    FaceEmotion.SURPRISED: {real_emotion.BOTTOM_LIP: (0.0, 0.04),
+                            real_emotion.LEFT_CORNER: (0.0, 0.02),
+                            real_emotion.RIGHT_CORNER: (0.0, 0.02)},
+    FaceEmotion.ANGRY: {real_emotion.L_BROW_INNER: (0.015, 0.0),
+                        real_emotion.R_BROW_INNER: (-0.015, 0.0)},
+    FaceEmotion.SAD: {real_emotion.LEFT_CORNER: (0.0, 0.01),
+                      real_emotion.RIGHT_CORNER: (0.0, 0.01)},
+}
+
+EXPRESSIONS = tuple(_EXPRESSIONS)
+
+
+def landmark_array(emotion, seed=0, jitter=0.0005):
+    """
+    Returns a (468, 2) array of (x, y) coordinates that get_emotion classifies
+    as emotion. The non-key landmarks are scattered over the face box.
+    """
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(0.3, 0.7, size=(NUM_LANDMARKS, 2))
+    key = _NEUTRAL_KEY_POINTS.copy()
+    for position, offset in _EXPRESSIONS[emotion].items():
+        key[position] += offset
+    key += rng.normal(0.0, jitter, size=key.shape)
+    points[real_emotion.KEY_LANDMARKS] = key
+
+    reading = real_emotion.get_emotion(points)
+    if reading.emotion != emotion:
+        raise AssertionError(f"fixture for {emotion.name} classifies as {reading.emotion.name}")
+    # The single-face scorer and the batch scorer must agree
+    codes, features = real_emotion.get_emotion_batch(points[None])
+    if codes[0] != reading.emotion or not np.allclose([f[0] for f in features], reading.features):
+        raise AssertionError(f"batch scoring disagrees on the {emotion.name} fixture")
+    return points
+
+def landmark_list(emotion, seed=0):
+    """
+    Same face as landmark_array, shaped like results.multi_face_landmarks[0].landmark.
+    """
+    return [Landmark(float(x), float(y)) for x, y in landmark_array(emotion, seed)]
+
+
+# --- Audio ---
+def voice_samples(seconds, rate, seed=0):
+    """
+    Speech-like mono float32 signal: a harmonic voice with a wandering pitch,
+    chopped into syllables, over a little background noise.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    f0 = 160 + 30 * np.sin(2 * np.pi * 0.7 * t) + 10 * np.sin(2 * np.pi * 5.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = np.clip(np.sin(2 * np.pi * 3.0 * t), 0.0, None) ** 0.5
+    y = 0.25 * voice * syllables + 0.01 * rng.standard_normal(t.size)
+    return (y / np.max(np.abs(y)) * 0.8).astype(np.float32)
+
+def wav_bytes(seconds, rate, seed=0):
+    """
+    voice_samples encoded as a 16-bit PCM WAV file in memory.
+    """
+    buffer = io.BytesIO()
+    sf.write(buffer, voice_samples(seconds, rate, seed), rate, format='WAV', subtype='PCM_16')
+    return buffer.getvalue()
+
+
+# --- Camera frames ---
+def frame_image(width, height, seed=0):
+    """
+    BGR frame with a lit background and a face-like drawing in the middle.
+    FaceMesh may or may not find a face in it; the point is a realistic
+    decode + inference cost at each resolution.
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(60, 180, width, dtype=np.float32)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[...] = (gradient[None, :, None] * (0.8, 0.9, 1.0)).astype(np.uint8)
+    noise = rng.integers(-12, 13, size=image.shape, dtype=np.int16)
+    image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+    cx, cy, s = width // 2, height // 2, min(width, height)
+    cv2.ellipse(image, (cx, cy), (int(s * 0.18), int(s * 0.25)), 0, 0, 360, (120, 160, 210), -1)
+    for dx in (-1, 1):
+        eye = (cx + dx * int(s * 0.07), cy - int(s * 0.06))
+        cv2.ellipse(image, eye, (int(s * 0.03), int(s * 0.012)), 0, 0, 360, (40, 40, 40), -1)
+        brow = (cx + dx * int(s * 0.07), cy - int(s * 0.1))
+        cv2.ellipse(image, brow, (int(s * 0.04), int(s * 0.01)), 0, 180, 360, (30, 40, 60), 2)
+    cv2.ellipse(image, (cx, cy + int(s * 0.12)), (int(s * 0.06), int(s * 0.02)), 0, 0, 180, (60, 60, 150), 3)
+    return image
+
+def jpeg_bytes(width, height, seed=0, quality=JPEG_QUALITY):
+    ok, encoded = cv2.imencode('.jpg', frame_image(width, height, seed),
+                               [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("JPEG encoding failed")
+    return encoded.tobytes()
+
+
+# --- Track catalogue ---
+def track_columns(count, seed=0):
+    """
+    Columns for catalogue.write_segment: uniformly spread energy/valence,
+    a mood per track from the catalogue vocabulary, and a handful of genres.
+    """
+    rng = np.random.default_rng(seed)
+    moods = np.array(sorted(catalogue.MOOD_TARGETS), dtype=object)
+    return {
+        "track_id": np.array([f"T{i:021d}" for i in rng.permutation(count)], dtype=object),
+        "track_name": np.array([f"Track {i}" for i in range(count)], dtype=object),
+        "artists": rng.choice(np.array(["Artist A", "Artist B", "Artist C"], dtype=object), count),
+        "album_name": np.full(count, "Album", dtype=object),
+        "duration_ms": rng.integers(120_000, 360_000, count),
+        "energy": rng.random(count, dtype=np.float32),
+        "valence": rng.random(count, dtype=np.float32),
+        "mood": rng.choice(moods, count),
+        "track_genre": rng.choice(np.array(GENRES, dtype=object), count),
+    }
+
+def write_catalogue(path, count, seed=0):
+    catalogue.write_segment(os.path.join(path, catalogue.segment_name(0)), track_columns(count, seed))
+    catalogue.write_manifest(path, [catalogue.segment_name(0)])
+    return path
@@ -0,0 +1,117 @@
+"""
+Import-time budget for the web server.
+
+Imports app.py in fresh interpreters (python -X importtime) and reports the
+median cost, the slowest of its direct imports, and any heavy or device-bound
+module that got imported although the server is meant to load it lazily.
+
+    python -m benchmarks.import_time                 # report only
+    python -m benchmarks.import_time --budget 1.0    # exit 1 if over budget
+    python -m benchmarks.import_time --output import_time.json
+
+The budget can also come from IMPORT_BUDGET_SECONDS.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Must not be imported by "import app"; they load on first use instead
+LAZY_MODULES = ("mediapipe", "pygame", "sounddevice", "scipy", "librosa")
+
+_PROBE = (
+    "import json, sys\n"
+    "import {module}\n"
+    "print(json.dumps(sorted(sys.modules)))\n"
+)
+
+
+def measure_once(module="app"):
+    """
+    Imports module in a new interpreter. Returns (total seconds,
+    {direct import of module: cumulative seconds}, loaded module names).
+    """
+    env = dict(os.environ, WARM_UP="0")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{proc.stderr[-2000:]}")
+
+    # "import time: self [us] | cumulative | <2 spaces per nesting level>name".
+    # A package's own imports are listed just before it, one level deeper.
+    total, children, direct = 0.0, {}, {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        seconds = int(cumulative) / 1e6
+        if depth == 1:
+            children[name.strip()] = seconds
+        elif depth == 0:
+            if name.strip() == module:
+                total, direct = seconds, children
+            children = {}
+    loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+    return total, direct, loaded
+
+def measure(module="app", runs=5):
+    totals, breakdown, loaded = [], {}, []
+    for _ in range(runs):
+        total, direct, loaded = measure_once(module)
+        totals.append(total)
+        for name, seconds in direct.items():
+            breakdown.setdefault(name, []).append(seconds)
+    eager = sorted(name for name in loaded if name.split(".")[0] in LAZY_MODULES)
+    return {
+        "module": module,
+        "runs": runs,
+        "median_seconds": statistics.median(totals),
+        "min_seconds": min(totals),
+        "imports": {name: statistics.median(values) for name, values in breakdown.items()},
+        "eager_heavy_modules": sorted({name.split(".")[0] for name in eager}),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how long importing the server takes.")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="how many of the slowest imports to list")
+    parser.add_argument("--budget", type=float,
+                        default=float(os.environ["IMPORT_BUDGET_SECONDS"])
+                        if "IMPORT_BUDGET_SECONDS" in os.environ else None,
+                        help="fail if the median import takes longer (seconds)")
+    parser.add_argument("--output", help="also write the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = measure(args.module, args.runs)
+    report["budget_seconds"] = args.budget
+
+    print(f"import {args.module}: median {report['median_seconds'] * 1000:.0f} ms "
+          f"(min {report['min_seconds'] * 1000:.0f} ms over {args.runs} runs)")
+    slowest = sorted(report["imports"].items(), key=lambda item: -item[1])
+    for name, seconds in slowest[:args.top]:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+    failed = False
+    if report["eager_heavy_modules"]:
+        print(f"Loaded eagerly, should be lazy: {', '.join(report['eager_heavy_modules'])}")
+        failed = True
+    if args.budget is not None and report["median_seconds"] > args.budget:
+        print(f"Over budget: {report['median_seconds']:.3f}s > {args.budget:.3f}s")
+        failed = True
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""
+Microbenchmarks for the face, voice and fusion hot paths.
+
+Runs offline on a plain CPU: all inputs come from benchmarks/fixtures.py and
+speech recognition is replaced by stt.StaticBackend.
+
+    python -m benchmarks.run                        # writes benchmarks/results/<commit>.json
+    python -m benchmarks.run --quick --filter fuse  # a fast look at one group
+    python -m benchmarks.run --baseline benchmarks/results/abc1234.json
+    python -m benchmarks.run --compare old.json new.json --threshold 0.1
+
+Each benchmark reports seconds per call (min, median, mean, stdev over the
+repeats). Comparisons use the median; --threshold makes the exit status
+non-zero when anything got slower by more than that fraction.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import numpy as np
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SCHEMA_VERSION = 1
+
+
+# --- Timing ---
+def measure(fn, repeat=5, min_time=0.05):
+    """
+    Times fn() like timeit: picks a loop count whose total runs for at least
+    min_time, then repeats that measurement. Returns per-call seconds.
+    """
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    runs = [timer.timeit(number) / number for _ in range(repeat)]
+    return {
+        "min": min(runs),
+        "median": statistics.median(runs),
+        "mean": statistics.fmean(runs),
+        "stdev": statistics.stdev(runs) if len(runs) > 1 else 0.0,
+        "loops": number,
+        "repeat": repeat,
+    }
+
+
+# --- Benchmarks ---
+def build_cases(workdir):
+    """
+    Returns [(name, params, fn)]. Fixtures that the code under test reads
+    from disk are written to workdir first, so file I/O is part of the timing
+    exactly as in production, but fixture generation is not. A case that
+    cannot run here has fn None and the reason in params["skipped"].
+    """
+    import audio_logic
+    import catalogue
+    import fusion_engine
+    import mood_label
+    import real_emotion
+    from benchmarks import fixtures
+    from emotions import FaceEmotion
+
+    cases = []
+
+    for emotion in fixtures.EXPRESSIONS:
+        landmarks = fixtures.landmark_list(emotion)
+        cases.append((f"get_emotion[{emotion.name.lower()}]", {"emotion": emotion.name},
+                      lambda landmarks=landmarks: real_emotion.get_emotion(landmarks)))
+
+    # Landmark-only mode: what the server does when the client runs the mesh
+    payload = fixtures.landmark_array(FaceEmotion.HAPPY).astype(real_emotion.LANDMARK_DTYPE).tobytes()
+    cases.append(("analyze_landmarks_bytes[468xf16]", {"bytes": len(payload)},
+                  lambda: real_emotion.analyze_landmarks_bytes(payload)))
+
+    for width, height in fixtures.FRAME_SIZES:
+        path = os.path.join(workdir, f"frame_{width}x{height}.jpg")
+        data = fixtures.jpeg_bytes(width, height)
+        with open(path, "wb") as f:
+            f.write(data)
+        full, tracked = probe_mesh(data)
+        name, params = f"analyze_face[{width}x{height}]", dict(full, width=width, height=height)
+        cases.append((name, params, None if "skipped" in full else
+                      lambda path=path: real_emotion.analyze_face(path)))
+        # Tracked: the mesh only sees the padded box around the face drawing
+        name, params = f"analyze_face_bytes[{width}x{height},tracked]", dict(tracked, width=width, height=height)
+        cases.append((name, params, None if "skipped" in tracked else
+                      lambda data=data: real_emotion.analyze_face_bytes(data, None, fixtures.FACE_SEARCH_REGION)))
+
+    for rate in fixtures.WAV_RATES:
+        for seconds in fixtures.WAV_SECONDS:
+            path = os.path.join(workdir, f"voice_{rate}_{seconds:g}s.wav")
+            with open(path, "wb") as f:
+                f.write(fixtures.wav_bytes(seconds, rate))
+            params = {"rate": rate, "seconds": seconds}
+            tag = f"{rate}Hz,{seconds:g}s"
+            cases.append((f"audio_logic.analyze_voice_input[{tag}]", params,
+                          lambda path=path: audio_logic.analyze_voice_input(path)))
+            cases.append((f"mood_label.analyze_voice_input[{tag}]", params,
+                          lambda path=path: mood_label.analyze_voice_input(path)))
+
+    for count in fixtures.CATALOGUE_SIZES:
+        path = fixtures.write_catalogue(os.path.join(workdir, f"catalogue_{count}"), count)
+        tracks = catalogue.Catalogue(path)
+        cases.append((f"catalogue.open[{count}]", {"tracks": count},
+                      lambda path=path: catalogue.Catalogue(path)))
+        cases.append((f"catalogue.recommend[{count}]", {"tracks": count, "genre": None},
+                      lambda tracks=tracks: tracks.recommend("Happy")))
+        cases.append((f"catalogue.recommend[{count},malayalam]", {"tracks": count, "genre": "malayalam"},
+                      lambda tracks=tracks: tracks.recommend("Sad", genre="malayalam")))
+
+    # One call per face/voice pair in the compiled vocabulary; timed as a sweep
+    pairs = [(face, voice) for face in FaceEmotion for voice in fusion_engine.get_rules().voice_labels]
+    def fuse_all():
+        for face, voice in pairs:
+            fusion_engine.fuse_emotions(face, voice)
+    cases.append(("fuse_emotions[all_pairs]", {"calls": len(pairs)}, fuse_all))
+    cases.append(("fuse_emotions[legacy_text]", {"calls": 1},
+                  lambda: fusion_engine.fuse_emotions("Happy: Corners lifted (0.030)", "Sad")))
+
+    return cases
+
+def probe_mesh(data):
+    """
+    Runs FaceMesh once on a frame fixture, on the whole frame and on the
+    tracked crop, outside analyze_face's catch-all, which would otherwise
+    turn a broken mesh into a fast Neutral and time the error path.
+    Returns params for the two cases: {"face": found} or {"skipped": reason}.
+    """
+    import real_emotion
+    from benchmarks import fixtures
+
+    image = real_emotion.decode_image(data)
+    crop, _ = real_emotion.crop_to_roi(image, fixtures.FACE_SEARCH_REGION)
+    probes = []
+    for region in (image, crop):
+        try:
+            probes.append({"face": real_emotion.mesh_landmarks(region) is not None})
+        except Exception as e:
+            probes.append({"skipped": f"FaceMesh failed on the fixture: {e}"})
+    return probes
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    cwd=ROOT, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def run(name_filter=None, repeat=5, min_time=0.05, out=sys.stdout):
+    import stt
+    stt.set_backend(stt.StaticBackend())
+
+    results, skipped = {}, {}
+    with tempfile.TemporaryDirectory(prefix="mt-bench-") as workdir:
+        for name, params, fn in build_cases(workdir):
+            if name_filter and name_filter not in name:
+                continue
+            if fn is None:
+                skipped[name] = params["skipped"]
+                print(f"{name:<52} {'skipped':>10}  ({params['skipped']})", file=out)
+                continue
+            fn()   # warm-up: lazy initialisation, caches, first-call costs
+            stats = measure(fn, repeat, min_time)
+            results[name] = dict(stats, params=params)
+            print(f"{name:<52} {_format_seconds(stats['median']):>10}  "
+                  f"(min {_format_seconds(stats['min'])}, x{stats['loops']})", file=out)
+    return {"schema": SCHEMA_VERSION, "environment": environment(), "results": results,
+            "skipped": skipped}
+
+
+# --- Comparison ---
+def compare(baseline, current, threshold=None, out=sys.stdout):
+    """
+    Prints the median change of every benchmark present in both result sets.
+    Returns the names that slowed down by more than threshold (a fraction).
+    """
+    regressions = []
+    old, new = baseline["results"], current["results"]
+    print(f"{'benchmark':<52} {'baseline':>10} {'current':>10} {'change':>8}", file=out)
+    for name in sorted(old.keys() & new.keys()):
+        before, after = old[name]["median"], new[name]["median"]
+        change = after / before - 1.0 if before else 0.0
+        flag = ""
+        if old[name]["params"] != new[name]["params"]:
+            # e.g. the mesh found the fixture's face in one run only
+            flag = f"  (params differ: {old[name]['params']} -> {new[name]['params']})"
+        elif threshold is not None and change > threshold:
+            regressions.append(name)
+            flag = "  <-- slower"
+        print(f"{name:<52} {_format_seconds(before):>10} {_format_seconds(after):>10} "
+              f"{change:>+8.1%}{flag}", file=out)
+    for name in sorted(old.keys() - new.keys()):
+        reason = current.get("skipped", {}).get(name)
+        print(f"{name:<52} ({'skipped: ' + reason if reason else 'missing from current run'})", file=out)
+    for name in sorted(new.keys() - old.keys()):
+        print(f"{name:<52} (new)", file=out)
+    return regressions
+
+def _format_seconds(seconds):
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f} {unit}"
+    return f"{seconds / 1e-9:.1f} ns"
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("schema") != SCHEMA_VERSION:
+        raise SystemExit(f"{path}: unsupported results schema {data.get('schema')!r}")
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the emotion pipeline.")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="minimum seconds per repeat (default 0.05)")
+    parser.add_argument("--quick", action="store_true", help="3 short repeats, for a rough look")
+    parser.add_argument("--output", help="results file (default benchmarks/results/<commit>.json)")
+    parser.add_argument("--baseline", help="results file to compare this run against")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="compare two results files without running anything")
+    parser.add_argument("--threshold", type=float,
+                        help="exit with status 1 if a median slows down by more than this fraction")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        regressions = compare(load(args.compare[0]), load(args.compare[1]), args.threshold)
+        return 1 if regressions else 0
+
+    logging.basicConfig(level=logging.WARNING)
+    repeat, min_time = (3, 0.01) if args.quick else (args.repeat, args.min_time)
+    current = run(args.filter, repeat, min_time)
+
+    output = args.output
+    if output is None:
+        env = current["environment"]
+        stem = (env["commit"] or "local") + ("-dirty" if env["dirty"] else "")
+        output = os.path.join(RESULTS_DIR, f"{stem}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(current, f, indent=2, sort_keys=True)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        print()
+        regressions = compare(load(args.baseline), current, args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
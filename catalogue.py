@@ -0,0 +1,749 @@
+import argparse
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The track catalogue (tracks_with_mood.csv) compiled into a directory of
+# memory-mapped NumPy columns. Opening it maps the files instead of parsing
+# anything, so it loads in milliseconds at any size, and queries touch only
+# the rows they need through two indexes built at compile time:
+#   - a row index per mood and per genre (rows grouped by code + offsets)
+#   - a GRID x GRID grid over (energy, valence), rows grouped by cell, once
+#     over all tracks and once per mood, so a mood query only visits its own
+#     tracks
+#
+# Layout: <path>/manifest.json lists segment directories; each segment holds
+# meta.json plus one .npy file per column and index.
+CATALOGUE_PATH = os.environ.get("CATALOGUE_PATH", "tracks.catalogue")
+TRACK_AUDIO_DIR = os.environ.get("TRACK_AUDIO_DIR", os.path.join("audio", "tracks"))
+
+FORMAT_VERSION = 2
+GRID = 64
+CELL = 1.0 / GRID
+
+# Below this many rows, a mood/genre subset is scanned directly instead of
+# walking the grid
+SCAN_ROWS = 4096
+
+STRING_COLUMNS = ("track_name", "artists", "album_name")
+CATEGORY_COLUMNS = ("mood", "track_genre")
+
+# Where each mood sits in (energy, valence); select_song looks for tracks
+# nearest to it. Keys are the moods fusion_engine and the voice analysers produce.
+MOOD_TARGETS = {
+    "Happy": (0.70, 0.80),
+    "Excited": (0.85, 0.70),
+    "Surprise": (0.85, 0.52),
+    "Calm": (0.30, 0.60),
+    "Neutral": (0.50, 0.50),
+    "Sad": (0.30, 0.20),
+    "Hidden Sadness": (0.45, 0.30),
+    "Frustration": (0.70, 0.30),
+    "Angry": (0.85, 0.25),
+}
+MOOD_ALIASES = {"Sadness": "Sad", "Anger": "Angry", "Surprised": "Surprise"}
+
+
+def normalize_mood(mood):
+    """
+    Maps any spelling of a mood ('sad', 'Sadness', 'surprised') to the catalogue's.
+    """
+    mood = str(mood).strip()
+    if mood.islower():
+        mood = mood.title()
+    return MOOD_ALIASES.get(mood, mood)
+
+def track_path(track_id):
+    return os.path.join(TRACK_AUDIO_DIR, f"{track_id}.mp3")
+
+
+# --- Writing ---
+def _grouped(codes, groups):
+    # Rows ordered by code, and where each code's rows start (length groups + 1)
+    order = np.argsort(codes, kind="stable").astype(np.int32)
+    offsets = np.searchsorted(codes[order], np.arange(groups + 1)).astype(np.int64)
+    return order, offsets
+
+def grid_cells(energy, valence):
+    e = np.clip((np.asarray(energy) * GRID).astype(np.int32), 0, GRID - 1)
+    v = np.clip((np.asarray(valence) * GRID).astype(np.int32), 0, GRID - 1)
+    return e * GRID + v
+
+def _save(directory, name, array):
+    np.save(os.path.join(directory, f"{name}.npy"), array, allow_pickle=False)
+
+def _text(values):
+    # Missing values (None/NaN) become empty strings
+    return ["" if v is None or v != v else str(v) for v in values]
+
+def _ids(values):
+    return np.array([t.encode("utf-8") for t in _text(values)], dtype=np.bytes_)
+
+def _encode_strings(values):
+    """
+    UTF-8 bytes of all values back to back, plus the (n + 1) row offsets.
+    """
+    texts = _text(values)
+    joined = "".join(texts)
+    data = joined.encode("utf-8")
+    if len(data) == len(joined):
+        # All ASCII: byte lengths are the character lengths
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    else:
+        lengths = np.fromiter((len(t.encode("utf-8")) for t in texts), dtype=np.int64, count=len(texts))
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return np.frombuffer(data, dtype=np.uint8), offsets
+
+def _factorize(values):
+    import pandas as pd
+    codes, uniques = pd.factorize(np.asarray(_text(values), dtype=object))
+    return codes, np.asarray(uniques, dtype=object)
+
+def _fill_moods(moods, energy, valence):
+    # Tracks without a mood are labelled from their energy/valence
+    import track_moods
+    moods = np.asarray(_text(moods), dtype=object)
+    missing = moods == ""
+    if missing.any():
+        moods[missing] = track_moods.label(energy[missing], valence[missing])
+    return moods
+
+def write_segment(directory, columns):
+    """
+    Writes one segment from a mapping of equal-length columns: track_id,
+    energy, valence, mood, track_genre, and optionally duration_ms and the
+    STRING_COLUMNS. Rows without finite energy/valence are left out; rows
+    without a mood get one from track_moods.label.
+    Returns the number of rows written.
+    """
+    energy = np.asarray(columns["energy"], dtype=np.float32)
+    valence = np.asarray(columns["valence"], dtype=np.float32)
+    keep = np.isfinite(energy) & np.isfinite(valence)
+    if not keep.all():
+        logger.warning("Skipping %d tracks without energy/valence", int((~keep).sum()))
+
+    def column(name, default=""):
+        values = columns.get(name)
+        if values is None:
+            return np.full(int(keep.sum()), default, dtype=object)
+        return np.asarray(values, dtype=object)[keep]
+
+    os.makedirs(directory, exist_ok=True)
+    energy, valence = energy[keep], valence[keep]
+    track_ids = _ids(column("track_id"))
+    meta = {"version": FORMAT_VERSION, "rows": int(keep.sum()), "grid": GRID, "categories": {}}
+
+    # The sorted ids double as the persistent index that ingest() checks
+    # new tracks against
+    order = np.argsort(track_ids, kind="stable").astype(np.int32)
+    _save(directory, "track_id", track_ids)
+    _save(directory, "track_id_order", order)
+    _save(directory, "track_id_sorted", track_ids[order])
+    _save(directory, "energy", energy)
+    _save(directory, "valence", valence)
+    durations = columns.get("duration_ms")
+    _save(directory, "duration_ms", np.zeros(meta["rows"], dtype=np.int32) if durations is None
+          else np.nan_to_num(np.asarray(durations, dtype=np.float64)[keep]).astype(np.int32))
+
+    for name in STRING_COLUMNS:
+        data, offsets = _encode_strings(column(name))
+        _save(directory, f"{name}.offsets", offsets)
+        _save(directory, f"{name}.bytes", data)
+
+    for name in CATEGORY_COLUMNS:
+        # Normalize and sort the distinct values only, then remap the codes
+        values = column(name)
+        if name == "mood":
+            values = _fill_moods(values, energy, valence)
+        codes, uniques = _factorize(values)
+        if name == "mood":
+            uniques = np.array([normalize_mood(v) for v in uniques], dtype=object)
+        vocabulary, remap = np.unique(uniques.astype(str), return_inverse=True)
+        codes = remap.astype(np.int16)[codes]
+        rows, offsets = _grouped(codes, len(vocabulary))
+        meta["categories"][name] = vocabulary.tolist()
+        _save(directory, name, codes)
+        _save(directory, f"{name}.rows", rows)
+        _save(directory, f"{name}.offsets", offsets)
+
+    cells = grid_cells(energy, valence)
+    rows, offsets = _grouped(cells, GRID * GRID)
+    _save(directory, "grid.rows", rows)
+    _save(directory, "grid.offsets", offsets)
+    moods = np.load(os.path.join(directory, "mood.npy")).astype(np.int64)
+    rows, offsets = _grouped(moods * GRID * GRID + cells, len(meta["categories"]["mood"]) * GRID * GRID)
+    _save(directory, "mood_grid.rows", rows)
+    _save(directory, "mood_grid.offsets", offsets)
+
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta["rows"]
+
+def write_manifest(path, segments):
+    manifest = {"version": FORMAT_VERSION, "segments": list(segments)}
+    tmp = os.path.join(path, "manifest.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, "manifest.json"))
+
+def compile_csv(csv_path, path=CATALOGUE_PATH):
+    """
+    Compiles a tracks CSV into a fresh catalogue at path, replacing any
+    catalogue there only once the new one is complete.
+    """
+    import pandas as pd
+
+    usecols = ["track_id", "energy", "valence", "mood", "track_genre", "duration_ms", *STRING_COLUMNS]
+    header = pd.read_csv(csv_path, nrows=0).columns
+    df = pd.read_csv(csv_path, usecols=[c for c in usecols if c in header],
+                     dtype={"energy": "float32", "valence": "float32"})
+
+    staging = staging_path(path)
+    rows = write_segment(os.path.join(staging, segment_name(0)), {c: df[c].to_numpy() for c in df.columns})
+    write_manifest(staging, [segment_name(0)])
+    publish(staging, path)
+    return rows
+
+def segment_name(number):
+    return f"seg-{number:06d}"
+
+def staging_path(path):
+    """
+    An empty directory next to path to build a new catalogue in; see publish.
+    """
+    staging = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    return staging
+
+def publish(staging, path):
+    """
+    Swaps a fully written catalogue in for the one at path.
+    """
+    old = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(staging, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+# --- Reading ---
+class _Strings:
+    """
+    A variable-length string column: UTF-8 bytes plus row offsets.
+    """
+
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+
+    def __getitem__(self, row):
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return bytes(self._data[start:end]).decode("utf-8")
+
+
+class Segment:
+    """
+    One compiled, memory-mapped block of tracks and its indexes.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != FORMAT_VERSION or self.meta["grid"] != GRID:
+            raise ValueError(f"{directory}: incompatible catalogue format, recompile it")
+        # Plain ndarray views of the maps: same pages, without np.memmap's
+        # per-indexing overhead
+        load = lambda name: np.load(os.path.join(directory, f"{name}.npy"),
+                                    mmap_mode="r").view(np.ndarray)
+
+        self.directory = directory
+        self.rows = self.meta["rows"]
+        self.track_id = load("track_id")
+        self.track_id_order = load("track_id_order")
+        self.track_id_sorted = load("track_id_sorted")
+        self.energy = load("energy")
+        self.valence = load("valence")
+        self.duration_ms = load("duration_ms")
+        self.strings = {name: _Strings(load(f"{name}.bytes"), load(f"{name}.offsets"))
+                        for name in STRING_COLUMNS}
+        self.vocabulary = self.meta["categories"]
+        self.codes = {name: {value: code for code, value in enumerate(self.vocabulary[name])}
+                      for name in CATEGORY_COLUMNS}
+        self.categories = {name: load(name) for name in CATEGORY_COLUMNS}
+        self.index = {name: (load(f"{name}.rows"), load(f"{name}.offsets"))
+                      for name in (*CATEGORY_COLUMNS, "grid", "mood_grid")}
+
+    def __len__(self):
+        return self.rows
+
+    def rows_for(self, column, value):
+        """
+        Rows whose mood/track_genre equals value (empty if it never occurs).
+        """
+        code = self.codes[column].get(value)
+        if code is None:
+            return np.empty(0, dtype=np.int32)
+        rows, offsets = self.index[column]
+        return rows[offsets[code]:offsets[code + 1]]
+
+    def lookup(self, track_ids):
+        """
+        Rows of many track ids at once (-1 where absent), by binary search
+        over the sorted id index.
+        """
+        keys = track_ids if isinstance(track_ids, np.ndarray) and track_ids.dtype.kind == "S" \
+            else _ids(track_ids)
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if self.rows and len(keys):
+            pos = np.minimum(np.searchsorted(self.track_id_sorted, keys), self.rows - 1)
+            hit = self.track_id_sorted[pos] == keys
+            rows[hit] = self.track_id_order[pos[hit]]
+        return rows
+
+    def find(self, track_id):
+        """
+        Row of track_id, or -1.
+        """
+        return int(self.lookup([track_id])[0])
+
+    def columns(self):
+        """
+        All rows as write_segment columns, e.g. to merge segments.
+        """
+        columns = {
+            "track_id": np.array(_text(t.decode("utf-8") for t in self.track_id), dtype=object),
+            "energy": np.array(self.energy),
+            "valence": np.array(self.valence),
+            "duration_ms": np.array(self.duration_ms),
+        }
+        for name in STRING_COLUMNS:
+            strings = self.strings[name]
+            columns[name] = np.array([strings[row] for row in range(self.rows)], dtype=object)
+        for name in CATEGORY_COLUMNS:
+            columns[name] = np.asarray(self.vocabulary[name], dtype=object)[self.categories[name]]
+        return columns
+
+    def track(self, row):
+        track = {
+            "track_id": self.track_id[row].decode(),
+            "energy": float(self.energy[row]),
+            "valence": float(self.valence[row]),
+            "duration_ms": int(self.duration_ms[row]),
+        }
+        for name in STRING_COLUMNS:
+            track[name] = self.strings[name][row]
+        for name in CATEGORY_COLUMNS:
+            track[name] = self.vocabulary[name][self.categories[name][row]]
+        return track
+
+    def nearest(self, energy, valence, k=1, filters=None, exclude=None):
+        """
+        Returns (distances, rows) of up to k rows nearest to (energy, valence)
+        that match filters ({column: value}) and whose track_id is not in
+        exclude (an array of byte strings), nearest first.
+        """
+        codes = {}
+        for column, value in (filters or {}).items():
+            code = self.codes[column].get(value)
+            if code is None:
+                return np.empty(0), np.empty(0, dtype=np.int32)
+            codes[column] = code
+
+        def accept(rows):
+            for column, code in codes.items():
+                rows = rows[self.categories[column][rows] == code]
+            if exclude is not None and len(exclude) and rows.size:
+                rows = rows[~np.isin(self.track_id[rows], exclude)]
+            return rows
+
+        def closest(rows, limit):
+            d = np.hypot(self.energy[rows] - energy, self.valence[rows] - valence)
+            if rows.size > limit:
+                keep = np.argpartition(d, limit - 1)[:limit]
+                rows, d = rows[keep], d[keep]
+            order = np.argsort(d, kind="stable")
+            return d[order], rows[order]
+
+        # A rare mood or genre: scanning its rows beats walking the grid
+        subsets = [self.rows_for(column, value) for column, value in (filters or {}).items()]
+        smallest = min(subsets, key=len, default=None)
+        if smallest is not None and len(smallest) <= SCAN_ROWS:
+            return closest(accept(np.asarray(smallest)), k)
+
+        # Otherwise walk square rings of grid cells outward from the target,
+        # in the mood's own grid when filtering by mood. Anything beyond ring
+        # r is at least r cells away, so once k matches are that close, no
+        # unvisited row can beat them.
+        base = 0
+        grid_rows, grid_offsets = self.index["grid"]
+        if "mood" in codes:
+            base = codes.pop("mood") * GRID * GRID
+            grid_rows, grid_offsets = self.index["mood_grid"]
+        ce = min(max(int(energy * GRID), 0), GRID - 1)
+        cv = min(max(int(valence * GRID), 0), GRID - 1)
+        best_d, best_rows = np.empty(0), np.empty(0, dtype=np.int32)
+        for r in range(GRID):
+            chunks = []
+            for e in range(max(ce - r, 0), min(ce + r, GRID - 1) + 1):
+                span = range(max(cv - r, 0), min(cv + r, GRID - 1) + 1)
+                cells = span if abs(e - ce) == r else [c for c in (cv - r, cv + r) if c in span]
+                for v in cells:
+                    cell = base + e * GRID + v
+                    start, end = grid_offsets[cell], grid_offsets[cell + 1]
+                    if end > start:
+                        chunks.append(grid_rows[start:end])
+            if chunks:
+                found = accept(np.concatenate(chunks))
+                if found.size:
+                    d, rows = closest(found, k)
+                    best_d, best_rows = _merge_closest(best_d, best_rows, d, rows, k)
+            if len(best_rows) >= k and best_d[-1] <= r * CELL:
+                break
+        return best_d, best_rows
+
+def _merge_closest(d1, rows1, d2, rows2, k):
+    d = np.concatenate((d1, d2))
+    rows = np.concatenate((rows1, rows2))
+    order = np.argsort(d, kind="stable")[:k]
+    return d[order], rows[order]
+
+
+class Catalogue:
+    """
+    All segments of a compiled catalogue, queried as one.
+    """
+
+    def __init__(self, path=CATALOGUE_PATH):
+        manifest_path = os.path.join(path, "manifest.json")
+        self.mtime = os.stat(manifest_path).st_mtime_ns
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.path = path
+        self.segments = [Segment(os.path.join(path, name)) for name in manifest["segments"]]
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def moods(self):
+        return sorted({mood for s in self.segments for mood in s.vocabulary["mood"]})
+
+    def genres(self):
+        return sorted({genre for s in self.segments for genre in s.vocabulary["track_genre"]})
+
+    def contains(self, track_ids):
+        """
+        Boolean array: which of track_ids are already in the catalogue.
+        """
+        keys = _ids(track_ids)
+        found = np.zeros(len(keys), dtype=bool)
+        for segment in self.segments:
+            found |= segment.lookup(keys) >= 0
+        return found
+
+    def find(self, track_id):
+        """
+        Returns the track as a dict, or None.
+        """
+        for segment in reversed(self.segments):
+            row = segment.find(track_id)
+            if row >= 0:
+                return segment.track(row)
+        return None
+
+    def nearest(self, energy, valence, k=1, mood=None, genre=None, exclude=()):
+        """
+        Up to k tracks (dicts with a 'distance') nearest to (energy, valence)
+        in the given mood and genre, skipping track ids in exclude.
+        """
+        filters = {}
+        if mood is not None:
+            filters["mood"] = normalize_mood(mood)
+        if genre is not None:
+            filters["track_genre"] = genre
+        excluded = _ids(exclude) if exclude else None
+
+        best_d, best = np.empty(0), []
+        for segment in self.segments:
+            d, rows = segment.nearest(energy, valence, k, filters, excluded)
+            best_d = np.concatenate((best_d, d))
+            best.extend((segment, int(row)) for row in rows)
+        tracks = []
+        for i in np.argsort(best_d, kind="stable")[:k]:
+            segment, row = best[i]
+            tracks.append(dict(segment.track(row), distance=float(best_d[i])))
+        return tracks
+
+    def recommend(self, emotion, k=1, genre=None, exclude=()):
+        """
+        Tracks for an emotion: nearest to its MOOD_TARGETS point among tracks
+        labelled with that mood, or among all tracks if none are.
+        """
+        mood = normalize_mood(emotion)
+        energy, valence = MOOD_TARGETS.get(mood, MOOD_TARGETS["Neutral"])
+        tracks = self.nearest(energy, valence, k, mood, genre, exclude)
+        if not tracks:
+            tracks = self.nearest(energy, valence, k, None, genre, exclude)
+        return tracks
+
+
+class RecentTracks:
+    """
+    The last few track ids played, so recommendations do not repeat them.
+    """
+
+    def __init__(self, size=20):
+        self._ids = deque(maxlen=size)
+
+    def add(self, track_id):
+        self._ids.append(track_id)
+
+    def __contains__(self, track_id):
+        return track_id in self._ids
+
+    def __iter__(self):
+        return iter(list(self._ids))
+
+    def __len__(self):
+        return len(self._ids)
+
+
+# --- Appending ---
+# Each ingest() is one transaction: the accepted tracks become a new segment
+# with its own indexes, committed by atomically rewriting the manifest. No
+# existing segment is touched, so an addition costs O(batch), not O(catalogue).
+# Once there are more than MAX_SEGMENTS, the small ones are merged into one.
+MAX_SEGMENTS = 16
+
+@contextmanager
+def _writer_lock(path):
+    # One writer at a time; readers never wait
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _read_segments(path):
+    try:
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f)["segments"]
+    except FileNotFoundError:
+        return []
+
+def _remove_orphans(path, segments):
+    # Segments left behind by a writer that died before its commit
+    for name in os.listdir(path):
+        if name.startswith("seg-") and name not in segments:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+def _next_segment(segments):
+    return segment_name(max((int(name.split("-")[1]) for name in segments), default=-1) + 1)
+
+def read_tracks(path):
+    """
+    Reads a batch of tracks from CSV, a JSON list of objects, or JSON lines.
+    Returns a pandas DataFrame.
+    """
+    import pandas as pd
+    if path.endswith(".jsonl"):
+        return pd.read_json(path, lines=True, dtype={"track_id": str})
+    if path.endswith(".json"):
+        return pd.read_json(path, dtype={"track_id": str})
+    return pd.read_csv(path, dtype={"track_id": str})
+
+def _append_csv(csv_path, batch):
+    import pandas as pd
+    frame = pd.DataFrame({name: values for name, values in batch.items() if values is not None})
+    if os.path.exists(csv_path) and os.path.getsize(csv_path):
+        header = list(pd.read_csv(csv_path, nrows=0).columns)
+        frame = frame.reindex(columns=header)
+        frame.to_csv(csv_path, mode="a", header=False, index=False)
+    else:
+        frame.to_csv(csv_path, index=False)
+
+def ingest(columns, path=CATALOGUE_PATH, csv_path=None):
+    """
+    Appends a batch of tracks (columns as for write_segment, or a DataFrame)
+    in one transaction. Tracks without an id or energy/valence, ids already
+    in the catalogue and ids repeated within the batch are skipped.
+    Accepted tracks are also appended to csv_path, if given, so the source
+    CSV stays complete without being rewritten.
+
+    Returns counts: added, existing, duplicates, invalid.
+    """
+    ids = np.array(_text(columns["track_id"]), dtype=object)
+    energy = np.asarray(columns["energy"], dtype=np.float64)
+    valence = np.asarray(columns["valence"], dtype=np.float64)
+    valid = (ids != "") & np.isfinite(energy) & np.isfinite(valence)
+
+    with _writer_lock(path):
+        segments = _read_segments(path)
+        _remove_orphans(path, segments)
+        existing = Catalogue(path).contains(ids) if segments else np.zeros(len(ids), dtype=bool)
+
+        first = np.zeros(len(ids), dtype=bool)
+        first[np.unique(ids, return_index=True)[1]] = True
+        keep = valid & first & ~existing
+        report = {
+            "added": 0,
+            "existing": int((valid & first & existing).sum()),
+            "duplicates": int((valid & ~first).sum()),
+            "invalid": int((~valid).sum()),
+        }
+        if not keep.any():
+            return report
+
+        batch = {name: None if values is None else np.asarray(values, dtype=object)[keep]
+                 for name, values in columns.items()}
+        name = _next_segment(segments)
+        report["added"] = write_segment(os.path.join(path, name), batch)
+        segments.append(name)
+        write_manifest(path, segments)   # commit point
+        logger.info("Ingested %d tracks into %s/%s", report["added"], path, name)
+
+        if csv_path:
+            _append_csv(csv_path, batch)
+        if len(segments) > MAX_SEGMENTS:
+            _compact(path, segments, keep_largest=True)
+    return report
+
+def compact(path=CATALOGUE_PATH):
+    """
+    Merges all segments into one (e.g. after many small ingests).
+    """
+    with _writer_lock(path):
+        segments = _read_segments(path)
+        if len(segments) > 1:
+            _compact(path, segments, keep_largest=False)
+
+def _compact(path, segments, keep_largest):
+    # Caller holds the writer lock. With keep_largest, the biggest segment
+    # (normally the original compile) stays as it is and the rest are merged.
+    opened = {name: Segment(os.path.join(path, name)) for name in segments}
+    sizes = {name: len(segment) for name, segment in opened.items()}
+    kept = [max(segments, key=sizes.get)] if keep_largest else []
+    merged = [name for name in segments if name not in kept]
+    parts = [opened[name].columns() for name in merged]
+    columns = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+    name = _next_segment(segments)
+    write_segment(os.path.join(path, name), columns)
+    write_manifest(path, kept + [name])
+    del opened, parts
+    for old in merged:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    logger.info("Merged %d segments into %s/%s", len(merged), path, name)
+
+
+_catalogue = None
+_catalogue_lock = threading.Lock()
+
+def get_catalogue():
+    """
+    Returns the catalogue at CATALOGUE_PATH, or None if it was never built.
+    Reopens it when its manifest changed (after an ingest or a recompile).
+    """
+    global _catalogue
+    try:
+        mtime = os.stat(os.path.join(CATALOGUE_PATH, "manifest.json")).st_mtime_ns
+    except FileNotFoundError:
+        return _catalogue
+    if _catalogue is None or _catalogue.mtime != mtime:
+        with _catalogue_lock:
+            if _catalogue is None or _catalogue.mtime != mtime:
+                try:
+                    _catalogue = Catalogue(CATALOGUE_PATH)
+                except FileNotFoundError:
+                    pass   # swapped while opening; the next call retries
+    return _catalogue
+
+def reload_catalogue():
+    global _catalogue
+    with _catalogue_lock:
+        _catalogue = None
+    return get_catalogue()
+
+def pick(emotion, genre=None, recent=None):
+    """
+    Chooses one track for an emotion that is not in recent (a RecentTracks),
+    and records it there. Returns the track dict, or None without a catalogue.
+    """
+    catalogue = get_catalogue()
+    if catalogue is None:
+        return None
+    tracks = catalogue.recommend(emotion, 1, genre, list(recent) if recent is not None else ())
+    if not tracks:
+        return None
+    if recent is not None:
+        recent.add(tracks[0]["track_id"])
+    return tracks[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build, extend and query the track catalogue.")
+    parser.add_argument("--catalogue", default=CATALOGUE_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("compile", help="compile a tracks CSV")
+    build.add_argument("csv", nargs="?", default="tracks_with_mood.csv")
+    add = commands.add_parser("ingest", help="append tracks from CSV/JSON files in one transaction")
+    add.add_argument("files", nargs="+")
+    add.add_argument("--csv", help="also append the accepted tracks to this CSV")
+    add.add_argument("--genre", help="genre for tracks that have none")
+    commands.add_parser("compact", help="merge all segments into one")
+    query = commands.add_parser("query", help="recommend tracks for an emotion")
+    query.add_argument("emotion")
+    query.add_argument("-k", type=int, default=5)
+    query.add_argument("--genre")
+    args = parser.parse_args(argv)
+
+    if args.command == "compile":
+        started = time.perf_counter()
+        rows = compile_csv(args.csv, args.catalogue)
+        print(f"Compiled {rows} tracks into {args.catalogue} in {time.perf_counter() - started:.1f}s")
+        return
+
+    if args.command == "ingest":
+        import pandas as pd
+        batch = pd.concat([read_tracks(path) for path in args.files], ignore_index=True)
+        if args.genre:
+            genre = batch["track_genre"] if "track_genre" in batch else pd.Series(index=batch.index, dtype=object)
+            batch["track_genre"] = genre.fillna(args.genre)
+        started = time.perf_counter()
+        report = ingest(batch, args.catalogue, args.csv)
+        print(f"Added {report['added']} tracks in {time.perf_counter() - started:.2f}s; skipped "
+              f"{report['existing']} already present, {report['duplicates']} repeated, "
+              f"{report['invalid']} without id or energy/valence")
+        return
+
+    if args.command == "compact":
+        compact(args.catalogue)
+        print(f"{args.catalogue}: {len(Catalogue(args.catalogue).segments)} segment(s)")
+        return
+
+    started = time.perf_counter()
+    catalogue = Catalogue(args.catalogue)
+    loaded = time.perf_counter()
+    tracks = catalogue.recommend(args.emotion, args.k, args.genre)
+    queried = time.perf_counter()
+    for track in tracks:
+        print(f"{track['distance']:.3f}  {track['mood']:<14} {track['track_genre']:<12} "
+              f"{track['track_name']} - {track['artists']} ({track['track_id']})")
+    print(f"{len(catalogue)} tracks, opened in {(loaded - started) * 1000:.1f} ms, "
+          f"queried in {(queried - loaded) * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
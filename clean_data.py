@@ -1,32 +1,190 @@
+import argparse
+import io
+import os
+import resource
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 
-# Load dataset
-df = pd.read_csv("tracks.csv", low_memory=False)
+import catalogue
+
+# Streams tracks.csv in chunks, reading only the columns the app uses, and
+# writes them both as CSV and as a columnar catalogue (see catalogue.py).
+# The input is split into line-aligned byte ranges that are cleaned in
+# parallel; the outputs are stitched together in input order.
+#
+#   python clean_data.py                       # tracks.csv -> tracks_cleaned.csv (+ .catalogue)
+#   python clean_data.py big.csv --jobs 8 --chunksize 100000
+
+# Everything else in tracks.csv (popularity, explicit, danceability, key,
+# loudness, mode, speechiness, acousticness, instrumentalness, liveness,
+# tempo, time_signature and the unnamed index) is never read
+KEEP_COLUMNS = ["track_id", "artists", "album_name", "track_name",
+                "duration_ms", "energy", "valence", "track_genre"]
+
+DTYPES = {
+    "track_id": "string",
+    "artists": "category",
+    "album_name": "string",
+    "track_name": "string",
+    "duration_ms": "float64",   # may have gaps; stored as int32 below
+    "energy": "float32",
+    "valence": "float32",
+    "track_genre": "category",
+}
+
+
+class ByteRange(io.RawIOBase):
+    """
+    Read-only view of bytes [start, end) of a file.
+    """
+
+    def __init__(self, path, start, end):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._left = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self._file.readinto(memoryview(buffer)[:min(len(buffer), self._left)])
+        self._left -= n
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def shard_ranges(path, shards):
+    """
+    Splits the file after its header into at most `shards` byte ranges that
+    start and end on line boundaries. Assumes no quoted field spans lines,
+    which holds for the Spotify track dumps; use one shard otherwise.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.readline()
+        data_start = f.tell()
+        bounds = [data_start]
+        for i in range(1, shards):
+            f.seek(max(data_start + (size - data_start) * i // shards, bounds[-1]))
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > bounds[-1]:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def clean_chunk(df):
+    """
+    Drops unusable rows and narrows the dtypes.
+    """
+    df = df.dropna(subset=["track_id"])
+    df["duration_ms"] = df["duration_ms"].fillna(0).astype("int32")
+    return df
+
+def clean_shard(path, header, start, end, csv_part, segment_dir, chunksize):
+    """
+    Cleans one byte range chunk by chunk: each chunk is appended to csv_part
+    and written as its own catalogue segment under segment_dir (named in
+    chunk order), so a worker only ever holds one chunk.
+    Returns (rows, segments, seconds).
+    """
+    started = time.perf_counter()
+    usecols = [c for c in KEEP_COLUMNS if c in header]
+    rows = segments = 0
+    with ByteRange(path, start, end) as raw, open(csv_part, "w", encoding="utf-8", newline="") as out:
+        reader = pd.read_csv(io.BufferedReader(raw, 1 << 20), header=None, names=header,
+                             usecols=usecols, dtype={c: DTYPES[c] for c in usecols},
+                             chunksize=chunksize)
+        for chunk in reader:
+            chunk = clean_chunk(chunk)[usecols]
+            chunk.to_csv(out, header=False, index=False)
+            rows += len(chunk)
+            if segment_dir is None or chunk.empty:
+                continue
+            columns = {name: (chunk[name].astype("string") if DTYPES[name] == "category"
+                              else chunk[name]).to_numpy()
+                       for name in usecols}
+            columns["mood"] = None   # labelled from energy/valence (see track_moods.py)
+            catalogue.write_segment(os.path.join(segment_dir, catalogue.segment_name(segments)), columns)
+            segments += 1
+    return rows, segments, time.perf_counter() - started
+
+def clean(input_path="tracks.csv", output_path="tracks_cleaned.csv", catalogue_path=None,
+          jobs=None, chunksize=200_000):
+    """
+    Runs the cleaner and returns (rows, seconds). catalogue_path=None skips
+    the columnar output.
+    """
+    started = time.perf_counter()
+    header = list(pd.read_csv(input_path, nrows=0).columns)
+    missing = [c for c in KEEP_COLUMNS if c not in header]
+    if "track_id" in missing or "energy" in missing or "valence" in missing:
+        raise SystemExit(f"{input_path} lacks required columns: {', '.join(missing)}")
+
+    jobs = jobs or os.cpu_count() or 1
+    ranges = shard_ranges(input_path, jobs)
+    staging = catalogue.staging_path(catalogue_path) if catalogue_path else None
+    parts = [f"{output_path}.part-{i}" for i in range(len(ranges))]
+    shard_dirs = [os.path.join(staging, f"shard-{i}") for i in range(len(ranges))] if staging else None
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as pool:
+        futures = [
+            pool.submit(clean_shard, input_path, header, start, end, part,
+                        shard_dirs[i] if staging else None, chunksize)
+            for i, ((start, end), part) in enumerate(zip(ranges, parts))
+        ]
+        results = [future.result() for future in futures]
+
+    with open(output_path, "w", encoding="utf-8", newline="") as out:
+        out.write(",".join(c for c in KEEP_COLUMNS if c in header) + "\n")
+        for part in parts:
+            with open(part, encoding="utf-8", newline="") as f:
+                shutil.copyfileobj(f, out, 1 << 20)
+            os.remove(part)
 
-print("Original columns:", df.columns)
+    if staging:
+        # Number the shards' segments consecutively, in input order
+        segments = []
+        for shard_dir, (_, shard_segments, _) in zip(shard_dirs, results):
+            for k in range(shard_segments):
+                name = catalogue.segment_name(len(segments))
+                os.replace(os.path.join(shard_dir, catalogue.segment_name(k)), os.path.join(staging, name))
+                segments.append(name)
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        catalogue.write_manifest(staging, segments)
+        catalogue.publish(staging, catalogue_path)
 
-# Columns to remove
-cols_to_drop = [
-    "popularity",
-    "explicit",
-    "danceability",
-    "key",
-    "loudness",
-    "mode",
-    "speechiness",
-    "acousticness",
-    "instrumentalness",
-    "liveness",
-    "tempo",
-    "time_signature"
-]
+    rows = sum(r for r, _, _ in results)
+    for i, (shard_rows, shard_segments, seconds) in enumerate(results):
+        print(f"  shard {i}: {shard_rows} rows, {shard_segments} segment(s) in {seconds:.2f}s "
+              f"({shard_rows / max(seconds, 1e-9):,.0f} rows/s)")
+    return rows, time.perf_counter() - started
 
-# Drop the columns
-df = df.drop(columns=cols_to_drop)
 
-print("Remaining columns:", df.columns)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clean tracks.csv into a compact CSV and catalogue.")
+    parser.add_argument("input", nargs="?", default="tracks.csv")
+    parser.add_argument("--output", default="tracks_cleaned.csv")
+    parser.add_argument("--catalogue", default="tracks_cleaned.catalogue",
+                        help="columnar output directory ('' to skip)")
+    parser.add_argument("--jobs", type=int, help="parallel shards (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=200_000, help="rows per chunk, and per catalogue segment")
+    args = parser.parse_args(argv)
 
-# Save cleaned dataset
-df.to_csv("tracks_cleaned.csv", index=False)
+    rows, seconds = clean(args.input, args.output, args.catalogue or None, args.jobs, args.chunksize)
+    peak_mb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+    print(f"Kept columns: {', '.join(KEEP_COLUMNS)}")
+    print(f"{rows} rows in {seconds:.2f}s ({rows / max(seconds, 1e-9):,.0f} rows/s), "
+          f"peak RSS per process {peak_mb:.0f} MB")
+    print(f"{args.output} created successfully")
 
-print("tracks_cleaned.csv created successfully")
+if __name__ == "__main__":
+    main()
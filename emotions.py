@@ -0,0 +1,28 @@
+from enum import IntEnum
+
+
+class FaceEmotion(IntEnum):
+    """
+    Labels produced by the geometric face classifier.
+    The integer values double as compact codes for batch results.
+    """
+    NEUTRAL = 0
+    HAPPY = 1
+    SURPRISED = 2
+    ANGRY = 3
+    SAD = 4
+    NO_FACE = 5
+
+    @property
+    def label(self):
+        return FACE_LABELS[self]
+
+
+FACE_LABELS = {
+    FaceEmotion.NEUTRAL: "Neutral",
+    FaceEmotion.HAPPY: "Happy",
+    FaceEmotion.SURPRISED: "Surprised",
+    FaceEmotion.ANGRY: "Angry",
+    FaceEmotion.SAD: "Sad",
+    FaceEmotion.NO_FACE: "No Face Detected",
+}
@@ -0,0 +1,191 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+import metrics
+import real_emotion
+
+# After the pool breaks (a worker crashed or could not load its model), frames
+# are refused for this long before a new pool is started, doubling on every
+# consecutive failure up to the maximum
+RESTART_BACKOFF_SECONDS = 1.0
+MAX_RESTART_BACKOFF_SECONDS = 60.0
+
+
+class FrameDropped(Exception):
+    """
+    Raised for a queued frame that was superseded by a newer one or rejected
+    because the queue was full.
+    """
+
+
+class FaceUnavailable(Exception):
+    """
+    Raised for frames arriving while a broken pool waits to be restarted.
+    """
+
+
+class FaceInferenceService:
+    """
+    Runs face analysis on a pool of worker processes, each holding its own FaceMesh.
+
+    At most one frame per session waits in the queue: when a newer frame from the
+    same session arrives, the waiting one is dropped (latest frame wins). The queue
+    holds at most max_queue sessions, so latency stays bounded under overload.
+    If the pool breaks, it is restarted after a growing back-off; frames
+    arriving meanwhile fail with FaceUnavailable.
+    """
+
+    def __init__(self, workers=None, max_queue=64, analyze=real_emotion.analyze_face_bytes,
+                 initializer=real_emotion.warm_up):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self._analyze = analyze
+        self._initializer = initializer
+        self._executor = None
+        self._pending = OrderedDict()   # session_id -> (payload, Future)
+        self._lock = threading.RLock()
+        self._in_flight = 0
+        self.dropped = 0
+        self.processed = 0
+        self.restarts = 0
+        self._backoff = 0.0
+        self._broken_until = 0.0
+
+    def _get_executor(self):
+        # Caller holds self._lock. Workers are spawned rather than forked so that
+        # no MediaPipe graph state from the parent leaks into them. Each worker
+        # builds its FaceMesh as it starts, before taking its first frame.
+        if self._executor is None:
+            if time.monotonic() < self._broken_until:
+                raise FaceUnavailable("face workers are restarting")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=self._initializer
+            )
+        return self._executor
+
+    def warm_up(self, timeout=None):
+        """
+        Starts every worker process and waits until each has built its model.
+        Returns the number of distinct workers that answered.
+        """
+        with self._lock:
+            executor = self._get_executor()
+            # Submitted together, so the pool has to start a process for each
+            pings = [executor.submit(os.getpid) for _ in range(self.workers)]
+        try:
+            return len({ping.result(timeout=timeout) for ping in pings})
+        except BrokenProcessPool:
+            with self._lock:
+                self._broken(executor)
+            raise
+
+    def _broken(self, executor):
+        # Caller holds self._lock. Drops the broken pool and delays the next one.
+        if self._executor is not executor:
+            return
+        self._executor = None
+        self._backoff = min(MAX_RESTART_BACKOFF_SECONDS, self._backoff * 2 or RESTART_BACKOFF_SECONDS)
+        self._broken_until = time.monotonic() + self._backoff
+        self.restarts += 1
+        metrics.inc("face_pool_broken")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, session_id, *args):
+        """
+        Queues a frame for session_id and returns a Future for
+        (analysis result, timing spans recorded in the worker).
+        """
+        future = Future()
+        stale = None
+        rejected = False
+        with self._lock:
+            previous = self._pending.pop(session_id, None)
+            if previous is not None:
+                stale = previous[1]
+                self.dropped += 1
+            elif len(self._pending) >= self.max_queue:
+                rejected = True
+                self.dropped += 1
+            if not rejected:
+                self._pending[session_id] = (args, future)
+                self._dispatch()
+            else:
+                metrics.inc("face_frames_rejected")
+
+        if stale is not None:
+            metrics.inc("face_frames_superseded")
+            stale.set_exception(FrameDropped("superseded by a newer frame"))
+        if rejected:
+            future.set_exception(FrameDropped("face queue is full"))
+        return future
+
+    def infer(self, session_id, *args, timeout=None):
+        """
+        Blocking helper: analyzes a frame and returns the result, recording the
+        worker's timings on the calling thread.
+        Raises FrameDropped if the frame never reached a worker.
+        """
+        with metrics.span("face_pool_roundtrip"):
+            result, spans = self.submit(session_id, *args).result(timeout=timeout)
+        metrics.record_spans(spans)
+        return result
+
+    def _dispatch(self):
+        # Caller holds self._lock
+        while self._pending and self._in_flight < self.workers:
+            _, (args, future) = self._pending.popitem(last=False)
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._in_flight += 1
+            executor = None
+            try:
+                executor = self._get_executor()
+                inner = executor.submit(metrics.collect_spans, self._analyze, *args)
+            except (FaceUnavailable, BrokenProcessPool, RuntimeError) as e:
+                self._in_flight -= 1
+                if executor is not None:
+                    self._broken(executor)
+                future.set_exception(e)
+                continue
+            inner.add_done_callback(partial(self._on_done, executor, future))
+
+    def _on_done(self, executor, future, inner):
+        error = inner.exception()
+        with self._lock:
+            self._in_flight -= 1
+            self.processed += 1
+            if isinstance(error, BrokenProcessPool):
+                self._broken(executor)
+            elif error is None:
+                self._backoff = 0.0
+            self._dispatch()
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(inner.result())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": len(self._pending),
+                "in_flight": self._in_flight,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "restarts": self.restarts
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
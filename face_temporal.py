@@ -0,0 +1,172 @@
+import threading
+
+import cv2
+import numpy as np
+
+import metrics
+
+import real_emotion
+from emotions import FaceEmotion
+from real_emotion import FaceFeatures, FaceReading
+
+# Thumbnail used to decide whether a frame changed enough to re-run the mesh
+SIGNATURE_SIZE = (32, 24)
+
+# How far a feature must move back past its threshold before the current label
+# is released. This stops the label flickering when a feature sits on a threshold.
+HYSTERESIS = FaceFeatures(smile=0.003, mar=0.03, brow_raise=0.005, glabella=0.01)
+
+# Same order as the rules in real_emotion.classify_features
+PRIORITY = [FaceEmotion.HAPPY, FaceEmotion.SURPRISED, FaceEmotion.ANGRY,
+            FaceEmotion.SAD, FaceEmotion.NEUTRAL]
+
+
+def frame_signature(image_bytes):
+    """
+    Returns a small grayscale thumbnail of an encoded frame, or None if it
+    cannot be decoded. The JPEG is decoded at 1/8 scale, which costs a fraction
+    of a full decode.
+    """
+    if not image_bytes:
+        return None
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    small = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if small is None:
+        return None
+    return cv2.resize(small, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+def label_holds(label, features, margin=HYSTERESIS):
+    """
+    Checks whether label's rule still holds with its thresholds relaxed by margin.
+    """
+    smile, mar, brow, glab = features
+    if label == FaceEmotion.HAPPY:
+        return smile > real_emotion.HAPPY_SMILE - margin.smile
+    if label == FaceEmotion.SURPRISED:
+        return (mar > real_emotion.SURPRISE_MAR - margin.mar
+                and brow > real_emotion.SURPRISE_BROW - margin.brow_raise)
+    if label == FaceEmotion.ANGRY:
+        return (glab < real_emotion.ANGRY_GLABELLA + margin.glabella
+                and brow < real_emotion.ANGRY_BROW + margin.brow_raise)
+    if label == FaceEmotion.SAD:
+        return smile < real_emotion.SAD_SMILE + margin.smile
+    return False
+
+
+class FaceStreamFilter:
+    """
+    Per-session temporal layer around face analysis.
+
+    Frames whose thumbnail barely differs from the last analysed frame reuse
+    that frame's reading instead of running the mesh again (at most max_skips
+    times in a row). Features are smoothed with an exponential moving average,
+    and the label only changes once the old label's rule clearly stops holding.
+    """
+
+    def __init__(self, diff_threshold=3.0, max_skips=10, alpha=0.4):
+        self.diff_threshold = diff_threshold
+        self.max_skips = max_skips
+        self.alpha = alpha
+        self.analyzed = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._signature = None   # thumbnail of the last analysed frame
+        self._raw = None         # reading of the last analysed frame
+        self._skips = 0
+        self._smoothed = None
+        self._label = FaceEmotion.NEUTRAL
+
+    def process(self, image_bytes, analyze, encoded=True):
+        """
+        Returns a smoothed FaceReading for the frame. analyze(image_bytes) is
+        only called when the frame changed; its exceptions propagate.
+        encoded=False marks a payload that is not an encoded image (client
+        landmarks): it is always analysed and only smoothed here.
+        """
+        signature = frame_signature(image_bytes) if encoded else None
+        with self._lock:
+            raw = self._reusable(signature)
+            if raw is not None:
+                self._skips += 1
+                self.skipped += 1
+                metrics.inc("face_frames_skipped")
+
+        if raw is None:
+            raw = analyze(image_bytes)
+            with self._lock:
+                self._signature = signature
+                self._raw = raw
+                self._skips = 0
+                self.analyzed += 1
+
+        with self._lock:
+            return self._smooth(raw)
+
+    def _reusable(self, signature):
+        # Caller holds self._lock
+        if signature is None or self._signature is None or self._raw is None:
+            return None
+        if self._skips >= self.max_skips:
+            return None
+        if np.mean(np.abs(signature - self._signature)) >= self.diff_threshold:
+            return None
+        return self._raw
+
+    def _smooth(self, raw):
+        # Caller holds self._lock
+        if raw.features is None:
+            # No face: start smoothing afresh when it comes back
+            self._smoothed = None
+            self._label = FaceEmotion.NEUTRAL
+            return raw
+
+        current = np.array(raw.features, dtype=np.float64)
+        if self._smoothed is None:
+            self._smoothed = current
+        else:
+            self._smoothed = self.alpha * current + (1 - self.alpha) * self._smoothed
+        features = FaceFeatures(*(float(f) for f in self._smoothed))
+
+        label = FaceEmotion(int(real_emotion.classify_features(features)))
+        if (label != self._label
+                and PRIORITY.index(label) > PRIORITY.index(self._label)
+                and label_holds(self._label, features)):
+            label = self._label
+        self._label = label
+        return FaceReading(label, features, raw.bbox)
+
+
+class FaceTracker:
+    """
+    Per-session face position. The next frame's mesh runs on a padded crop
+    around the last face box instead of the whole frame; until a face is
+    found, and again as soon as it is lost, there is no search region and
+    the whole frame is searched.
+    """
+
+    def __init__(self, padding=0.3, min_size=0.15):
+        self.padding = padding     # added on every side, as a fraction of the box
+        self.min_size = min_size   # smallest region side, as a fraction of the frame
+        self.bbox = None
+
+    def search_region(self):
+        """
+        Returns the region (x, y, width, height) to search next, or None.
+        """
+        bbox = self.bbox
+        if bbox is None:
+            return None
+        x, y, width, height = bbox
+        half_w = max(width * (1 + 2 * self.padding), self.min_size) / 2
+        half_h = max(height * (1 + 2 * self.padding), self.min_size) / 2
+        cx, cy = x + width / 2, y + height / 2
+        x0, x1 = max(0.0, cx - half_w), min(1.0, cx + half_w)
+        y0, y1 = max(0.0, cy - half_h), min(1.0, cy + half_h)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        # Rounded, so that a still face keeps asking for the same region
+        # (it is part of the result cache key)
+        return (round(x0, 3), round(y0, 3), round(x1 - x0, 3), round(y1 - y0, 3))
+
+    def update(self, reading):
+        self.bbox = reading.bbox
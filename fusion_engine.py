@@ -1,74 +1,210 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+import metrics
+from emotions import FaceEmotion
+
+logger = logging.getLogger(__name__)
+
+# The psychological rules live in a declarative table so they can be changed
+# without editing code. They are compiled into a dense face x voice lookup,
+# recompiled when the file changes (see check_rules_file).
+RULES_PATH = os.environ.get(
+    "FUSION_RULES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fusion_rules.json")
+)
+# How often the rules file is checked for edits; 0 turns reloading off
+RULES_CHECK_SECONDS = float(os.environ.get("FUSION_RULES_CHECK_SECONDS", 5))
+
+
+def normalize_face(face_input):
+    """
+    Maps a face input to a FaceEmotion. Face input is a FaceEmotion from
+    real_emotion, or (legacy) a descriptive string such as "Happy: Corners lifted...".
+    """
+    if isinstance(face_input, FaceEmotion):
+        return face_input
+    if "Happy" in face_input: return FaceEmotion.HAPPY
+    elif "Sad" in face_input: return FaceEmotion.SAD
+    elif "Surprised" in face_input: return FaceEmotion.SURPRISED
+    elif "Angry" in face_input: return FaceEmotion.ANGRY
+    return FaceEmotion.NEUTRAL
+
+
+class FusionRules:
+    """
+    A rule table compiled into lookup tables indexed by
+    (FaceEmotion code, voice code). Outcome strings are interned, so a cell
+    holds only small integer ids plus the confidence.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.rules = table["rules"]
+        for rule in self.rules:
+            for key in ("face", "voice"):
+                check_selector(rule.get("name", "?"), key, rule[key])
+        self.voice_aliases = table.get("voice_aliases", {})
+        self.face_terms = tuple(table["face_terms"][face.name] for face in FaceEmotion)
+        self.voice_labels = tuple(table["voice_labels"])
+        self.voice_codes = {voice: code for code, voice in enumerate(self.voice_labels)}
+
+        moods, reasonings = {}, {}
+        shape = (len(self.face_terms), len(self.voice_labels))
+        self.mood_ids = np.zeros(shape, dtype=np.int16)
+        self.reasoning_ids = np.zeros(shape, dtype=np.int16)
+        self.confidences = np.zeros(shape, dtype=np.float64)
+        self._cells = []
+        for f, face in enumerate(self.face_terms):
+            row = []
+            for v, voice in enumerate(self.voice_labels):
+                result = self.evaluate(face, voice)
+                self.mood_ids[f, v] = moods.setdefault(result["final_mood"], len(moods))
+                self.reasoning_ids[f, v] = reasonings.setdefault(result["reasoning"], len(reasonings))
+                self.confidences[f, v] = result["confidence"]
+                row.append({key: sys.intern(value) if isinstance(value, str) else value
+                            for key, value in result.items()})
+            self._cells.append(row)
+        self.moods = tuple(sys.intern(mood) for mood in moods)
+        self.reasonings = tuple(sys.intern(reasoning) for reasoning in reasonings)
+
+    def _matches(self, selector, value, face):
+        if selector == "*":
+            return True
+        if selector == "=face":
+            # e.g. voice 'Sadness' == face 'Sad'
+            return self.voice_aliases.get(value, value) == face
+        return value in selector   # a list of labels (see check_selector)
+
+    def evaluate(self, face, voice):
+        """
+        Interprets the rules directly for a face term and a voice label.
+        Used to compile the table, and for voice labels outside its vocabulary.
+        """
+        for rule in self.rules:
+            if self._matches(rule["face"], face, face) and self._matches(rule["voice"], voice, face):
+                fields = {"face": face, "voice": voice}
+                return {
+                    "final_mood": rule["final_mood"].format(**fields),
+                    "confidence": float(rule["confidence"]),
+                    "reasoning": rule["reasoning"].format(**fields)
+                }
+        raise ValueError(f"No fusion rule matches face {face!r} and voice {voice!r}")
+
+    def fuse(self, face_code, voice):
+        code = self.voice_codes.get(voice)
+        if code is None:
+            return self.evaluate(self.face_terms[face_code], voice)
+        return dict(self._cells[face_code][code])
+
+
+def check_selector(rule_name, key, selector):
+    """
+    A rule's face or voice selector is "*", "=face" (voice only) or a list
+    of labels. Raises ValueError otherwise: a bare label string would match
+    as a substring ("Sadness" would catch "Sad").
+    """
+    if selector == "*" or (selector == "=face" and key == "voice"):
+        return
+    if isinstance(selector, list) and all(isinstance(label, str) for label in selector):
+        return
+    raise ValueError(f'Rule {rule_name!r}: the {key} selector must be "*", "=face" (voice only) '
+                     f'or a list of labels, not {selector!r}')
+
+def load_rules(path=None):
+    path = path or RULES_PATH
+    mtime = os.stat(path).st_mtime_ns
+    with open(path, encoding="utf-8") as f:
+        rules = FusionRules(json.load(f))
+    rules.path, rules.mtime = path, mtime
+    return rules
+
+_rules = load_rules()
+_rules_lock = threading.Lock()
+_watcher = None
+
+def reload_rules(path=None):
+    """
+    Recompiles the rule table now, e.g. from another file. Raises if the
+    table is invalid, and the old one stays in use.
+    """
+    global _rules
+    with _rules_lock:
+        _rules = load_rules(path)
+    return _rules
+
+def check_rules_file():
+    """
+    Recompiles the rules if their file has changed. An edit that fails to
+    load is logged and the old rules are kept until the file changes again.
+    """
+    global _rules
+    with _rules_lock:
+        rules = _rules
+        try:
+            mtime = os.stat(rules.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == rules.mtime:
+            return
+        try:
+            _rules = load_rules(rules.path)
+            logger.info("Reloaded fusion rules from %s", rules.path)
+        except (OSError, ValueError, KeyError) as e:
+            rules.mtime = mtime
+            logger.error("Could not reload fusion rules from %s: %s", rules.path, e)
+
+def _watch_rules():
+    while True:
+        time.sleep(RULES_CHECK_SECONDS)
+        check_rules_file()
+
+def get_rules():
+    """
+    Returns the compiled rules, without touching the filesystem. A background
+    thread, started on first use, checks the file every RULES_CHECK_SECONDS,
+    so clinicians' edits apply without a restart.
+    """
+    global _watcher
+    if _watcher is None and RULES_CHECK_SECONDS > 0:
+        with _rules_lock:
+            if _watcher is None:
+                _watcher = threading.Thread(target=_watch_rules, name="fusion-rules", daemon=True)
+                _watcher.start()
+    return _rules
+
+
+@metrics.timed("fuse_emotions")
 def fuse_emotions(face_input, voice_input):
     """
     Combines Face and Voice emotion inputs to decide the Final Mood.
-    Uses pure conditional logic (If-Else) based on psychological rules.
-    """
-    
-    # --- 1. CLEAN & NORMALIZE INPUTS ---
-    # Face input comes as a descriptive string (e.g., "Happy: Corners lifted...")
-    # We map it to the 5 core categories.
-    face = "Neutral"
-    if "Happy" in face_input: face = "Happy"
-    elif "Sad" in face_input: face = "Sad"
-    elif "Surprised" in face_input: face = "Surprise"
-    elif "Angry" in face_input: face = "Anger"
-    elif "Neutral" in face_input: face = "Neutral"
-    
-    # Voice input is usually clean, but let's ensure consistency
-    voice = voice_input 
-    
-    print(f"\n   [FUSION ENGINE] Input -> Face: '{face}' | Voice: '{voice}'")
-
-    # --- 2. LOGIC MATRIX (DECISION TREE) ---
-    final_mood = "Neutral"
-    confidence = 0.0
-    reasoning = ""
-
-    # Helper for comparison (Voice 'Sadness' == Face 'Sad')
-    voice_as_face_term = voice
-    if voice == "Sadness": voice_as_face_term = "Sad"
-
-    # RULE 1: Perfect Match
-    if face == voice_as_face_term:
-        final_mood = face
-        confidence = 1.0
-        reasoning = f"Perfect Match: Both face and voice indicate {face}."
-    
-    # RULE 2: The 'Fake Smile' (Depression Detection)
-    elif face == "Happy" and (voice == "Sadness" or voice == "Sad"):
-        final_mood = "Hidden Sadness"
-        confidence = 0.85
-        reasoning = "Fake Smile Detected: Voice tone indicates sadness despite the smiling face."
-
-    # RULE 3: The 'Stoic' (Hidden Anger)
-    elif face == "Neutral" and voice == "Anger":
-        final_mood = "Frustration"
-        confidence = 0.9
-        reasoning = "The Stoic: Face is composed (Neutral) but voice carries Anger, suggesting Frustration."
-
-    # RULE 4: The 'Silent Shock'
-    elif face == "Surprise" and (voice == "Neutral" or voice == "Calm"):
-        final_mood = "Surprise"
-        confidence = 0.9
-        reasoning = "Silent Shock: Visibly surprised but speechless/calm. Visual cue takes priority."
-
-    # RULE 5: Excitement Override
-    elif voice == "Excited" and (face == "Neutral" or face == "Happy"):
-        final_mood = "Excited"
-        confidence = 0.95
-        reasoning = "Excitement Override: High vocal energy overrides the facial expression."
-
-    # RULE 6: The Fallback (Voice Priority)
-    else:
-        final_mood = voice
-        confidence = 0.6
-        reasoning = f"Conflicting Signals: Trusting Voice ({voice}) over Face ({face}) as it's a more raw biological signal."
-
-    # --- 3. OUTPUT ---
-    print(f"   [FUSION RESULT] Final Mood: {final_mood} | Rule: {reasoning}")
-    
-    return {
-        "final_mood": final_mood,
-        "confidence": confidence,
-        "reasoning": reasoning
-    }
+    A constant-time table lookup; see fusion_rules.json for the rules.
+    """
+    return get_rules().fuse(normalize_face(face_input), voice_input)
+
+def voice_code(voice):
+    """
+    Returns the voice label's code in the compiled table, or -1 if it is not in its vocabulary.
+    """
+    return get_rules().voice_codes.get(voice, -1)
+
+def fuse_batch(face_codes, voice_codes):
+    """
+    Fuses whole arrays of FaceEmotion codes and voice codes (see voice_code),
+    e.g. when replaying session logs. Returns (mood_ids, confidences,
+    reasoning_ids); decode ids with get_rules().moods and .reasonings.
+    """
+    face_codes = np.asarray(face_codes, dtype=np.intp)
+    voice_codes = np.asarray(voice_codes, dtype=np.intp)
+    rules = get_rules()
+    if voice_codes.size and (voice_codes.min() < 0 or voice_codes.max() >= len(rules.voice_labels)):
+        raise ValueError("voice code outside the compiled vocabulary")
+    return (rules.mood_ids[face_codes, voice_codes],
+            rules.confidences[face_codes, voice_codes],
+            rules.reasoning_ids[face_codes, voice_codes])
@@ -0,0 +1,52 @@
+# Production serving for app.py:
+#
+#   gunicorn -c gunicorn.conf.py app:app
+#
+# Each worker process serves requests on a pool of threads (gthread), which
+# also carries the /ws/face WebSockets. CPU-heavy work does not run on those
+# threads: FaceMesh runs on each worker's face process pool (face_pool.py),
+# speech recognition waits on a thread executor (stt.py) and, with
+# VOICE_WORKERS set, voice features go to a process pool (audio_logic.py).
+# Per-route limits in app.py answer 503 once a route is at capacity.
+#
+# Sessions (mood state, voice streams, the face filter and tracker) live in
+# the memory of the worker that created them, so one worker is the default:
+# scale it with WEB_THREADS and FACE_WORKERS. Several workers need a load
+# balancer that sends each browser to the same worker every time (sticky on
+# the mt_session cookie); set STICKY_SESSIONS=1 to confirm it does.
+#
+# Everything below can be overridden with the environment variables named.
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+if workers > 1 and os.environ.get("STICKY_SESSIONS") != "1":
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={workers} splits sessions across workers; route each "
+        "mt_session cookie to one worker and set STICKY_SESSIONS=1, or run one worker")
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 32))
+# Each /ws/face socket holds a thread for its whole life; app.py caps the
+# sockets at a quarter of the threads so HTTP routes keep threads of their own
+os.environ["WEB_THREADS"] = str(threads)
+
+# Accepted connections waiting for a thread; past this the kernel refuses them
+backlog = int(os.environ.get("WEB_BACKLOG", 128))
+timeout = int(os.environ.get("WEB_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Songs go out with sendfile(); recycle workers now and then to cap memory growth
+sendfile = True
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", 10000))
+max_requests_jitter = max_requests // 10
+
+# Share the cores between the workers' face pools instead of starting a full
+# pool per worker, and warm each worker up in the background (/readyz
+# answers 503 until it is done) so booting never trips the worker timeout.
+os.environ.setdefault("FACE_WORKERS", str(max(1, multiprocessing.cpu_count() // workers)))
+os.environ.setdefault("WARM_UP", "background")
+
+accesslog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info").lower()
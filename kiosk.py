@@ -0,0 +1,288 @@
+import argparse
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+import metrics
+import real_emotion
+from emotions import FaceEmotion
+
+logger = logging.getLogger(__name__)
+
+# Standalone webcam mode for the clinic kiosks, as a three-stage pipeline:
+#
+#   capture thread --> [latest frame] --> inference thread --> [latest result]
+#          \                                                         |
+#           `--------> [latest frame] --> render (main thread) <-----'
+#
+# Each arrow is a single-slot buffer that keeps only the newest item, so a
+# slow stage skips frames instead of falling behind: the camera is read at
+# its own rate, the display shows every captured frame with the most recent
+# reading drawn over it, and inference always works on the newest frame.
+#
+#   python kiosk.py                     # camera 0, window with FPS overlay
+#   python kiosk.py --infer-width 480   # lighter inference on slow CPUs
+#   python kiosk.py --headless          # no window, telemetry in the log only
+
+WINDOW_TITLE = "Geometric Emotion Detection"
+
+# Frames are downscaled to this width before the mesh runs; landmarks are
+# normalized, so the readings do not change, only the cost does
+INFER_WIDTH = 640
+
+LOG_INTERVAL_SECONDS = 5.0
+
+
+class LatestSlot:
+    """
+    Single-slot buffer between two pipeline stages. put() replaces whatever
+    is waiting; get() waits for something newer than the caller last saw.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._version = 0
+        self.replaced = 0   # items overwritten before anyone took them
+        self.closed = False
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.replaced += 1
+            self._item = item
+            self._version += 1
+            self._cond.notify_all()
+
+    def get(self, seen=0, timeout=None):
+        """
+        Returns (item, version) once version > seen, or (None, seen) on
+        timeout or after close(). The item is taken out of the slot.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._version > seen or self.closed, timeout):
+                return None, seen
+            if self._version <= seen:
+                return None, seen
+            item, self._item = self._item, None
+            return item, self._version
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class Frame(NamedTuple):
+    image: np.ndarray
+    captured_at: float   # time.perf_counter()
+
+
+class Result(NamedTuple):
+    reading: real_emotion.FaceReading
+    key_points: np.ndarray   # (K, 2) normalized, or None without a face
+    captured_at: float
+    infer_seconds: float
+
+
+class StageClock:
+    """
+    Rate and mean duration of one stage, as exponential moving averages.
+    """
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.fps = 0.0
+        self.seconds = 0.0
+        self.count = 0
+        self._last = None
+
+    def tick(self, seconds=0.0):
+        now = time.perf_counter()
+        if self._last is not None and now > self._last:
+            rate = 1.0 / (now - self._last)
+            self.fps = rate if self.count == 1 else self.alpha * rate + (1 - self.alpha) * self.fps
+        self.seconds = seconds if self.count == 0 else self.alpha * seconds + (1 - self.alpha) * self.seconds
+        self._last = now
+        self.count += 1
+
+
+class Telemetry:
+    """
+    Per-stage timings of the pipeline, for the overlay and the log.
+    """
+
+    def __init__(self):
+        self.capture = StageClock()
+        self.inference = StageClock()
+        self.render = StageClock()
+        self.latency = 0.0   # capture to display of the reading shown
+        self._lock = threading.Lock()
+
+    def lines(self):
+        with self._lock:
+            return [
+                f"capture {self.capture.fps:5.1f} fps",
+                f"infer   {self.inference.fps:5.1f} fps  {self.inference.seconds * 1000:5.1f} ms",
+                f"render  {self.render.fps:5.1f} fps  {self.render.seconds * 1000:5.1f} ms",
+                f"latency {self.latency * 1000:5.1f} ms",
+            ]
+
+    def record(self, clock, seconds=0.0):
+        with self._lock:
+            clock.tick(seconds)
+
+    def record_latency(self, seconds, alpha=0.1):
+        with self._lock:
+            self.latency = seconds if self.latency == 0.0 else alpha * seconds + (1 - alpha) * self.latency
+        metrics.observe("kiosk_latency", seconds)
+
+
+# --- Stages ---
+def capture_stage(cap, outputs, telemetry, stop):
+    while not stop.is_set():
+        ok, image = cap.read()
+        if not ok:
+            logger.warning("Camera returned no frame; stopping")
+            break
+        frame = Frame(image, time.perf_counter())
+        for slot in outputs:
+            slot.put(frame)
+        telemetry.record(telemetry.capture)
+    stop.set()
+    for slot in outputs:
+        slot.close()
+
+def infer_frame(face_mesh, image, infer_width=INFER_WIDTH):
+    """
+    Runs the mesh on one frame. Returns (FaceReading, key points or None).
+    Only the key landmarks are read out of the mesh result.
+    """
+    height, width = image.shape[:2]
+    if infer_width and width > infer_width:
+        image = cv2.resize(image, (infer_width, round(height * infer_width / width)),
+                           interpolation=cv2.INTER_AREA)
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    with metrics.span("facemesh_process"):
+        results = face_mesh.process(rgb)
+    if not results.multi_face_landmarks:
+        return real_emotion.FaceReading(FaceEmotion.NO_FACE), None
+    points = real_emotion.key_points(results.multi_face_landmarks[0].landmark)
+    return real_emotion.get_emotion_points(points), points
+
+def inference_stage(face_mesh, frames, results, telemetry, stop, infer_width=INFER_WIDTH):
+    seen = 0
+    while not stop.is_set():
+        frame, seen = frames.get(seen, timeout=0.5)
+        if frame is None:
+            continue
+        started = time.perf_counter()
+        try:
+            reading, points = infer_frame(face_mesh, frame.image, infer_width)
+        except Exception as e:
+            logger.error("Kiosk inference failed: %s", e)
+            continue
+        seconds = time.perf_counter() - started
+        results.put(Result(reading, points, frame.captured_at, seconds))
+        telemetry.record(telemetry.inference, seconds)
+
+def draw(image, result, telemetry_lines):
+    """
+    Draws the key landmarks, the reading and the telemetry onto image.
+    """
+    if result is not None:
+        if result.key_points is not None:
+            h, w = image.shape[:2]
+            for cx, cy in (result.key_points * (w, h)).astype(np.int32):
+                cv2.circle(image, (int(cx), int(cy)), 2, (0, 255, 0), -1)
+        cv2.putText(image, str(result.reading), (20, 50),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+    for i, line in enumerate(telemetry_lines):
+        cv2.putText(image, line, (20, image.shape[0] - 20 - 22 * (len(telemetry_lines) - 1 - i)),
+                    cv2.FONT_HERSHEY_PLAIN, 1.2, (255, 255, 255), 1)
+    return image
+
+
+def run(camera=0, infer_width=INFER_WIDTH, headless=False, log_interval=LOG_INTERVAL_SECONDS):
+    """
+    Runs the kiosk until ESC is pressed (or the camera stops). Rendering
+    stays on the calling thread, which some GUI backends require.
+    """
+    cap = cv2.VideoCapture(camera)
+    if not cap.isOpened():
+        print("Cannot open camera")
+        return
+    # One camera, frame after frame: let MediaPipe track the face
+    face_mesh = real_emotion.new_face_mesh(static_image_mode=False)
+
+    telemetry = Telemetry()
+    to_inference, to_render, results = LatestSlot(), LatestSlot(), LatestSlot()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=capture_stage, name="kiosk-capture",
+                         args=(cap, [to_inference, to_render], telemetry, stop), daemon=True),
+        threading.Thread(target=inference_stage, name="kiosk-inference",
+                         args=(face_mesh, to_inference, results, telemetry, stop, infer_width), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    latest = None
+    frame_seen = result_seen = 0
+    next_log = time.monotonic() + log_interval
+    try:
+        while not stop.is_set():
+            frame, frame_seen = to_render.get(frame_seen, timeout=0.5)
+            if frame is None:
+                continue
+            started = time.perf_counter()
+            result, version = results.get(result_seen, timeout=0)
+            if result is not None:
+                latest, result_seen = result, version
+                telemetry.record_latency(time.perf_counter() - result.captured_at)
+
+            if not headless:
+                # The inference stage may still be reading this frame: draw on a copy
+                cv2.imshow(WINDOW_TITLE, draw(frame.image.copy(), latest, telemetry.lines()))
+                if cv2.waitKey(1) & 0xFF == 27:
+                    break
+            telemetry.record(telemetry.render, time.perf_counter() - started)
+
+            if time.monotonic() >= next_log:
+                next_log += log_interval
+                logger.info("kiosk: %s | frames skipped: inference %d, display %d",
+                            " | ".join(" ".join(line.split()) for line in telemetry.lines()),
+                            to_inference.replaced, to_render.replaced)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for slot in (to_inference, to_render, results):
+            slot.close()
+        for thread in threads:
+            thread.join(timeout=2)
+        cap.release()
+        face_mesh.close()
+        if not headless:
+            cv2.destroyAllWindows()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pipelined webcam emotion kiosk.")
+    parser.add_argument("--camera", type=int, default=0)
+    parser.add_argument("--infer-width", type=int, default=INFER_WIDTH,
+                        help="downscale frames to this width before inference (0: full size)")
+    parser.add_argument("--headless", action="store_true", help="no window; telemetry goes to the log")
+    parser.add_argument("--log-interval", type=float, default=LOG_INTERVAL_SECONDS,
+                        help="seconds between telemetry log lines")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    run(args.camera, args.infer_width, args.headless, args.log_interval)
+
+if __name__ == "__main__":
+    main()
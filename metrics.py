@@ -0,0 +1,146 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+# Latency histogram bucket bounds, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = "music_therapy"
+
+_lock = threading.Lock()
+_histograms = {}   # stage -> [bucket counts..., +Inf count], plus sum in _sums
+_sums = {}
+_counters = {}
+_gauges = {}       # name -> callable returning a number or a {label: number} dict
+
+# Spans of the current request, when per-request timing is switched on
+_request_spans = ContextVar("request_spans", default=None)
+
+
+# --- Recording ---
+def observe(stage, seconds):
+    index = bisect_left(BUCKETS, seconds)
+    with _lock:
+        counts = _histograms.get(stage)
+        if counts is None:
+            counts = _histograms[stage] = [0] * (len(BUCKETS) + 1)
+            _sums[stage] = 0.0
+        counts[index] += 1
+        _sums[stage] += seconds
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+@contextmanager
+def span(stage):
+    """
+    Times the enclosed block into the stage's latency histogram.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def timed(stage):
+    """
+    Decorator form of span().
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def inc(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def register_gauge(name, read):
+    """
+    Registers a callable read at scrape time. It returns a number, or a dict
+    of numbers that become one gauge per key.
+    """
+    _gauges[name] = read
+
+
+# --- Spans across threads and processes ---
+def begin_request():
+    """
+    Starts collecting this request's spans; returns a token for end_request.
+    """
+    return _request_spans.set([])
+
+def end_request(token):
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+def collect_spans(fn, *args):
+    """
+    Runs fn and returns (result, spans). Used in worker processes, whose
+    histograms the web process cannot see; pass the spans to record_spans.
+    """
+    token = begin_request()
+    try:
+        result = fn(*args)
+    finally:
+        spans = end_request(token)
+    return result, spans
+
+def record_spans(spans):
+    for stage, seconds in spans:
+        observe(stage, seconds)
+
+
+# --- Exposition ---
+def render():
+    """
+    Returns all metrics in the Prometheus text format.
+    """
+    lines = []
+    with _lock:
+        histograms = {stage: (list(counts), _sums[stage]) for stage, counts in _histograms.items()}
+        counters = dict(_counters)
+
+    name = f"{PREFIX}_stage_seconds"
+    lines.append(f"# TYPE {name} histogram")
+    for stage, (counts, total) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {cumulative}')
+
+    name = f"{PREFIX}_events_total"
+    lines.append(f"# TYPE {name} counter")
+    for event, value in sorted(counters.items()):
+        lines.append(f'{name}{{event="{event}"}} {value}')
+
+    for gauge, read in sorted(_gauges.items()):
+        try:
+            value = read()
+        except Exception:
+            continue
+        name = f"{PREFIX}_{gauge}"
+        lines.append(f"# TYPE {name} gauge")
+        if isinstance(value, dict):
+            for key, number in sorted(value.items()):
+                lines.append(f'{name}{{key="{key}"}} {number}')
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def server_timing(spans):
+    """
+    Formats spans as a Server-Timing header value (durations in ms).
+    """
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in spans)
@@ -0,0 +1,122 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+import voice_features
+
+logger = logging.getLogger(__name__)
+
+# Microphone capture for the command-line flow, the local counterpart of
+# voice_stream.py: instead of recording for a fixed time, the sound card
+# delivers blocks to a callback that copies them into a preallocated ring
+# buffer, and the caller's thread feeds them to the voice activity detector,
+# stopping as soon as the speaker has finished.
+#
+#   samples, rate = mic_stream.listen()
+#   result = audio_logic.analyze_voice_samples(samples, rate)
+
+# The features and the recognizers need nothing above 16 kHz
+RATE = 16000
+BLOCK_MS = 50
+MAX_SECONDS = 15
+# Give up if nobody has started speaking after this long
+NO_SPEECH_SECONDS = 5.0
+
+
+class RingBuffer:
+    """
+    Preallocated float32 ring holding the most recent `capacity` samples,
+    written by one thread (the audio callback) and read by another.
+    Positions count samples since the start, so a reader asks for
+    everything after the position it last saw.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.written = 0
+        self._data = np.zeros(capacity, dtype=np.float32)
+        self._cond = threading.Condition()
+
+    def write(self, samples):
+        count = len(samples)
+        samples = samples[-self.capacity:]
+        # Copies happen under the lock, so a reader never sees a slot mid-overwrite
+        with self._cond:
+            start = (self.written + count - len(samples)) % self.capacity
+            first = min(len(samples), self.capacity - start)
+            self._data[start:start + first] = samples[:first]
+            self._data[:len(samples) - first] = samples[first:]
+            self.written += count
+            self._cond.notify_all()
+
+    def wait(self, position, timeout=None):
+        """
+        Waits until samples beyond position arrive; False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.written > position, timeout)
+
+    def read(self, since=0, until=None):
+        """
+        Returns (a copy of samples [since, until), until). Samples already
+        overwritten are skipped, so the copy may start later than asked.
+        """
+        with self._cond:
+            until = self.written if until is None else min(until, self.written)
+            since = max(since, self.written - self.capacity, 0)
+            if since >= until:
+                return np.empty(0, dtype=np.float32), until
+            start, end = since % self.capacity, until % self.capacity
+            if start < end:
+                return self._data[start:end].copy(), until
+            return np.concatenate((self._data[start:], self._data[:end])), until
+
+
+def listen(rate=RATE, max_seconds=MAX_SECONDS, no_speech_seconds=NO_SPEECH_SECONDS,
+           device=None, **vad_options):
+    """
+    Records from the microphone until the voice activity detector hears the
+    end of an utterance, at most max_seconds. Returns (samples, rate), with
+    empty samples if nobody spoke. vad_options go to StreamingVoiceAnalyzer.
+    """
+    # Device-bound import stays local, like audio_logic.record_voice
+    import sounddevice as sd
+
+    ring = RingBuffer(int(rate * max_seconds))
+    analyzer = voice_features.StreamingVoiceAnalyzer(rate, **vad_options)
+    overflows = 0
+
+    def on_block(indata, frames, time_info, status):
+        # Runs on the audio thread: copy and return, nothing more
+        nonlocal overflows
+        if status:
+            overflows += 1
+        # One utterance fills the ring at most: never overwrite its start
+        room = ring.capacity - ring.written
+        if room > 0:
+            ring.write(indata[:room, 0])
+
+    position = 0
+    started = time.monotonic()
+    with sd.InputStream(samplerate=rate, channels=1, dtype="float32", device=device,
+                        blocksize=int(rate * BLOCK_MS / 1000), callback=on_block):
+        while position < ring.capacity:
+            if not ring.wait(position, timeout=0.5):
+                if time.monotonic() - started > max_seconds + 1:
+                    logger.warning("Microphone delivered no audio")
+                    break
+                continue
+            block, position = ring.read(position, ring.capacity)
+            if analyzer.push(block):
+                break
+            if not analyzer.speech_started and position >= no_speech_seconds * rate:
+                position = 0
+                break
+
+    # The stream is closed now: nothing writes while the utterance is read out
+    if overflows:
+        logger.warning("Microphone input overflowed %d times", overflows)
+    samples, _ = ring.read(0, position)
+    return samples, rate
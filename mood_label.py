@@ -1,9 +1,13 @@
-import librosa
-import numpy as np
+import logging
 import speech_recognition as sr
 import os
-import pygame
-import time
+
+import audio_logic
+import metrics
+import stt
+import voice_features
+
+logger = logging.getLogger(__name__)
 
 def analyze_voice_input(file_path):
     """
@@ -17,94 +21,61 @@ def analyze_voice_input(file_path):
         "pitch_score": 0.0
     }
 
-    # --- SPEECH TO TEXT ---
-    recognizer = sr.Recognizer()
-    recognizer.energy_threshold = 300
+    try:
+        y, sr_rate = voice_features.read_pcm(file_path)
+    except Exception as e:
+        logger.error("Could not decode audio: %s", e)
+        return result
 
+    # --- SPEECH TO TEXT ---
+    # English and Malayalam are tried concurrently while the physics runs
     try:
-        with sr.AudioFile(file_path) as source:
-            audio_data = recognizer.record(source)
-            try:
-                # English first
-                text = recognizer.recognize_google(audio_data, language='en-US')
-                result['text'] = text
-            except sr.UnknownValueError:
-                # Try Malayalam
-                try:
-                    text_ml = recognizer.recognize_google(audio_data, language='ml-IN')
-                    result['text'] = text_ml
-                except:
-                    result['text'] = "(Could not understand)"
-            except sr.RequestError:
-                print("[ERROR] No internet connection for speech recognition.")
+        pending_text = stt.start(stt.audio_data_from_samples(y, sr_rate))
     except Exception as e:
-        print(f"[CRITICAL] Speech Recognition failed: {e}")
+        logger.error("Speech Recognition failed: %s", e)
+        pending_text = None
 
     # --- PHYSICS & EMOTION LOGIC ---
+    # Same feature engine as audio_logic, with the lowercase 5-emotion labels
     try:
-        y, sr_rate = librosa.load(file_path)
-        max_vol = np.max(np.abs(y))
-        y_clean = y[np.abs(y) > (0.25 * max_vol)]
-        if len(y_clean) == 0: y_clean = y
-
-        rms = librosa.feature.rms(y=y_clean)
-        energy = float(np.mean(rms))
-
-        zcr = librosa.feature.zero_crossing_rate(y=y_clean)
-        pitch_var = float(np.mean(zcr))
+        with metrics.span("voice_features"):
+            energy, pitch_var = voice_features.extract_features(y, sr_rate)
 
         result['energy_score'] = energy
         result['pitch_score'] = pitch_var
 
         # --- MAP ENERGY & PITCH TO 5 EMOTIONS ---
-        if energy < 0.015:
-            result['emotion'] = "neutral"
-        elif energy > 0.08:
-            if pitch_var > 0.05:
-                result['emotion'] = "surprised"
-            else:
-                result['emotion'] = "angry"
-        elif energy > 0.02:
-            if pitch_var > 0.06:
-                result['emotion'] = "happy"
-            else:
-                result['emotion'] = "neutral"
-        else:
-            if pitch_var < 0.03:
-                result['emotion'] = "sad"
-            else:
-                result['emotion'] = "neutral"
+        result['emotion'] = voice_features.label_voice(energy, pitch_var, voice_features.MOOD_LABELS)
 
     except Exception as e:
-        print(f"[CRITICAL] Physics analysis failed: {e}")
+        logger.error("Physics analysis failed: %s", e)
+
+    if pending_text is not None:
+        try:
+            text, _ = stt.collect(pending_text)
+            result['text'] = text or "(Could not understand)"
+        except sr.RequestError:
+            logger.warning("No internet connection for speech recognition.")
+        except Exception as e:
+            logger.error("Speech Recognition failed: %s", e)
 
     return result
 
 # --- SONG SELECTION ---
-def select_song(emotion):
+def select_song(emotion, genre=None, recent=None):
     """
     Return the path of the song corresponding to the detected emotion.
+    Same catalogue lookup as audio_logic.select_song, which also maps the
+    lowercase emotions used here.
     """
-    song_map = {
-        "happy": "audio/malayalam/malayalam_calm.mp3",     # Change to happy song later
-        "sad": "audio/malayalam/malayalam_calm.mp3",
-        "angry": "audio/malayalam/malayalam_calm.mp3",
-        "surprised": "audio/malayalam/malayalam_calm.mp3",
-        "neutral": "audio/malayalam/malayalam_calm.mp3"
-    }
-    return song_map.get(emotion, "audio/malayalam/malayalam_calm.mp3")
+    return audio_logic.select_song(emotion, genre, recent)
 
 # --- PLAY SONG ---
-def play_song(song_path):
-    if os.path.exists(song_path):
-        pygame.mixer.init()
-        pygame.mixer.music.load(song_path)
-        pygame.mixer.music.play()
-        print(f"🎵 Playing: {song_path}")
-        while pygame.mixer.music.get_busy():
-            time.sleep(1)
-    else:
-        print(f"[ERROR] Song not found: {song_path}")
+def play_song(song_path, wait=False):
+    """
+    Starts playback without blocking (see audio_logic.play_song).
+    """
+    audio_logic.play_song(song_path, wait)
 
 # --- MAIN TEST ---
 if __name__ == "__main__":
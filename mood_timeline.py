@@ -0,0 +1,280 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Append-only history of each session's moods, for therapists to look back on.
+#
+# Requests only append an event to an in-memory queue; a background thread
+# writes the queue to SQLite in batches, one transaction each, so no request
+# waits on the disk. The database runs in WAL mode, so the queries below read
+# while the flusher writes, and several server processes can share one file.
+#
+#   face events:  a face reading (face)
+#   voice events: a fused voice answer (face, voice, mood, confidence, energy, pitch)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS mood_events (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    source TEXT NOT NULL,
+    face TEXT,
+    voice TEXT,
+    mood TEXT,
+    confidence REAL,
+    energy REAL,
+    pitch REAL
+);
+-- Every query filters on (session_id, ts); the trailing columns let the
+-- distributions be counted from the index alone
+CREATE INDEX IF NOT EXISTS mood_events_session_ts
+    ON mood_events (session_id, ts, source, face, mood);
+"""
+
+COLUMNS = ("session_id", "ts", "source", "face", "voice", "mood", "confidence", "energy", "pitch")
+INSERT = f"INSERT INTO mood_events ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+
+FLUSH_INTERVAL_SECONDS = 1.0
+BATCH_SIZE = 500
+# Events queued beyond this (the disk cannot keep up) drop the oldest
+MAX_PENDING = 50_000
+MAX_BUCKETS = 1000
+# The camera sends several frames a second: a face reading equal to the
+# session's previous one is kept at most once per this many seconds, so
+# face counts read roughly as seconds on camera
+FACE_REPEAT_SECONDS = 1.0
+# Sessions whose last face reading is remembered for the above
+MAX_TRACKED_SESSIONS = 10_000
+
+
+def connect(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    # WAL keeps committed batches safe from crashes; only a power cut can lose the last ones
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+class MoodTimeline:
+    """
+    Buffered writer and query interface for the mood_events table.
+
+    record_face and record_voice never touch the database; events reach it
+    within flush_interval seconds, or sooner once batch_size are waiting.
+    Queries flush first, so they see everything recorded before them.
+    A face reading repeating the session's last one within
+    face_repeat_seconds is not recorded again.
+    """
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL_SECONDS, batch_size=BATCH_SIZE,
+                 max_pending=MAX_PENDING, face_repeat_seconds=FACE_REPEAT_SECONDS):
+        self.path = path
+        self.face_repeat_seconds = face_repeat_seconds
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._pending = deque(maxlen=max_pending)
+        self._last_face = OrderedDict()   # session id -> (face, ts) of its last kept reading
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._writer = None
+        self._readers = threading.local()
+        self._flusher = None
+        self._closed = False
+
+    # --- Recording ---
+    def record_face(self, session_id, face, ts=None):
+        ts = time.time() if ts is None else ts
+        with self._cond:
+            last = self._last_face.get(session_id)
+            if last is not None and last[0] == face and 0 <= ts - last[1] < self.face_repeat_seconds:
+                return
+            self._last_face[session_id] = (face, ts)
+            self._last_face.move_to_end(session_id)
+            if len(self._last_face) > MAX_TRACKED_SESSIONS:
+                self._last_face.popitem(last=False)
+        self._append((session_id, ts, "face", face, None, None, None, None, None))
+
+    def record_voice(self, session_id, face, voice, mood, confidence=None, energy=None, pitch=None,
+                     ts=None):
+        self._append((session_id, time.time() if ts is None else ts, "voice",
+                      face, voice, mood, confidence, energy, pitch))
+
+    def _append(self, event):
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(event)
+            if self._flusher is None:
+                # Started on first use: spawned face workers import the app but never record
+                self._flusher = threading.Thread(target=self._run, name="mood-timeline", daemon=True)
+                self._flusher.start()
+                atexit.register(self.close)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or len(self._pending) >= self.batch_size,
+                                    self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        """
+        Writes everything queued so far. Returns the number of events written.
+        """
+        with self._write_lock:
+            with self._cond:
+                batch = list(self._pending)
+                self._pending.clear()
+            if not batch:
+                return 0
+            try:
+                with metrics.span("mood_timeline_flush"):
+                    if self._writer is None:
+                        self._writer = connect(self.path)
+                    with self._writer:
+                        self._writer.executemany(INSERT, batch)
+            except sqlite3.Error as e:
+                logger.error("Could not write %d mood timeline events: %s", len(batch), e)
+                self.failed += len(batch)
+                return 0
+            self.written += len(batch)
+            return len(batch)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    # --- Queries ---
+    def _reader(self):
+        db = getattr(self._readers, "db", None)
+        if db is None:
+            db = self._readers.db = connect(self.path)
+        return db
+
+    def _range(self, session_id, since, until):
+        db = self._reader()
+        if since is None or until is None:
+            first, last = db.execute(
+                "SELECT MIN(ts), MAX(ts) FROM mood_events WHERE session_id = ?", (session_id,)).fetchone()
+            if first is None:
+                return db, None, None
+            since = first if since is None else since
+            until = last + 1e-3 if until is None else until
+        return db, since, until
+
+    def timeline(self, session_id, since=None, until=None, buckets=200):
+        """
+        The session's history in at most `buckets` equal time slices between
+        since and until (epoch seconds; default: its first and last events).
+        Each slice gives the most frequent face reading and fused mood, the
+        last voice emotion and the mean confidence, energy and pitch of the
+        voice answers in it. Slices without events are left out.
+        """
+        self.flush()
+        buckets = max(1, min(int(buckets), MAX_BUCKETS))
+        db, since, until = self._range(session_id, since, until)
+        if since is None or until <= since:
+            return {"session_id": session_id, "since": since, "until": until,
+                    "bucket_seconds": None, "points": []}
+        width = (until - since) / buckets
+
+        # Face readings are the bulk of a session: counted from the index alone
+        faces = db.execute(
+            """
+            SELECT MIN(CAST((ts - ?1) / ?2 AS INTEGER), ?3 - 1) AS bucket, face, COUNT(*)
+            FROM mood_events
+            WHERE session_id = ?4 AND ts >= ?1 AND ts < ?5 AND source = 'face'
+            GROUP BY bucket, face
+            """, (since, width, buckets, session_id, until))
+        # Voice answers come one per spoken reply, few enough to fold here
+        answers = db.execute(
+            """
+            SELECT ts, voice, mood, confidence, energy, pitch
+            FROM mood_events
+            WHERE session_id = ? AND ts >= ? AND ts < ? AND source = 'voice'
+            ORDER BY ts
+            """, (session_id, since, until))
+
+        slices = {}
+        def slice_at(bucket):
+            return slices.setdefault(bucket, {"faces": Counter(), "moods": Counter(), "voice": None,
+                                              "answers": 0, "sums": [0.0, 0.0, 0.0]})
+        for bucket, face, count in faces:
+            slice_at(bucket)["faces"][face] += count
+        for ts, voice, mood, *scores in answers:
+            point = slice_at(min(int((ts - since) / width), buckets - 1))
+            point["moods"][mood] += 1
+            point["voice"] = voice
+            point["answers"] += 1
+            for i, score in enumerate(scores):
+                point["sums"][i] += score or 0.0
+
+        points = []
+        for bucket in sorted(slices):
+            point = slices[bucket]
+            answers = point["answers"]
+            means = [round(total / answers, 4) if answers else None for total in point["sums"]]
+            points.append({
+                "t": since + bucket * width,
+                "face": point["faces"].most_common(1)[0][0] if point["faces"] else None,
+                "mood": point["moods"].most_common(1)[0][0] if point["moods"] else None,
+                "voice": point["voice"],
+                "face_readings": sum(point["faces"].values()),
+                "voice_answers": answers,
+                "confidence": means[0],
+                "energy": means[1],
+                "pitch": means[2],
+            })
+        return {"session_id": session_id, "since": since, "until": until,
+                "bucket_seconds": width, "points": points}
+
+    def distribution(self, session_id, since=None, until=None):
+        """
+        How often each face reading and each fused mood occurred in the
+        session, as counts and fractions.
+        """
+        self.flush()
+        db = self._reader()
+        rows = db.execute(
+            """
+            SELECT source, CASE source WHEN 'face' THEN face ELSE mood END AS label, COUNT(*)
+            FROM mood_events
+            WHERE session_id = ? AND ts >= ? AND ts < ?
+            GROUP BY source, label
+            """, (session_id, float("-inf") if since is None else since,
+                  float("inf") if until is None else until)).fetchall()
+
+        result = {"session_id": session_id, "face": {}, "mood": {}}
+        for source, label, count in rows:
+            result["face" if source == "face" else "mood"][label] = count
+        for key in ("face", "mood"):
+            total = sum(result[key].values())
+            result[key] = {label: {"count": count, "share": round(count / total, 4)}
+                           for label, count in sorted(result[key].items(), key=lambda kv: -kv[1])}
+        return result
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {"pending": pending, "written": self.written, "dropped": self.dropped, "failed": self.failed}
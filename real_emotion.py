@@ -1,190 +1,415 @@
 import cv2
+import logging
 import math
-import mediapipe as mp
-
-# Direct access to the internal modules to bypass the "solutions" error
-try:
-    from mediapipe.python.solutions import face_mesh as mp_face_mesh
-    from mediapipe.python.solutions import drawing_utils as mp_drawing
-except ImportError:
-    # Fallback for newer MediaPipe structures
-    import mediapipe.solutions.face_mesh as mp_face_mesh
-    import mediapipe.solutions.drawing_utils as mp_drawing
-
-# Initialize using the direct reference
-face_mesh_module = mp_face_mesh.FaceMesh(
-    static_image_mode=False,
-    max_num_faces=1,
-    min_detection_confidence=0.5,
-    min_tracking_confidence=0.5
-)
+import threading
+from dataclasses import dataclass
+from typing import NamedTuple
+import numpy as np
+
+import metrics
+from emotions import FaceEmotion
+
+logger = logging.getLogger(__name__)
+
+# MediaPipe is imported and the FaceMesh graph built on first use (or by
+# warm_up), so importing this module stays cheap for processes that never
+# run the mesh themselves, such as the web server that hands frames to face_pool.
+_face_mesh = None
+_face_mesh_lock = threading.Lock()
+
+def _face_mesh_solution():
+    # Direct access to the internal modules to bypass the "solutions" error
+    try:
+        from mediapipe.python.solutions import face_mesh as mp_face_mesh
+    except ImportError:
+        # Fallback for newer MediaPipe structures
+        import mediapipe.solutions.face_mesh as mp_face_mesh
+    return mp_face_mesh
+
+def new_face_mesh(static_image_mode=True):
+    """
+    Builds a FaceMesh. Video mode (static_image_mode=False) tracks the face
+    from one call to the next, which only helps when every call gets the
+    next frame of the same camera, as in detect_emotion_video.
+    """
+    return _face_mesh_solution().FaceMesh(
+        static_image_mode=static_image_mode,
+        max_num_faces=1,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    )
+
+def get_face_mesh():
+    """
+    Returns this process's FaceMesh, building it on the first call. It runs
+    in static image mode: a face pool worker serves frames from many
+    sessions, so MediaPipe's own tracking would follow one session's face
+    into the next session's frame. Per-session tracking is done by cropping
+    to the last face position instead (see analyze_face_image).
+    """
+    global _face_mesh
+    if _face_mesh is None:
+        with _face_mesh_lock:
+            if _face_mesh is None:
+                with metrics.span("facemesh_load"):
+                    _face_mesh = new_face_mesh(static_image_mode=True)
+    return _face_mesh
+
+def warm_up():
+    """
+    Builds the FaceMesh and runs it once on a blank frame, so the first real
+    frame does not pay for graph construction. Safe to call more than once.
+    """
+    get_face_mesh().process(np.zeros((64, 64, 3), dtype=np.uint8))
+
+
+# --- Points of Interest ---
+NUM_LANDMARKS = 468
+
+# Gathered in one go into a (K, 2) array; the positions below index that array.
+KEY_LANDMARKS = np.array([
+    13, 14, 61, 291,    # Mouth: top lip, bottom lip, left corner, right corner
+    55, 285, 105, 334,  # Eyebrows: left/right inner, left/right mid
+    159, 386, 33, 263   # Eyes: left/right top, left/right outer corner
+])
+(TOP_LIP, BOTTOM_LIP, LEFT_CORNER, RIGHT_CORNER,
+ L_BROW_INNER, R_BROW_INNER, L_BROW_MID, R_BROW_MID,
+ L_EYE_TOP, R_EYE_TOP, L_EYE_OUTER, R_EYE_OUTER) = range(len(KEY_LANDMARKS))
+
+# --- Thresholds ---
+HAPPY_SMILE = 0.015       # Slightly more sensitive
+SURPRISE_MAR = 0.25       # Lowered from 0.5 (then 0.3) for "subtle" surprise
+SURPRISE_BROW = 0.04      # Lowered brow raise slightly
+ANGRY_GLABELLA = 0.285    # User baseline glabella ~0.29, so this is very sensitive
+ANGRY_BROW = 0.1          # Allows for natural brow position
+SAD_SMILE = -0.005        # Very subtle frown
+
+# Part of the result cache key (see app.py). Retuning a threshold changes it,
+# so readings cached under the old rules are not reused.
+ANALYZER_VERSION = repr(("facemesh-1", HAPPY_SMILE, SURPRISE_MAR, SURPRISE_BROW,
+                         ANGRY_GLABELLA, ANGRY_BROW, SAD_SMILE))
+
+
+class FaceFeatures(NamedTuple):
+    """
+    Geometric features of one frame (floats) or a batch of frames ((N,) arrays).
+    """
+    smile: object
+    mar: object
+    brow_raise: object
+    glabella: object
+
+
+@dataclass
+class FaceReading:
+    """
+    Result of analysing one face. str() gives the text shown to the user.
+    Features are None when no landmarks were available. bbox is where the
+    landmarks lie, (x, y, width, height) in normalized frame coordinates,
+    when the mesh found a face.
+    """
+    emotion: FaceEmotion
+    features: FaceFeatures = None
+    bbox: tuple = None
+
+    def __str__(self):
+        if self.features is None:
+            return self.emotion.label
+        smile, mar, brow, glab = self.features
+        if self.emotion == FaceEmotion.HAPPY:
+            return f"Happy: Corners lifted ({smile:.3f})"
+        if self.emotion == FaceEmotion.SURPRISED:
+            return f"Surprised: Mouth open ({mar:.2f})"
+        if self.emotion == FaceEmotion.ANGRY:
+            return f"Angry: Brows squeezed ({glab:.3f})"
+        if self.emotion == FaceEmotion.SAD:
+            return f"Sad: Corners down ({smile:.3f})"
+        # Neutral - Return debug info to help user trigger emotions
+        return f"Neutral (Glab:{glab:.2f}, Brow:{brow:.2f}, Smile:{smile:.3f})"
 
 
 def calculate_distance(point1, point2):
     """
-    Helper function to calculate Euclidean distance between two points (x, y).
+    Euclidean distance between (x, y) points; works element-wise on (..., 2) arrays.
     """
-    return math.hypot(point2[0] - point1[0], point2[1] - point1[1])
+    diff = np.asarray(point2) - np.asarray(point1)
+    return np.hypot(diff[..., 0], diff[..., 1])
 
-def get_emotion(landmarks):
+def key_points(landmarks):
+    """
+    Gathers the key landmarks into a (K, 2) array.
+    Accepts a MediaPipe landmark list, or a (..., 468, 2) array of (x, y)
+    coordinates, in which case a batch (N, 468, 2) gives (N, K, 2).
+    """
+    if isinstance(landmarks, np.ndarray):
+        return landmarks[..., KEY_LANDMARKS, :2]
+    return np.array([(landmarks[idx].x, landmarks[idx].y) for idx in KEY_LANDMARKS])
+
+def compute_features(points):
+    """
+    Computes the geometric features for key points of shape (K, 2) or (N, K, 2).
     """
-    The main logic function containing the if/else threshold math using Euclidean Geometry.
-    """
-
-    # Extract coordinates (using .x and .y directly from landmarks)
-    
-    # helper to get (x,y) from index
-    def get_pt(idx):
-        return (landmarks[idx].x, landmarks[idx].y)
-    
-    # --- Points of Interest ---
-    
-    # Mouth
-    top_lip = get_pt(13)
-    bottom_lip = get_pt(14)
-    left_corner = get_pt(61)
-    right_corner = get_pt(291)
-    
-    # Eyebrows
-    l_brow_inner = get_pt(55)
-    r_brow_inner = get_pt(285)
-    l_brow_mid = get_pt(105)
-    r_brow_mid = get_pt(334)
-    
-    # --- Geometric Logic ---
+    p = np.asarray(points, dtype=np.float64)
 
     # 1. HAPPY: Lip Corner Angle / Slope
-    # Positive value means corners are ABOVE center (Happy) (Y is inverted in image coords usually 0 at top)
     # MediaPipe Y: 0 at top, 1 at bottom. So Smaller Y = Higher up.
     # Center Y - Corner Y > 0 => Corner Y is smaller => Corner is Higher => Smile.
-    
-    center_y = (top_lip[1] + bottom_lip[1]) / 2
-    corners_y = (left_corner[1] + right_corner[1]) / 2
-    
-    smile_val = center_y - corners_y 
-    
-    # Threshold for Happy
-    if smile_val > 0.015:  # Slightly more sensitive
-        return f"Happy: Corners lifted ({smile_val:.3f})"
-
-    # 2. SURPRISE: Mouth Aspect Ratio (MAR) + Eyebrow Raise
-    
-    mouth_width = calculate_distance(left_corner, right_corner)
-    mouth_height = calculate_distance(top_lip, bottom_lip)
-    
-    if mouth_width == 0: mouth_width = 0.001
-    mar = mouth_height / mouth_width
-    
-    # Eyebrow Raise check relative to eyes
-    l_eye_top = get_pt(159)
-    r_eye_top = get_pt(386)
-    
-    l_brow_raise = calculate_distance(l_eye_top, l_brow_mid)
-    r_brow_raise = calculate_distance(r_eye_top, r_brow_mid)
+    center_y = (p[..., TOP_LIP, 1] + p[..., BOTTOM_LIP, 1]) / 2
+    corners_y = (p[..., LEFT_CORNER, 1] + p[..., RIGHT_CORNER, 1]) / 2
+    smile_val = center_y - corners_y
+
+    # 2. SURPRISE: Mouth Aspect Ratio (MAR) + Eyebrow Raise relative to eyes
+    mouth_width = calculate_distance(p[..., LEFT_CORNER, :], p[..., RIGHT_CORNER, :])
+    mouth_height = calculate_distance(p[..., TOP_LIP, :], p[..., BOTTOM_LIP, :])
+    mar = mouth_height / np.where(mouth_width == 0, 0.001, mouth_width)
+
+    l_brow_raise = calculate_distance(p[..., L_EYE_TOP, :], p[..., L_BROW_MID, :])
+    r_brow_raise = calculate_distance(p[..., R_EYE_TOP, :], p[..., R_BROW_MID, :])
     avg_brow_raise = (l_brow_raise + r_brow_raise) / 2
 
-    # Lowered MAR threshold from 0.5 to 0.3 for "subtle" surprise
-    # Lowered brow raise slightly
-    if mar > 0.25 and avg_brow_raise > 0.04: 
-        return f"Surprised: Mouth open ({mar:.2f})"
-
-    # 3. ANGRY: Glabella Distance (Inter-Brow)
-    
-    glabella_dist = calculate_distance(l_brow_inner, r_brow_inner)
-    
-    l_eye_outer = get_pt(33)
-    r_eye_outer = get_pt(263)
-    face_width = calculate_distance(l_eye_outer, r_eye_outer)
-    if face_width == 0: face_width = 0.001
-    
-    norm_glabella = glabella_dist / face_width
-    
-    # Relaxed thresholds for "Subtle" Anger
-    # User Baseline Glabella: ~0.29
-    # New Target: < 0.285 (Very sensitive, almost neutral)
-    # Increased avg_brow_raise limit to 0.1 to allow for natural brow position
-    if norm_glabella < 0.285: 
-         if avg_brow_raise < 0.1: # Brows low/normal
-             return f"Angry: Brows squeezed ({norm_glabella:.3f})"
-
-    # 4. SAD: Micro-Frown
-    # Corners lower than center. (smile_val is negative).
-    # Made more sensitive (closer to 0).
-    
-    if smile_val < -0.005: # Very subtle frown
-        return f"Sad: Corners down ({smile_val:.3f})"
-
-    # 5. NEUTRAL - Return debug info to help user trigger emotions
-    return f"Neutral (Glab:{norm_glabella:.2f}, Brow:{avg_brow_raise:.2f}, Smile:{smile_val:.3f})"
+    # 3. ANGRY: Glabella Distance (Inter-Brow), normalized by eye span
+    glabella_dist = calculate_distance(p[..., L_BROW_INNER, :], p[..., R_BROW_INNER, :])
+    face_width = calculate_distance(p[..., L_EYE_OUTER, :], p[..., R_EYE_OUTER, :])
+    norm_glabella = glabella_dist / np.where(face_width == 0, 0.001, face_width)
 
-def analyze_face(image_path):
+    return FaceFeatures(smile_val, mar, avg_brow_raise, norm_glabella)
+
+def classify_features(features):
+    """
+    Applies the threshold rules in priority order. Returns an array of
+    FaceEmotion codes shaped like the feature arrays.
     """
-    Analyzes the face image at the given path and returns an estimated emotion.
-    Used by app.py.
+    smile, mar, brow, glab = (np.asarray(f) for f in features)
+    conditions = [
+        smile > HAPPY_SMILE,
+        (mar > SURPRISE_MAR) & (brow > SURPRISE_BROW),
+        (glab < ANGRY_GLABELLA) & (brow < ANGRY_BROW),   # Brows squeezed and low/normal
+        smile < SAD_SMILE,                               # 4. SAD: Micro-Frown
+    ]
+    choices = [FaceEmotion.HAPPY, FaceEmotion.SURPRISED, FaceEmotion.ANGRY, FaceEmotion.SAD]
+    return np.select(conditions, choices, default=FaceEmotion.NEUTRAL)
+
+def get_emotion_batch(points):
+    """
+    Scores a batch of frames at once. points is (N, K, 2) key points or
+    (N, 468, 2) full landmark sets. Returns (codes, FaceFeatures of (N,) arrays).
+    """
+    points = np.asarray(points)
+    if points.shape[-2] != len(KEY_LANDMARKS):
+        points = key_points(points)
+    features = compute_features(points)
+    return classify_features(features), features
+
+def get_emotion(landmarks):
+    """
+    Classifies a single landmark set with the Euclidean geometry rules.
+    Returns a FaceReading.
+    """
+    if isinstance(landmarks, np.ndarray):
+        return get_emotion_points(landmarks[KEY_LANDMARKS, :2])
+    return _reading([(landmarks[idx].x, landmarks[idx].y) for idx in _KEY_LANDMARK_LIST])
+
+def get_emotion_points(points):
+    """
+    Same as get_emotion, for a (K, 2) array of key points.
+    """
+    return _reading(np.asarray(points, dtype=np.float64).tolist())
+
+# One face is scored in plain floats: for a dozen points, building arrays
+# costs more than the arithmetic. Must agree with compute_features and
+# classify_features, which score batches.
+_KEY_LANDMARK_LIST = KEY_LANDMARKS.tolist()
+
+def _reading(p):
+    center_y = (p[TOP_LIP][1] + p[BOTTOM_LIP][1]) / 2
+    corners_y = (p[LEFT_CORNER][1] + p[RIGHT_CORNER][1]) / 2
+    smile = center_y - corners_y
+
+    mouth_width = _distance(p[LEFT_CORNER], p[RIGHT_CORNER])
+    mouth_height = _distance(p[TOP_LIP], p[BOTTOM_LIP])
+    mar = mouth_height / (mouth_width or 0.001)
+    brow = (_distance(p[L_EYE_TOP], p[L_BROW_MID]) + _distance(p[R_EYE_TOP], p[R_BROW_MID])) / 2
+
+    face_width = _distance(p[L_EYE_OUTER], p[R_EYE_OUTER])
+    glab = _distance(p[L_BROW_INNER], p[R_BROW_INNER]) / (face_width or 0.001)
+
+    if smile > HAPPY_SMILE:
+        emotion = FaceEmotion.HAPPY
+    elif mar > SURPRISE_MAR and brow > SURPRISE_BROW:
+        emotion = FaceEmotion.SURPRISED
+    elif glab < ANGRY_GLABELLA and brow < ANGRY_BROW:
+        emotion = FaceEmotion.ANGRY
+    elif smile < SAD_SMILE:
+        emotion = FaceEmotion.SAD
+    else:
+        emotion = FaceEmotion.NEUTRAL
+    return FaceReading(emotion, FaceFeatures(smile, mar, brow, glab))
+
+def _distance(a, b):
+    return math.hypot(b[0] - a[0], b[1] - a[1])
+
+# --- Regions of interest ---
+# An ROI (x, y, width, height) is a crop of the camera frame in normalized
+# frame coordinates. The mesh reports landmarks relative to the crop; they
+# are mapped back to the frame so the thresholds above keep their meaning.
+def roi_to_frame(points, roi):
+    x, y, width, height = roi
+    return np.asarray(points, dtype=np.float64) * (width, height) + (x, y)
+
+def bounding_box(points):
+    low = points.min(axis=0)
+    high = points.max(axis=0)
+    return tuple(float(v) for v in (low[0], low[1], high[0] - low[0], high[1] - low[1]))
+
+# A tracked face is cropped out of the frame and scaled so its longer side is
+# at most this many pixels, plenty for the mesh's 192x192 landmark model. The
+# mesh's cost then depends on the face, not on the camera resolution.
+TRACK_MAX_SIDE = 320
+
+def crop_to_roi(image, roi, max_side=TRACK_MAX_SIDE):
+    """
+    Cuts roi out of a BGR image and downscales it to at most max_side.
+    Returns (crop, the pixel-aligned roi actually cut), or (None, None) if
+    the region is empty.
+    """
+    height, width = image.shape[:2]
+    x0 = max(0, int(roi[0] * width))
+    y0 = max(0, int(roi[1] * height))
+    x1 = min(width, int(np.ceil((roi[0] + roi[2]) * width)))
+    y1 = min(height, int(np.ceil((roi[1] + roi[3]) * height)))
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return None, None
+    crop = image[y0:y1, x0:x1]
+    scale = max_side / max(crop.shape[:2])
+    if scale < 1:
+        crop = cv2.resize(crop, (max(1, round(crop.shape[1] * scale)), max(1, round(crop.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA)
+    return crop, (x0 / width, y0 / height, (x1 - x0) / width, (y1 - y0) / height)
+
+# --- Client-side landmarks ---
+# Clients running the mesh themselves post little-endian float16 (x, y)
+# pairs in normalized frame coordinates: all 468 landmarks, or only the
+# KEY_LANDMARKS in that order. An empty payload means no face was found.
+LANDMARK_DTYPE = np.dtype("<f2")
+
+def landmarks_from_bytes(data):
+    """
+    Returns the key points of a landmark payload as a (K, 2) array, or None
+    for an empty one. Raises ValueError for a malformed payload.
+    """
+    if not data:
+        return None
+    if len(data) % (2 * LANDMARK_DTYPE.itemsize):
+        raise ValueError("landmark payload is not a whole number of (x, y) pairs")
+    points = np.frombuffer(data, dtype=LANDMARK_DTYPE).reshape(-1, 2).astype(np.float64)
+    if len(points) == NUM_LANDMARKS:
+        points = points[KEY_LANDMARKS]
+    elif len(points) != len(KEY_LANDMARKS):
+        raise ValueError(f"expected {NUM_LANDMARKS} or {len(KEY_LANDMARKS)} landmarks, got {len(points)}")
+    if not np.isfinite(points).all():
+        raise ValueError("landmark coordinates must be finite")
+    return points
+
+@metrics.timed("analyze_landmarks")
+def analyze_landmarks_bytes(data):
+    """
+    Scores a landmark payload with the same geometry as analyze_face.
+    Raises ValueError for a malformed payload.
+    """
+    points = landmarks_from_bytes(data)
+    if points is None:
+        return FaceReading(FaceEmotion.NO_FACE)
+    return get_emotion_points(points)
+
+def decode_image(image_bytes):
+    """
+    Decodes an encoded image (JPEG/PNG bytes) into a BGR array without touching disk.
+    Returns None if the bytes cannot be decoded.
+    """
+    if not image_bytes:
+        return None
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    with metrics.span("image_decode"):
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+def mesh_landmarks(image):
+    """
+    Runs the mesh on a BGR image. Returns the (468, 2) landmarks normalized
+    to the image, or None if no face was found.
+    """
+    # Convert the BGR image to RGB before processing.
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    with metrics.span("facemesh_process"):
+        results = get_face_mesh().process(rgb)
+    if not results.multi_face_landmarks:
+        return None
+    return np.array([(lm.x, lm.y) for lm in results.multi_face_landmarks[0].landmark])
+
+@metrics.timed("analyze_face")
+def analyze_face_image(image, roi=None, search=None):
+    """
+    Analyzes an already decoded BGR image and returns a FaceReading.
+    If the image is a crop of a larger frame, roi says where (see roi_to_frame).
+    search is where the face was last seen in this image's coordinates (see
+    face_temporal.FaceTracker): the mesh runs on that region first and on
+    the whole image only if the face is not there.
     """
     try:
-        image = cv2.imread(image_path)
         if image is None:
-            return "Neutral"
+            return FaceReading(FaceEmotion.NEUTRAL)
 
-        # Convert the BGR image to RGB before processing.
-        results = face_mesh_module.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        points = None
+        if search is not None:
+            crop, region = crop_to_roi(image, search)
+            if crop is not None:
+                points = mesh_landmarks(crop)
+            if points is not None:
+                points = roi_to_frame(points, region)
+            else:
+                metrics.inc("face_track_lost")
 
-        if not results.multi_face_landmarks:
-            return "No Face Detected"
+        if points is None:
+            points = mesh_landmarks(image)
+            if points is None:
+                return FaceReading(FaceEmotion.NO_FACE)
 
-        landmarks = results.multi_face_landmarks[0].landmark
-        
-        emotion_text = get_emotion(landmarks)
-        # Return full text with debug info for now
-        return emotion_text
+        if roi is not None:
+            points = roi_to_frame(points, roi)
+        reading = get_emotion_points(points[KEY_LANDMARKS])
+        reading.bbox = bounding_box(points)
+        return reading
 
     except Exception as e:
-        print(f"Error in analyze_face: {e}")
-        return "Neutral"
+        logger.error("Error in analyze_face: %s", e)
+        return FaceReading(FaceEmotion.NEUTRAL)
+
+def analyze_face_bytes(image_bytes, roi=None, search=None):
+    """
+    Analyzes an encoded image held in memory (e.g. an uploaded JPEG).
+    Used by app.py so the request path never writes to disk.
+    """
+    try:
+        image = decode_image(image_bytes)
+    except Exception as e:
+        logger.error("Error decoding face image: %s", e)
+        return FaceReading(FaceEmotion.NEUTRAL)
+    return analyze_face_image(image, roi, search)
+
+def analyze_face(image_path):
+    """
+    Analyzes the face image at the given path and returns a FaceReading.
+    """
+    return analyze_face_image(cv2.imread(image_path))
 
 def detect_emotion_video():
     """
-    Opens the Webcam, draws the face mesh, and prints the calculated emotion 
-    on the screen. (Standalone Mode)
-    """
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("Cannot open camera")
-        return
-
-    while True:
-        success, image = cap.read()
-        if not success:
-            break
-
-        # Convert the BGR image to RGB.
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        results = face_mesh_module.process(image_rgb)
-
-        if results.multi_face_landmarks:
-            for face_landmarks in results.multi_face_landmarks:
-                # Draw mesh (optional, simplified drawing points)
-                h, w, c = image.shape
-                for idx, lm in enumerate(face_landmarks.landmark):
-                    # Draw only key points to avoid clutter
-                    if idx in [13, 14, 61, 291, 55, 285]: 
-                        cx, cy = int(lm.x * w), int(lm.y * h)
-                        cv2.circle(image, (cx, cy), 2, (0, 255, 0), -1)
-
-                # Get Emotion
-                emotion_full = get_emotion(face_landmarks.landmark)
-                
-                # Display
-                cv2.putText(image, emotion_full, (20, 50), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-
-        cv2.imshow('Geometric Emotion Detection', image)
-        if cv2.waitKey(5) & 0xFF == 27:
-            break
-    
-    cap.release()
-    cv2.destroyAllWindows()
+    Opens the Webcam, draws the key landmarks, and prints the calculated
+    emotion on the screen. (Standalone Mode)
+    Runs the pipelined kiosk, which keeps capture, inference and display
+    on separate threads (see kiosk.py).
+    """
+    import kiosk
+    kiosk.run()
 
 if __name__ == "__main__":
     detect_emotion_video()
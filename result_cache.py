@@ -0,0 +1,209 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Disk entries are swept for expiry/overflow once every this many writes
+PRUNE_EVERY = 128
+
+
+def content_key(data, version):
+    """
+    Cache key for uploaded bytes analysed by a given analyzer version.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(version).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Analysis results keyed by a hash of the input bytes and the analyzer version.
+
+    Entries live in memory in least-recently-used order with a TTL, like
+    SessionStore. With a directory, results are also written there as pickles
+    so that several server processes on one host share them; the directory is
+    trusted, so only point it at storage the server alone writes to.
+
+    Identical inputs arriving together are computed once: later callers wait
+    for the first one's result. Cached values are shared, treat them as read-only.
+    """
+
+    def __init__(self, name, max_entries=512, ttl_seconds=600, directory=None, disk_max_entries=10000):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.directory = os.path.join(directory, name) if directory else None
+        self.disk_max_entries = disk_max_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._entries = OrderedDict()   # key -> (expires at, value)
+        self._pending = {}              # key -> Event set when its computation ends
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, data, version, compute, cacheable=None):
+        """
+        Returns the cached result for (data, version), or compute() stored
+        under it. Results failing cacheable(result) are returned but not kept;
+        exceptions from compute propagate and are never cached.
+        """
+        key = content_key(data, version)
+        waited = False
+        while True:
+            found, value = self._get(key)
+            if found:
+                with self._lock:
+                    if waited:
+                        self.coalesced += 1
+                    else:
+                        self.hits += 1
+                return value
+
+            with self._lock:
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Someone is computing this input right now
+            pending.wait()
+            waited = True
+
+        try:
+            value = compute()
+            if cacheable is None or cacheable(value):
+                self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            self._evict(time.monotonic())
+        if self.directory:
+            self._write(key, value)
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    return True, entry[1]
+                del self._entries[key]
+
+        if not self.directory:
+            return False, None
+        found, value = self._read(key)
+        if found:
+            with self._lock:
+                self.disk_hits += 1
+                self._entries[key] = (now + self.ttl_seconds, value)
+                self._evict(now)
+        return found, value
+
+    def _evict(self, now):
+        # Caller holds self._lock
+        while self._entries:
+            oldest_key, (expires, _) = next(iter(self._entries.items()))
+            if expires > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[oldest_key]
+            self.evictions += 1
+
+    # --- Shared disk tier ---
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.pickle")
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return False, None
+            with open(path, "rb") as f:
+                return True, pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except Exception as e:
+            logger.warning("Unreadable %s cache entry %s: %s", self.name, path, e)
+            return False, None
+
+    def _write(self, key, value):
+        path = self._path(key)
+        staging = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(staging, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(staging, path)
+        except Exception as e:
+            logger.warning("Could not write %s cache entry: %s", self.name, e)
+            return
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """
+        Removes expired disk entries, then the oldest ones beyond disk_max_entries.
+        """
+        if not self.directory:
+            return
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".pickle"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except FileNotFoundError:
+                    continue
+        entries.sort()
+        cutoff = time.time() - self.ttl_seconds
+        surplus = len(entries) - self.disk_max_entries
+        for i, (mtime, path) in enumerate(entries):
+            if mtime >= cutoff and i >= surplus:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+
+from emotions import FaceEmotion
+
+
+def default_state():
+    return {
+        "face_emotion": "Neutral",
+        "face_label": FaceEmotion.NEUTRAL,
+        "voice_emotion": "Neutral",
+        "last_spoken_text": "",
+        "final_mood": "Neutral"
+    }
+
+
+class SessionState:
+    """
+    The mood state of one browser session plus the lock that guards it.
+    The app fills in the other slots when it first needs them: face_filter
+    and face_tracker hold the session's temporal face layer and last face
+    position, voice_stream the voice answer being uploaded in chunks, and
+    recent_tracks the songs already recommended to it.
+    """
+    __slots__ = ("data", "lock", "last_seen", "face_filter", "face_tracker", "voice_stream",
+                 "recent_tracks")
+
+    def __init__(self):
+        self.data = default_state()
+        self.lock = threading.Lock()
+        self.last_seen = time.monotonic()
+        self.face_filter = None
+        self.face_tracker = None
+        self.voice_stream = None
+        self.recent_tracks = None
+
+
+class SessionStore:
+    """
+    Session-keyed state with TTL eviction and a hard cap on the number of sessions.
+
+    Sessions are kept in least-recently-used order, so expired or surplus
+    sessions are always at the front and eviction never scans the whole store.
+    """
+
+    def __init__(self, ttl_seconds=1800, max_sessions=1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """
+        Returns the SessionState for session_id, creating it if needed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = SessionState()
+                self._sessions[session_id] = state
+            else:
+                self._sessions.move_to_end(session_id)
+            state.last_seen = now
+            self._evict(now)
+            return state
+
+    def update(self, session_id, **fields):
+        state = self.get(session_id)
+        with state.lock:
+            state.data.update(fields)
+        return state
+
+    def snapshot(self, session_id):
+        """
+        Returns a copy of the session's mood state that is safe to read without a lock.
+        """
+        state = self.get(session_id)
+        with state.lock:
+            return dict(state.data)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _evict(self, now):
+        # Caller holds self._lock
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            expired = now - oldest.last_seen > self.ttl_seconds
+            if not expired and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[oldest_id]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
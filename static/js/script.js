@@ -1,6 +1,14 @@
 const video = document.getElementById("video");
 const faceEmotionDisplay = document.getElementById("emotion");
 
+// Input formats the server accepts (/capabilities); null for an older
+// server, in which case full frames and native-rate audio are sent
+let serverCaps = null;
+const capsReady = fetch("/capabilities")
+    .then(res => (res.ok ? res.json() : null))
+    .then(caps => { serverCaps = caps; })
+    .catch(() => {});
+
 navigator.mediaDevices.getUserMedia({ video: true })
     .then(stream => {
         video.srcObject = stream;
@@ -18,27 +26,81 @@ let recorder;
 let audioChunks = [];
 let audioContext = new (window.AudioContext || window.webkitAudioContext)();
 
+// One canvas reused for every captured frame
+const frameCanvas = document.createElement("canvas");
+const frameCtx = frameCanvas.getContext("2d");
+
+// Streams frames over a WebSocket; falls back to polling /detect_face
+// if the socket cannot be opened or is lost.
 function startFaceDetection() {
+    if (!("WebSocket" in window)) {
+        startFacePolling();
+        return;
+    }
+
+    const protocol = location.protocol === "https:" ? "wss:" : "ws:";
+    const socket = new WebSocket(`${protocol}//${location.host}/ws/face`);
+    let timer = null;
+
+    socket.onopen = () => {
+        socket.send(JSON.stringify({
+            type: "hello",
+            width: video.videoWidth,
+            height: video.videoHeight
+        }));
+    };
+
+    socket.onmessage = event => {
+        const msg = JSON.parse(event.data);
+        if (msg.type === "config") {
+            // Server-negotiated size, quality and rate
+            clearInterval(timer);
+            timer = setInterval(async () => {
+                // Don't queue frames behind a slow connection
+                if (socket.readyState !== WebSocket.OPEN || socket.bufferedAmount > 0) return;
+                const faceBlob = await captureFaceFrame(msg.width, msg.quality);
+                if (faceBlob) socket.send(faceBlob);
+            }, msg.interval_ms);
+        } else if (msg.type === "emotion") {
+            faceEmotionDisplay.innerText = msg.emotion;
+        }
+    };
+
+    socket.onclose = () => {
+        clearInterval(timer);
+        startFacePolling();
+    };
+}
+
+function startFacePolling() {
     setInterval(async () => {
-        const faceBlob = await captureFaceFrame();
+        const faceBlob = await captureFaceFrame(...compactFrameSize());
         if (faceBlob) {
             sendFaceToBackend(faceBlob);
         }
     }, 500);
 }
 
-function captureFaceFrame() {
+// The downscaled size and JPEG quality the server asks for, if it said
+function compactFrameSize() {
+    return serverCaps ? [serverCaps.face.max_width, serverCaps.face.quality] : [];
+}
+
+function captureFaceFrame(maxWidth, quality) {
     if (!video.videoWidth) return null;
 
-    const canvas = document.createElement("canvas");
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
+    const scale = maxWidth ? Math.min(1, maxWidth / video.videoWidth) : 1;
+    const width = Math.round(video.videoWidth * scale);
+    const height = Math.round(video.videoHeight * scale);
+    if (frameCanvas.width !== width || frameCanvas.height !== height) {
+        frameCanvas.width = width;
+        frameCanvas.height = height;
+    }
 
-    const ctx = canvas.getContext("2d");
-    ctx.drawImage(video, 0, 0);
+    frameCtx.drawImage(video, 0, 0, width, height);
 
     return new Promise(resolve => {
-        canvas.toBlob(blob => resolve(blob), "image/jpeg");
+        frameCanvas.toBlob(blob => resolve(blob), "image/jpeg", quality);
     });
 }
 
@@ -115,12 +177,153 @@ function bufferToWave(abuffer, len) {
 }
 
 recordBtn.onclick = async () => {
+    // Resume context if suspended
+    if (audioContext.state === 'suspended') {
+        await audioContext.resume();
+    }
+    recordBtn.disabled = true;
+
     try {
-        // Resume context if suspended
-        if (audioContext.state === 'suspended') {
-            await audioContext.resume();
+        await recordStreaming();
+    } catch (err) {
+        // Older server or browser: record a fixed clip and upload it at the end
+        console.warn("Streaming voice unavailable, recording a clip instead:", err);
+        recordClip();
+    }
+};
+
+// --- STREAMING VOICE ---
+// Sends 16-bit PCM to the server in ~250 ms chunks while the user speaks. The
+// server answers each chunk with a provisional emotion and tells us when the
+// speaker has stopped, so we don't have to wait out the full 5 seconds.
+function floatTo16BitPCM(samples) {
+    const pcm = new Int16Array(samples.length);
+    for (let i = 0; i < samples.length; i++) {
+        const s = Math.max(-1, Math.min(1, samples[i]));
+        pcm[i] = s < 0 ? s * 32768 : s * 32767;
+    }
+    return pcm;
+}
+
+// Averages the input over each output sample's span (a crude low-pass),
+// carrying the position across buffers. RMS and zero-crossing features
+// need nothing above 8 kHz, so 16 kHz audio is a third of the upload.
+function makeDownsampler(fromRate, toRate) {
+    if (!toRate || toRate >= fromRate) return samples => samples;
+    const step = fromRate / toRate;
+    let pos = 0;   // input position of the next output sample, relative to this buffer
+    return input => {
+        const out = new Float32Array(Math.ceil(Math.max(0, input.length - pos) / step));
+        let n = 0;
+        while (pos < input.length) {
+            const start = Math.floor(pos);
+            const end = Math.min(input.length, Math.floor(pos + step));
+            let sum = 0;
+            for (let i = start; i < end; i++) sum += input[i];
+            out[n++] = end > start ? sum / (end - start) : input[start];
+            pos += step;
         }
+        pos -= input.length;
+        return out.subarray(0, n);
+    };
+}
+
+async function recordStreaming() {
+    await capsReady;
+    const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+    const rate = serverCaps
+        ? Math.min(audioContext.sampleRate, serverCaps.voice.preferred_rate)
+        : audioContext.sampleRate;
+    const downsample = makeDownsampler(audioContext.sampleRate, rate);
+    const started = await fetch("/voice_stream/start", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ sample_rate: rate })
+    });
+    if (!started.ok) {
+        stream.getTracks().forEach(track => track.stop());
+        throw new Error(`voice stream refused (${started.status})`);
+    }
 
+    const source = audioContext.createMediaStreamSource(stream);
+    const processor = audioContext.createScriptProcessor(4096, 1, 1);
+    const mute = audioContext.createGain();
+    mute.gain.value = 0;
+    source.connect(processor);
+    processor.connect(mute);
+    mute.connect(audioContext.destination);
+
+    const chunkSamples = Math.round(rate / 4);
+    let pieces = [];
+    let buffered = 0;
+    let sendQueue = Promise.resolve();   // keeps chunks in order
+    let finished = false;
+
+    const sendChunk = () => {
+        if (!buffered) return;
+        const chunk = new Int16Array(buffered);
+        let offset = 0;
+        pieces.forEach(piece => { chunk.set(piece, offset); offset += piece.length; });
+        pieces = [];
+        buffered = 0;
+
+        sendQueue = sendQueue
+            .then(() => fetch("/voice_stream/chunk", {
+                method: "POST",
+                headers: { "Content-Type": "application/octet-stream" },
+                body: chunk
+            }))
+            .then(res => res.json())
+            .then(data => {
+                if (finished) return;
+                if (data.provisional_emotion) {
+                    statusText.innerText = `Listening... (sounds ${data.provisional_emotion})`;
+                }
+                if (data.speech_ended) {
+                    // The server stops listening here: don't upload the tail
+                    pieces = [];
+                    buffered = 0;
+                    stop();
+                }
+            })
+            .catch(err => console.error("Voice chunk error:", err));
+    };
+
+    const stop = () => {
+        if (finished) return;
+        finished = true;
+        clearTimeout(timer);
+        sendChunk();
+        processor.disconnect();
+        source.disconnect();
+        mute.disconnect();
+        stream.getTracks().forEach(track => track.stop());
+        statusText.innerText = "Processing audio...";
+        sendQueue.then(finishVoiceStream);
+    };
+    const timer = setTimeout(stop, 5000);
+
+    processor.onaudioprocess = e => {
+        if (finished) return;
+        const piece = floatTo16BitPCM(downsample(e.inputBuffer.getChannelData(0)));
+        pieces.push(piece);
+        buffered += piece.length;
+        if (buffered >= chunkSamples) sendChunk();
+    };
+
+    statusText.innerText = "Listening...";
+}
+
+function finishVoiceStream() {
+    fetch("/voice_stream/finish", { method: "POST" })
+        .then(readVoiceReply)
+        .then(showVoiceResult)
+        .catch(showVoiceError);
+}
+
+// --- CLIP RECORDING (fallback) ---
+async function recordClip() {
+    try {
         const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
         recorder = new MediaRecorder(stream);
         audioChunks = [];
@@ -133,23 +336,36 @@ recordBtn.onclick = async () => {
 
         recorder.onstop = async () => {
             statusText.innerText = "Processing audio...";
+            await capsReady;
+            const faceBlob = await captureFaceFrame(...compactFrameSize());
 
             // 1. Get WebM/Ogg Blob
-            const webmBlob = new Blob(audioChunks, { type: 'audio/webm' });
-            // Note: 'audio/webm' is typical default, hopefully browser supports it or 'audio/ogg'
+            const recordedType = recorder.mimeType || "audio/webm";
+            const recordedBlob = new Blob(audioChunks, { type: recordedType });
+
+            // Compressed Opus is a fraction of the WAV size: send it as is
+            // when the server can decode it
+            const container = recordedType.split(";")[0];
+            if (serverCaps && serverCaps.voice.formats.some(f => f.split(";")[0] === container)) {
+                statusText.innerText = "Sending data...";
+                sendAudioToBackend(recordedBlob, faceBlob, `response.${container.split("/")[1]}`);
+                return;
+            }
 
             // 2. Convert to ArrayBuffer
-            const arrayBuffer = await webmBlob.arrayBuffer();
+            const arrayBuffer = await recordedBlob.arrayBuffer();
 
             // 3. Decode to AudioBuffer (PCM)
             try {
-                const audioBuffer = await audioContext.decodeAudioData(arrayBuffer);
+                let audioBuffer = await audioContext.decodeAudioData(arrayBuffer);
+                if (serverCaps) {
+                    audioBuffer = await resampleBuffer(audioBuffer, serverCaps.voice.preferred_rate);
+                }
 
                 // 4. Encode to WAV
                 const wavBlob = bufferToWave(audioBuffer, audioBuffer.length);
 
                 statusText.innerText = "Sending data...";
-                const faceBlob = await captureFaceFrame();
                 sendAudioToBackend(wavBlob, faceBlob);
 
             } catch (e) {
@@ -170,11 +386,22 @@ recordBtn.onclick = async () => {
         alert("Microphone access denied or error: " + err.message);
         recordBtn.disabled = false;
     }
-};
+}
 
-function sendAudioToBackend(audioBlob, faceBlob) {
+// Mixes down to mono at the given rate (never above the original rate)
+async function resampleBuffer(audioBuffer, rate) {
+    rate = Math.min(rate, audioBuffer.sampleRate);
+    const offline = new OfflineAudioContext(1, Math.ceil(audioBuffer.duration * rate), rate);
+    const source = offline.createBufferSource();
+    source.buffer = audioBuffer;
+    source.connect(offline.destination);
+    source.start();
+    return offline.startRendering();
+}
+
+function sendAudioToBackend(audioBlob, faceBlob, filename = "response.wav") {
     const formData = new FormData();
-    formData.append("audio_data", audioBlob, "response.wav"); // Explicit filename
+    formData.append("audio_data", audioBlob, filename); // Explicit filename
     if (faceBlob) {
         formData.append("face_data", faceBlob);
     }
@@ -183,15 +410,47 @@ function sendAudioToBackend(audioBlob, faceBlob) {
         method: "POST",
         body: formData
     })
-        .then(res => res.json())
-        .then(data => {
-            statusText.innerHTML = `${data.bot_reply}<br><b>Final Mood:</b> ${data.new_mood}<br><small>${data.reasoning}</small>`;
-            faceEmotionDisplay.innerText = data.new_mood;
-            recordBtn.disabled = false;
-        })
-        .catch(err => {
-            console.error(err);
-            statusText.innerText = "Error processing response.";
-            recordBtn.disabled = false;
-        });
-}
\ No newline at end of file
+        .then(readVoiceReply)
+        .then(showVoiceResult)
+        .catch(showVoiceError);
+}
+
+// At capacity the server answers 503 at once rather than queueing the request
+function readVoiceReply(res) {
+    if (res.status === 503) throw new Error("busy");
+    return res.json();
+}
+
+function showVoiceError(err) {
+    console.error(err);
+    statusText.innerText = err.message === "busy"
+        ? "The server is busy right now. Please try again in a moment."
+        : "Error processing response.";
+    recordBtn.disabled = false;
+}
+
+function showVoiceResult(data) {
+    // Start fetching the song first, so it buffers while the reply renders
+    if (data.track_url) queueSong(data.track_url);
+
+    statusText.innerHTML = `${data.bot_reply}<br><b>Final Mood:</b> ${data.new_mood}<br><small>${data.reasoning}</small>`;
+    faceEmotionDisplay.innerText = data.new_mood;
+    recordBtn.disabled = false;
+}
+
+// --- MUSIC ---
+// Songs stream from /songs/<track_id>; the browser fetches byte ranges as it
+// plays and seeks, and revalidates cached songs with their ETag.
+const musicPlayer = document.getElementById("musicPlayer");
+musicPlayer.preload = "auto";
+
+function queueSong(url) {
+    const src = new URL(url, location.href).href;
+    if (musicPlayer.src !== src) {
+        musicPlayer.src = src;
+        musicPlayer.load();
+    }
+    // Browsers may block playback without a recent user gesture;
+    // the controls are still there to start it by hand
+    musicPlayer.play().catch(err => console.warn("Autoplay blocked:", err));
+}
@@ -0,0 +1,177 @@
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import numpy as np
+import speech_recognition as sr
+
+import metrics
+
+# Tried concurrently; when several succeed the earlier language wins
+LANGUAGES = ("en-US", "ml-IN")
+STT_TIMEOUT_SECONDS = float(os.environ.get("STT_TIMEOUT_SECONDS", 8.0))
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("STT_THREADS", 8)),
+    thread_name_prefix="stt"
+)
+
+
+def audio_data_from_samples(y, rate):
+    """
+    Wraps mono float samples as 16-bit PCM for the recognizers.
+    """
+    pcm = (np.clip(y, -1.0, 1.0) * 32767).astype('<i2')
+    return sr.AudioData(pcm.tobytes(), rate, 2)
+
+
+# --- Backends ---
+class SpeechBackend:
+    """
+    Turns sr.AudioData into text for one language.
+    transcribe returns None when nothing was understood and raises
+    sr.RequestError when the engine cannot be reached.
+    """
+    name = "base"
+
+    def transcribe(self, audio_data, language):
+        raise NotImplementedError
+
+
+class GoogleBackend(SpeechBackend):
+    """
+    Google Web Speech API (network).
+    """
+    name = "google"
+
+    def transcribe(self, audio_data, language):
+        recognizer = sr.Recognizer()
+        recognizer.energy_threshold = 300
+        try:
+            return recognizer.recognize_google(audio_data, language=language)
+        except sr.UnknownValueError:
+            return None
+
+
+class VoskBackend(SpeechBackend):
+    """
+    Offline recognition with Vosk. Expects one model directory per language
+    under VOSK_MODEL_DIR, named after the language (e.g. models/en-US).
+    Languages without a model are reported as not understood.
+    """
+    name = "vosk"
+
+    def __init__(self, model_dir=None):
+        import vosk  # Optional dependency, only needed for this backend
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self.model_dir = model_dir or os.environ.get("VOSK_MODEL_DIR", "models")
+        self._models = {}
+
+    def _model(self, language):
+        if language not in self._models:
+            path = os.path.join(self.model_dir, language)
+            self._models[language] = self._vosk.Model(path) if os.path.isdir(path) else None
+        return self._models[language]
+
+    def transcribe(self, audio_data, language):
+        model = self._model(language)
+        if model is None:
+            return None
+        recognizer = self._vosk.KaldiRecognizer(model, audio_data.sample_rate)
+        recognizer.AcceptWaveform(audio_data.get_raw_data(convert_width=2))
+        text = json.loads(recognizer.FinalResult()).get("text", "")
+        return text or None
+
+
+class StaticBackend(SpeechBackend):
+    """
+    Offline stand-in for tests and benchmarks: "hears" a fixed text in one language.
+    """
+    name = "static"
+
+    def __init__(self, text=None, language="en-US", delay=0.0):
+        self.text = text if text is not None else os.environ.get("STT_STATIC_TEXT", "I am fine")
+        self.language = language
+        self.delay = delay
+
+    def transcribe(self, audio_data, language):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.text if language == self.language else None
+
+
+BACKENDS = {
+    "google": GoogleBackend,
+    "vosk": VoskBackend,
+    "static": StaticBackend,
+}
+
+_backend = None
+
+def get_backend():
+    """
+    Returns the configured backend (STT_BACKEND, default google), created on first use.
+    """
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[os.environ.get("STT_BACKEND", "google")]()
+    return _backend
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+# --- Concurrent recognition ---
+def start(audio_data, languages=LANGUAGES, backend=None):
+    """
+    Starts recognition in every language at once and returns the pending
+    attempts; pass them to collect() once other work is done.
+    """
+    backend = backend or get_backend()
+    started = time.monotonic()
+    # Each attempt runs in a copy of the caller's context so its span lands
+    # in the caller's request timings as well as the histograms
+    return [(language,
+             _executor.submit(contextvars.copy_context().run,
+                              _timed_transcribe, backend, audio_data, language),
+             started)
+            for language in languages]
+
+def _timed_transcribe(backend, audio_data, language):
+    with metrics.span(f"stt_{backend.name}_{language}"):
+        return backend.transcribe(audio_data, language)
+
+def collect(pending, timeout=STT_TIMEOUT_SECONDS):
+    """
+    Waits for the attempts from start() and returns (text, language) for the
+    first language in preference order that was understood, or (None, None).
+
+    Raises sr.RequestError if nothing was understood and at least one attempt
+    failed to reach its engine or ran past the timeout.
+    """
+    failure = None
+    for language, future, started in pending:
+        remaining = max(0.0, timeout - (time.monotonic() - started))
+        try:
+            text = future.result(timeout=remaining)
+        except FutureTimeout:
+            failure = failure or sr.RequestError(f"speech recognition timed out ({language})")
+            continue
+        except sr.RequestError as e:
+            failure = failure or e
+            continue
+        if text:
+            for _, other, _ in pending:
+                other.cancel()
+            return text, language
+
+    if failure is not None:
+        raise failure
+    return None, None
+
+def transcribe(audio_data, languages=LANGUAGES, backend=None, timeout=STT_TIMEOUT_SECONDS):
+    return collect(start(audio_data, languages, backend), timeout)
@@ -0,0 +1,178 @@
+import argparse
+import hashlib
+import io
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from clean_data import ByteRange, shard_ranges
+
+# Labels catalogue tracks with the moods the app itself produces (see
+# fusion_engine and catalogue.MOOD_TARGETS) from their energy and valence.
+# The rules are tried in order, first match wins, everything else is Neutral.
+# Bounds are [low, high); None means unbounded.
+MOOD_RULES = [
+    # mood              energy          valence
+    ("Excited",         (0.75, None),   (0.60, None)),
+    ("Happy",           (0.40, None),   (0.60, None)),
+    ("Calm",            (None, 0.40),   (0.45, None)),
+    ("Angry",           (0.75, None),   (None, 0.35)),
+    ("Frustration",     (0.55, None),   (None, 0.45)),
+    ("Surprise",        (0.75, None),   (0.45, 0.60)),
+    ("Sad",             (None, 0.40),   (None, 0.30)),
+    ("Hidden Sadness",  (None, None),   (None, 0.45)),
+]
+DEFAULT_MOOD = "Neutral"
+MOODS = tuple(mood for mood, _, _ in MOOD_RULES) + (DEFAULT_MOOD,)
+
+# Labels from a state file written under other rules are not reused
+RULES_VERSION = hashlib.sha1(repr((MOOD_RULES, DEFAULT_MOOD)).encode()).hexdigest()[:12]
+
+
+def _within(values, bounds):
+    low, high = bounds
+    inside = np.ones(values.shape, dtype=bool)
+    if low is not None:
+        inside &= values >= low
+    if high is not None:
+        inside &= values < high
+    return inside
+
+def label_codes(energy, valence):
+    """
+    Mood codes (indexes into MOODS) for arrays of energy and valence.
+    """
+    energy = np.asarray(energy, dtype=np.float32)
+    valence = np.asarray(valence, dtype=np.float32)
+    conditions = [_within(energy, e) & _within(valence, v) for _, e, v in MOOD_RULES]
+    return np.select(conditions, np.arange(len(MOOD_RULES)), default=len(MOOD_RULES)).astype(np.int16)
+
+def label(energy, valence):
+    """
+    Mood names for arrays of energy and valence.
+    """
+    return np.asarray(MOODS, dtype=object)[label_codes(energy, valence)]
+
+
+# --- Incremental relabeling of a tracks CSV ---
+# Next to the output sits a state file with the track ids, features and moods
+# of the last run. Rows whose id and features match it keep their mood; only
+# new or changed rows go through the rules.
+def state_path(output_path):
+    return f"{output_path}.labels.npz"
+
+def load_state(path):
+    """
+    Returns (sorted ids, energy, valence, moods) from the last run, or None.
+    """
+    try:
+        with np.load(path, allow_pickle=False) as state:
+            if str(state["rules_version"]) != RULES_VERSION:
+                return None
+            return state["ids"], state["energy"], state["valence"], state["moods"]
+    except FileNotFoundError:
+        return None
+
+def _previous(state, ids, energy, valence):
+    # Moods from the last run for unchanged rows; '' where the row must be labelled
+    moods = np.full(len(ids), "", dtype=object)
+    if state is None or not len(state[0]):
+        return moods
+    prev_ids, prev_energy, prev_valence, prev_moods = state
+    pos = np.minimum(np.searchsorted(prev_ids, ids), len(prev_ids) - 1)
+    same = (prev_ids[pos] == ids) & (prev_energy[pos] == energy) & (prev_valence[pos] == valence)
+    moods[same] = prev_moods[pos[same]].astype(str).astype(object)
+    return moods
+
+def label_shard(path, header, start, end, csv_part, state_file, chunksize):
+    """
+    Labels one byte range of the input CSV into csv_part.
+    Returns (ids, energy, valence, moods, relabelled) for the new state.
+    """
+    state = load_state(state_file)
+    columns = [c for c in header if c != "mood"]
+    out_ids, out_energy, out_valence, out_moods, relabelled = [], [], [], [], 0
+    with ByteRange(path, start, end) as raw, open(csv_part, "w", encoding="utf-8", newline="") as out:
+        reader = pd.read_csv(io.BufferedReader(raw, 1 << 20), header=None, names=header,
+                             dtype={"track_id": str, "energy": "float32", "valence": "float32"},
+                             chunksize=chunksize)
+        for chunk in reader:
+            ids = np.array([str(t).encode("utf-8") for t in chunk["track_id"]], dtype=np.bytes_)
+            energy = chunk["energy"].to_numpy(dtype=np.float32)
+            valence = chunk["valence"].to_numpy(dtype=np.float32)
+
+            moods = _previous(state, ids, energy, valence)
+            todo = moods == ""
+            moods[todo] = label(energy[todo], valence[todo])
+            relabelled += int(todo.sum())
+
+            chunk = chunk[columns].assign(mood=moods)
+            chunk.to_csv(out, header=False, index=False)
+            out_ids.append(ids)
+            out_energy.append(energy)
+            out_valence.append(valence)
+            out_moods.append(moods.astype(str))
+    join = lambda parts, dtype: np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+    return (join(out_ids, np.bytes_), join(out_energy, np.float32), join(out_valence, np.float32),
+            join(out_moods, str), relabelled)
+
+def label_csv(input_path, output_path, jobs=None, chunksize=200_000):
+    """
+    Writes input_path with a mood column to output_path, relabelling only rows
+    that are new or whose energy/valence changed since the last run.
+    Returns (rows, relabelled, seconds).
+    """
+    started = time.perf_counter()
+    header = list(pd.read_csv(input_path, nrows=0).columns)
+    for required in ("track_id", "energy", "valence"):
+        if required not in header:
+            raise SystemExit(f"{input_path} has no {required} column")
+
+    jobs = jobs or os.cpu_count() or 1
+    ranges = shard_ranges(input_path, jobs)
+    parts = [f"{output_path}.part-{i}" for i in range(len(ranges))]
+    state_file = state_path(output_path)
+    with ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as pool:
+        futures = [pool.submit(label_shard, input_path, header, start, end, part, state_file, chunksize)
+                   for (start, end), part in zip(ranges, parts)]
+        results = [future.result() for future in futures]
+
+    staging = f"{output_path}.tmp-{os.getpid()}"
+    with open(staging, "w", encoding="utf-8", newline="") as out:
+        out.write(",".join([c for c in header if c != "mood"] + ["mood"]) + "\n")
+        for part in parts:
+            with open(part, encoding="utf-8", newline="") as f:
+                shutil.copyfileobj(f, out, 1 << 20)
+            os.remove(part)
+    os.replace(staging, output_path)
+
+    ids, energy, valence, moods = (np.concatenate([r[i] for r in results]) for i in range(4))
+    order = np.argsort(ids, kind="stable")
+    np.savez(state_file, ids=ids[order], energy=energy[order], valence=valence[order],
+             moods=moods[order].astype(np.bytes_), rules_version=np.array(RULES_VERSION))
+    return len(ids), sum(r[4] for r in results), time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Label tracks with moods from energy and valence.")
+    parser.add_argument("input", nargs="?", default="tracks_cleaned.csv")
+    parser.add_argument("--output", default="tracks_with_mood.csv")
+    parser.add_argument("--jobs", type=int, help="parallel shards (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=200_000, help="rows per chunk")
+    parser.add_argument("--catalogue", help="also compile the labelled tracks into this catalogue")
+    args = parser.parse_args(argv)
+
+    rows, relabelled, seconds = label_csv(args.input, args.output, args.jobs, args.chunksize)
+    print(f"{rows} tracks, {relabelled} labelled, {rows - relabelled} unchanged, "
+          f"in {seconds:.2f}s ({rows / max(seconds, 1e-9):,.0f} rows/s)")
+    if args.catalogue:
+        import catalogue
+        catalogue.compile_csv(args.output, args.catalogue)
+        print(f"Compiled {args.catalogue}")
+
+if __name__ == "__main__":
+    main()
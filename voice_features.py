@@ -0,0 +1,337 @@
+import io
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import soundfile as sf
+
+# The energy/pitch thresholds were tuned on librosa defaults: audio resampled to
+# 22.05 kHz and 2048-sample frames with a 512 hop. Here frames cover the same
+# duration at whatever rate the audio arrives in, and the zero-crossing rate is
+# rescaled to the reference rate, so scores keep their meaning without resampling.
+REFERENCE_RATE = 22050
+REFERENCE_FRAME = 2048
+REFERENCE_HOP = 512
+
+# Only samples louder than this fraction of the peak count as voice
+GATE_RATIO = 0.25
+
+# Optional cap on the analysis rate (e.g. 16000). Higher-rate audio is decimated
+# by an integer stride (a view, no filtering) before feature extraction.
+MAX_ANALYSIS_RATE = int(os.environ.get("VOICE_MAX_ANALYSIS_RATE", 0)) or None
+
+
+# --- Decoding ---
+def read_pcm(source):
+    """
+    Decodes a WAV path or file-like object at its native rate into mono float32.
+    Returns (samples, sample_rate).
+    """
+    y, rate = sf.read(source, dtype='float32', always_2d=True)
+    if y.shape[1] == 1:
+        return y[:, 0], rate
+    return y.mean(axis=1), rate
+
+def read_pcm_bytes(wav_bytes):
+    """
+    Same as read_pcm, for bytes held in memory (e.g. an upload).
+    """
+    return read_pcm(io.BytesIO(wav_bytes))
+
+# libsndfile reads WAV, FLAC and Ogg (Vorbis/Opus) itself. WebM, which most
+# browsers' MediaRecorder produces, is decoded by ffmpeg when it is installed.
+FFMPEG = os.environ.get("FFMPEG_BINARY") or shutil.which("ffmpeg")
+FFMPEG_RATE = 16000
+FFMPEG_TIMEOUT_SECONDS = 10
+WEBM_MAGIC = b"\x1a\x45\xdf\xa3"   # EBML header
+
+def decode_with_ffmpeg(data, rate=FFMPEG_RATE):
+    """
+    Decodes any container/codec ffmpeg knows into mono float32 at rate.
+    Returns (samples, rate).
+    """
+    if FFMPEG is None:
+        raise ValueError("decoding this audio format needs ffmpeg")
+    proc = subprocess.run(
+        [FFMPEG, "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "f32le", "-ac", "1", "-ar", str(rate), "pipe:1"],
+        input=data, capture_output=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+    if proc.returncode != 0:
+        raise ValueError(f"ffmpeg could not decode audio: {proc.stderr.decode(errors='replace').strip()[-200:]}")
+    return np.frombuffer(proc.stdout, dtype="<f4"), rate
+
+def read_audio_bytes(data):
+    """
+    Decodes an uploaded recording in any accepted format (see
+    accepted_formats) into mono float32. Returns (samples, sample_rate).
+    """
+    if not data.startswith(WEBM_MAGIC):
+        try:
+            return read_pcm_bytes(data)
+        except RuntimeError:
+            if FFMPEG is None:
+                raise
+    return decode_with_ffmpeg(data)
+
+def accepted_formats():
+    formats = ["audio/wav", "audio/flac", "audio/ogg;codecs=vorbis", "audio/ogg;codecs=opus"]
+    if FFMPEG is not None:
+        formats.append("audio/webm;codecs=opus")
+    return formats
+
+
+# --- Features ---
+def frame_sizes(rate):
+    """
+    (frame, hop) in samples at rate, covering the reference durations.
+    """
+    frame = max(2, int(round(REFERENCE_FRAME * rate / REFERENCE_RATE)))
+    hop = max(1, int(round(REFERENCE_HOP * rate / REFERENCE_RATE)))
+    return frame, hop
+
+def extract_features(y, rate, max_rate=MAX_ANALYSIS_RATE):
+    """
+    Returns (energy, pitch) for mono samples: the mean RMS and the mean
+    zero-crossing rate over frames of the loud (gated) part of the signal.
+
+    Frames are centred like librosa's (zero padding for RMS, edge padding for
+    ZCR), but every frame is read from two prefix sums over the gated samples
+    instead of materializing a frame matrix, so the whole clip costs one pass.
+    """
+    y = np.asarray(y, dtype=np.float32)
+    if max_rate and rate > max_rate:
+        step = int(rate // max_rate)
+        y = y[::step]
+        rate = rate / step
+    if y.size == 0:
+        return 0.0, 0.0
+
+    frame, hop = frame_sizes(rate)
+
+    magnitude = np.abs(y)
+    gated = y[magnitude > GATE_RATIO * magnitude.max()]
+    if gated.size == 0:
+        gated = y
+    n = gated.size
+
+    # Prefix sums of squared samples and of sign changes between neighbours
+    energy_sum = np.zeros(n + 1)
+    np.cumsum(np.square(gated, dtype=np.float64), out=energy_sum[1:])
+    positive = gated >= -1e-10
+    crossing_sum = np.zeros(n + 1)
+    np.cumsum(positive[1:] != positive[:-1], out=crossing_sum[2:])
+
+    # Frame k covers gated samples [k * hop - pad, k * hop - pad + frame)
+    pad = frame // 2
+    n_frames = 1 + (n + 2 * pad - frame) // hop
+    starts = np.arange(n_frames) * hop - pad
+    lo = np.clip(starts, 0, n)
+    hi = np.clip(starts + frame, 0, n)
+    # A crossing is counted at the later of its two samples, never at a frame's first sample
+    lo_cross = np.clip(starts + 1, 0, n)
+
+    rms = np.sqrt((energy_sum[hi] - energy_sum[lo]) / frame)
+    zcr = (crossing_sum[hi] - crossing_sum[lo_cross]) / frame
+
+    energy = float(np.mean(rms))
+    pitch = float(np.mean(zcr) * frame / REFERENCE_FRAME)
+    return energy, pitch
+
+
+# --- Labels ---
+# audio_logic and mood_label share the same energy/pitch bands but name them
+# differently.
+VOICE_LABELS = {
+    "quiet": "Neutral",
+    "loud_high": "Excited",
+    "loud_low": "Angry",
+    "mid_high": "Happy",
+    "mid_low": "Neutral",
+    "soft_low": "Sad",
+    "soft_high": "Calm",
+}
+
+MOOD_LABELS = {
+    "quiet": "neutral",
+    "loud_high": "surprised",
+    "loud_low": "angry",
+    "mid_high": "happy",
+    "mid_low": "neutral",
+    "soft_low": "sad",
+    "soft_high": "neutral",
+}
+
+def voice_band(energy, pitch):
+    """
+    Expert rules: which energy/pitch band a voice falls in.
+    """
+    if energy < 0.015:
+        return "quiet"
+    if energy > 0.08:
+        return "loud_high" if pitch > 0.05 else "loud_low"
+    if energy > 0.02:
+        return "mid_high" if pitch > 0.06 else "mid_low"
+    return "soft_low" if pitch < 0.03 else "soft_high"
+
+def label_voice(energy, pitch, labels=VOICE_LABELS):
+    return labels[voice_band(energy, pitch)]
+
+
+# --- Streaming ---
+class StreamingVoiceAnalyzer:
+    """
+    Energy-based voice activity detection over audio pushed in chunks.
+
+    Audio is cut into short frames; frames louder than vad_threshold count
+    as speech. The utterance ends once hangover_ms of silence follows at
+    least min_speech_ms of speech. Emotion scores are not kept here: the
+    gated features of extract_features need the whole clip's peak, so
+    callers run it on the samples buffered so far.
+    """
+
+    def __init__(self, rate, frame_ms=20, vad_threshold=0.01, min_speech_ms=120, hangover_ms=800):
+        self.rate = rate
+        self.frame = max(1, int(rate * frame_ms / 1000))
+        self.vad_threshold = vad_threshold
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.speech_started = False
+        self.speech_ended = False
+        self.voiced_frames = 0
+        self._speech_run = 0
+        self._silence_run = 0
+        self._carry = np.zeros(0, dtype=np.float32)
+
+    def push(self, samples):
+        """
+        Adds mono float samples. Returns True once the utterance has ended.
+        """
+        y = np.concatenate([self._carry, np.asarray(samples, dtype=np.float32)])
+        n_frames = y.size // self.frame
+        self._carry = y[n_frames * self.frame:]
+        if n_frames == 0:
+            return self.speech_ended
+
+        frames = y[:n_frames * self.frame].reshape(n_frames, self.frame)
+        rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+
+        voiced = rms > self.vad_threshold
+        self.voiced_frames += int(np.count_nonzero(voiced))
+
+        for is_voiced in voiced:
+            if self.speech_ended:
+                break
+            if is_voiced:
+                self._speech_run += 1
+                self._silence_run = 0
+                if self._speech_run >= self.min_speech_frames:
+                    self.speech_started = True
+            else:
+                self._speech_run = 0
+                self._silence_run += 1
+                if self.speech_started and self._silence_run >= self.hangover_frames:
+                    self.speech_ended = True
+        return self.speech_ended
+
+
+class RunningFeatures:
+    """
+    extract_features over audio that arrives in chunks, kept up to date per
+    chunk instead of rescanning the clip.
+
+    The gated samples' prefix sums of energy and sign changes are extended
+    by each chunk, and frames lying wholly before the last gated sample are
+    folded into running totals, so only the few frames at the end are
+    recomputed. A chunk raising the peak moves the gate and re-reads the
+    audio so far; that happens while the speaker gets louder, not per chunk.
+    """
+
+    def __init__(self, rate, max_rate=MAX_ANALYSIS_RATE):
+        self.step = int(rate // max_rate) if max_rate and rate > max_rate else 1
+        self.frame, self.hop = frame_sizes(rate / self.step)
+        self.pad = self.frame // 2
+        self.peak = np.float32(0)
+        self._reset(0)
+
+    def _reset(self, capacity):
+        self._energy_sum = np.zeros(capacity + 1)
+        self._crossing_sum = np.zeros(capacity + 1)
+        self._n = 0
+        self._last_positive = None
+        self._frames_done = 0
+        self._rms_total = 0.0
+        self._zcr_total = 0.0
+
+    def update(self, samples, new):
+        """
+        samples holds all the audio so far, its last `new` samples just
+        arrived. Returns (energy, pitch) as extract_features would.
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        first = -(-(samples.size - new) // self.step) * self.step
+        fresh = samples[first::self.step]
+        if fresh.size and np.abs(fresh).max() > self.peak:
+            # The gate moves: everything heard so far is gated again
+            self.peak = np.abs(fresh).max()
+            history = samples[::self.step]
+            self._reset(history.size)
+            self._append(history)
+        elif fresh.size:
+            self._append(fresh)
+        return self.scores()
+
+    def _append(self, y):
+        gated = y[np.abs(y) > GATE_RATIO * self.peak]
+        m = gated.size
+        if m == 0:
+            return
+        n = self._n
+        if n + m + 1 > self._energy_sum.size:
+            size = max(n + m + 1, 2 * self._energy_sum.size)
+            for name in ("_energy_sum", "_crossing_sum"):
+                grown = np.zeros(size)
+                grown[:n + 1] = getattr(self, name)[:n + 1]
+                setattr(self, name, grown)
+
+        np.cumsum(np.square(gated, dtype=np.float64), out=self._energy_sum[n + 1:n + m + 1])
+        self._energy_sum[n + 1:n + m + 1] += self._energy_sum[n]
+        positive = gated >= -1e-10
+        changes = np.empty(m)
+        changes[0] = self._last_positive is not None and positive[0] != self._last_positive
+        changes[1:] = positive[1:] != positive[:-1]
+        np.cumsum(changes, out=self._crossing_sum[n + 1:n + m + 1])
+        self._crossing_sum[n + 1:n + m + 1] += self._crossing_sum[n]
+        self._last_positive = positive[-1]
+        self._n = n + m
+
+        # Frames ending at or before the last gated sample no longer change
+        done = max(0, (self._n + self.pad - self.frame) // self.hop + 1)
+        if done > self._frames_done:
+            rms, zcr = self._frames(self._frames_done, done)
+            self._rms_total += float(rms.sum())
+            self._zcr_total += float(zcr.sum())
+            self._frames_done = done
+
+    def _frames(self, k_from, k_to):
+        # Same frame arithmetic as extract_features, for frames [k_from, k_to)
+        n = self._n
+        starts = np.arange(k_from, k_to) * self.hop - self.pad
+        lo = np.clip(starts, 0, n)
+        hi = np.clip(starts + self.frame, 0, n)
+        lo_cross = np.clip(starts + 1, 0, n)
+        rms = np.sqrt((self._energy_sum[hi] - self._energy_sum[lo]) / self.frame)
+        zcr = (self._crossing_sum[hi] - self._crossing_sum[lo_cross]) / self.frame
+        return rms, zcr
+
+    def scores(self):
+        """
+        (energy, pitch) of the audio so far.
+        """
+        if self._n == 0:
+            return 0.0, 0.0
+        n_frames = 1 + (self._n + 2 * self.pad - self.frame) // self.hop
+        rms, zcr = self._frames(self._frames_done, n_frames)
+        energy = (self._rms_total + float(rms.sum())) / n_frames
+        pitch = (self._zcr_total + float(zcr.sum())) / n_frames * self.frame / REFERENCE_FRAME
+        return energy, pitch
@@ -0,0 +1,86 @@
+import threading
+
+import numpy as np
+
+import stt
+import voice_features
+
+MAX_STREAM_SECONDS = 15
+
+
+class VoiceStream:
+    """
+    One voice answer uploaded in chunks of 16-bit little-endian mono PCM.
+
+    Each chunk feeds the voice activity detector and updates running
+    energy/pitch scores that match the final answer's extractor, giving a
+    provisional emotion while the user speaks. As soon as the detector hears
+    the end of the utterance, speech recognition starts in the background
+    on the audio so far and the stream stops growing: later chunks are
+    ignored, so finishing reuses that transcript instead of starting over.
+    """
+
+    def __init__(self, rate, max_seconds=MAX_STREAM_SECONDS):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.analyzer = voice_features.StreamingVoiceAnalyzer(rate)
+        self.features = voice_features.RunningFeatures(rate)
+        # Grown as audio arrives (up to max_seconds), so an idle stream costs nothing
+        self.max_samples = int(rate * max_seconds)
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._length = 0
+        self._odd_byte = b""
+        self._pending_text = None
+        self._result = None
+
+    def push_pcm16(self, data):
+        """
+        Adds a chunk of raw PCM bytes and returns the provisional result.
+        """
+        with self.lock:
+            if self._pending_text is not None:
+                # Speech recognition already has the utterance: the tail is dropped
+                return self._result
+            data = self._odd_byte + data
+            usable = len(data) - len(data) % 2
+            self._odd_byte = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype='<i2').astype(np.float32) / 32768
+
+            samples = samples[:self.max_samples - self._length]
+            self._reserve(self._length + samples.size)
+            self._buffer[self._length:self._length + samples.size] = samples
+            self._length += samples.size
+
+            ended = self.analyzer.push(samples) or self._length == self.max_samples
+            if ended:
+                self._pending_text = stt.start(stt.audio_data_from_samples(self.samples(), self.rate))
+
+            energy, pitch = self.features.update(self.samples(), samples.size)
+            self._result = {
+                "provisional_emotion": voice_features.label_voice(energy, pitch),
+                "energy_score": energy,
+                "pitch_score": pitch,
+                "speech_ended": ended,
+                "seconds": self._length / self.rate
+            }
+            return self._result
+
+    def _reserve(self, size):
+        # Caller holds self.lock. Doubles the buffer, starting at one second.
+        if size <= self._buffer.size:
+            return
+        grown = np.zeros(min(self.max_samples, max(size, 2 * self._buffer.size, self.rate)),
+                         dtype=np.float32)
+        grown[:self._length] = self._buffer[:self._length]
+        self._buffer = grown
+
+    def samples(self):
+        return self._buffer[:self._length]
+
+    def pending_text(self):
+        """
+        Returns the speech recognition started at end of speech, which covers
+        all the audio kept, or None if the speaker never stopped.
+        """
+        with self.lock:
+            return self._pending_text